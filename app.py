@@ -9,8 +9,10 @@ import re
 import base64
 from fuzzywuzzy import fuzz
 
-# Импортируем новый модуль распознавания маркетплейсов
-import marketplace_detection
+# Реестр маркетплейсов (названия, цвета и иконки для отображения)
+from marketplace_signatures import MARKETPLACES
+from mapping_store import MappingStore
+from parse_cache import ParseCache, file_fingerprint, make_cache_key
 
 # Функция для конвертации изображения в base64
 def get_image_base64(image_path):
@@ -19,13 +21,15 @@ def get_image_base64(image_path):
         return base64.b64encode(img_file.read()).decode('utf-8')
 from utils import (
     load_excel_file, 
+    read_workbook_table,
     save_excel_file, 
     map_columns_automatically, 
     transfer_data_between_tables,
     preview_data,
-    find_header_row,
+    detect_marketplace_by_columns,
     detect_marketplace_template,
-    find_best_marketplace_sheet
+    marketplace_by_sheet_name,
+    probe_workbook
 )
 
 # Настройка страницы
@@ -35,6 +39,63 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def get_parse_cache():
+    """Общий для всех сессий кеш разобранных книг (каталог для выгрузки на диск задается PARSE_CACHE_DIR)"""
+    return ParseCache(max_entries=32, spill_dir=os.environ.get("PARSE_CACHE_DIR"))
+
+@st.cache_resource
+def get_mapping_store():
+    """Общее для всех сессий хранилище подтвержденных сопоставлений колонок (путь к базе задается MAPPING_STORE_PATH)"""
+    return MappingStore(os.environ.get("MAPPING_STORE_PATH", "mapping_store.sqlite3"))
+
+def get_sheet_table(side, workbook, sheet_name, header_row):
+    """
+    Возвращает разобранную таблицу листа из кеша или читает её и сохраняет в кеш.
+    
+    Args:
+        side: 'source' или 'target'
+        workbook: Рабочая книга
+        sheet_name: Имя листа
+        header_row: Номер строки с заголовками
+        
+    Returns:
+        dict: Запись кеша с ключами sheet_name, header_row, headers, data, marketplace, confidence
+    """
+    parse_cache = get_parse_cache()
+    cache_key = make_cache_key(
+        st.session_state[f"{side}_file_hash"],
+        kind="table",
+        side=side,
+        sheet_name=sheet_name,
+        header_row=header_row
+    )
+    entry = parse_cache.get(cache_key)
+    if entry is None:
+        headers, df = read_workbook_table(workbook, sheet_name, header_row)
+        marketplace, confidence = detect_marketplace_template(headers)
+        entry = {
+            'sheet_name': sheet_name,
+            'header_row': header_row,
+            'headers': headers,
+            'data': df,
+            'marketplace': marketplace,
+            'confidence': confidence
+        }
+        parse_cache.put(cache_key, entry)
+    
+    # Если расположение таблицы только что определено для нового файла, запоминаем его
+    layout_key = st.session_state.get(f"{side}_layout_key")
+    if layout_key:
+        parse_cache.put(layout_key, {
+            'sheet_name': sheet_name,
+            'header_row': header_row,
+            'marketplace': st.session_state.get(f"{side}_marketplace")
+        })
+        st.session_state[f"{side}_layout_key"] = None
+    
+    return entry
+
 # Инициализация состояний сессии
 if 'source_file' not in st.session_state:
     st.session_state.source_file = None
@@ -50,6 +111,8 @@ if 'target_columns' not in st.session_state:
     st.session_state.target_columns = None
 if 'column_mapping' not in st.session_state:
     st.session_state.column_mapping = {}
+if 'column_mapping_scores' not in st.session_state:
+    st.session_state.column_mapping_scores = {}
 if 'mapping_complete' not in st.session_state:
     st.session_state.mapping_complete = False
 if 'transfer_complete' not in st.session_state:
@@ -74,6 +137,10 @@ if 'source_header_row' not in st.session_state:
     st.session_state.source_header_row = 1
 if 'target_header_row' not in st.session_state:
     st.session_state.target_header_row = 1
+if 'source_file_hash' not in st.session_state:
+    st.session_state.source_file_hash = None
+if 'target_file_hash' not in st.session_state:
+    st.session_state.target_file_hash = None
 
 # Заголовок и описание
 st.title("🔄 Маппинг таблиц маркетплейсов")
@@ -105,143 +172,33 @@ with col1:
     if source_file is not None and source_file != st.session_state.source_file:
         st.session_state.source_file = source_file
         try:
-            source_workbook, source_sheets = load_excel_file(source_file)
+            # Ключ кеша строится по содержимому файла: повторная загрузка того же файла не требует разбора
+            st.session_state.source_file_hash = file_fingerprint(source_file.getvalue())
+            source_layout_key = make_cache_key(st.session_state.source_file_hash, kind="layout", side="source")
+            cached_layout = get_parse_cache().get(source_layout_key)
+            st.session_state.source_layout_key = None if cached_layout else source_layout_key
+            
+            # Исходный файл только читается: загружаем оглавление книги, а листы разбираются
+            # только при обращении к ним собственным потоковым парсером XML (без объектов ячеек openpyxl)
+            source_workbook, source_sheets = load_excel_file(source_file, engine='xml')
             st.session_state.source_workbook = source_workbook
             st.session_state.source_sheets = source_sheets
             
-            if len(source_sheets) > 0:
-                # По умолчанию используем первый лист
-                selected_sheet = source_sheets[0]
-                header_row = 1
-                
-                # Маркетплейсы и характерные для них листы и строки заголовков
-                marketplace_config = {
-                    'ozon': {
-                        'sheet_patterns': ['шаблон', 'template', 'озон', 'ozon'],
-                        'header_row': 2
-                    },
-                    'wildberries': {
-                        'sheet_patterns': ['товары', 'вб', 'wb', 'wildberries'],
-                        'header_row': 3
-                    },
-                    'lemanpro': {
-                        'sheet_patterns': ['леман', 'атем', 'leman', 'atem'],
-                        'header_row': 4
-                    },
-                    'yandex': {
-                        'sheet_patterns': ['данные о товарах', 'яндекс', 'маркет', 'яндекс маркет', 'yandex'],
-                        'header_row': 2
-                    }
-                }
-                
-                # Шаг 1: Ищем подходящий лист по имени
-                sheet_found = False
-                
-                # Специальная проверка для ЛеманПро по имени файла
-                source_filename = getattr(source_file, 'name', '')
-                if source_filename:
-                    # Для ЛеманПро проверяем соответствие имени файла и названия листа
-                    file_base_name = os.path.splitext(os.path.basename(source_filename))[0]
-                    
-                    for sheet_name in source_sheets:
-                        # Ищем лист, в названии которого есть "шаблон" и имя файла
-                        # или характерные для ЛеманПро имена
-                        if ("шаблон" in sheet_name.lower() and file_base_name.lower() in sheet_name.lower()) or \
-                           any(pattern in sheet_name.lower() for pattern in ["атем", "atem", "леман"]):
-                            selected_sheet = sheet_name
-                            header_row = 4  # Для ЛеманПро характерна 4-я строка заголовков
-                            marketplace_type = 'lemanpro'
-                            sheet_found = True
-                            break
-                
-                # Если не нашли ЛеманПро, ищем другие маркетплейсы
-                if not sheet_found:
-                    for sheet_name in source_sheets:
-                        sheet_lower = sheet_name.lower()
-                        for marketplace, config in marketplace_config.items():
-                            if any(pattern in sheet_lower for pattern in config['sheet_patterns']):
-                                selected_sheet = sheet_name
-                                header_row = config['header_row']
-                                marketplace_type = marketplace
-                                sheet_found = True
-                                break
-                        if sheet_found:
-                            break
-                
-                # Устанавливаем лист и строку заголовков
-                st.session_state.source_sheet_name = selected_sheet
-                st.session_state.source_header_row = header_row
-                
-                # Шаг 2: Получаем заголовки из выбранного листа
-                sheet = source_workbook[selected_sheet]
-                if sheet.max_row >= header_row:
-                    # Собираем заголовки
-                    headers = []
-                    for cell in sheet[header_row]:
-                        if cell.value is not None and str(cell.value).strip() != "":
-                            headers.append(str(cell.value))
-                    
-                    # Шаг 3: Определяем маркетплейс по заголовкам с учетом строки и первых 5 колонок
-                    if headers:
-                        # Используем новый модуль распознавания для более точного определения
-                        normalized_columns = [str(h).lower().strip() for h in headers]
-                        marketplace_type, confidence, details = marketplace_detection.detect_marketplace_by_row_headers(
-                            normalized_columns, 
-                            st.session_state.source_header_row
-                        )
-                        
-                        # Проверяем, есть ли в названии листа "Данные" для "Все инструменты"
-                        sheet_name_lower = selected_sheet.lower()
-                        if 'данные' in sheet_name_lower and st.session_state.source_header_row == 2:
-                            # Проверяем на шаблон Все инструменты
-                            has_guid = any('guid*' in col.lower() for col in normalized_columns[:5])
-                            if has_guid and 'код тн вэд' in ' '.join(normalized_columns[:5]).lower():
-                                marketplace_type = 'vseinstrumenty'
-                                confidence = 95.0
-                                st.write("⚠️ DEBUG: Обнаружен шаблон Все инструменты по GUID* и коду ТН ВЭД")
-                        
-                        if marketplace_type != 'other' and confidence > 80:
-                            st.session_state.source_marketplace = marketplace_type
-                            # Выводим детали распознавания для отладки
-                            st.markdown(f"<div style='font-size: 0.7rem; color: #aaa;'>DEBUG: {marketplace_type} (уверенность: {confidence:.1f}%)</div>", unsafe_allow_html=True)
-                            
-                            # Установка правильной строки заголовков по типу маркетплейса
-                            if marketplace_type == 'ozon' and st.session_state.source_header_row != 2:
-                                st.write(f"⚠️ DEBUG: Обнаружен Ozon, устанавливаем строку заголовков на 2")
-                                st.session_state.source_header_row = 2
-                                if "ozon_header_adjusted" not in st.session_state:
-                                    st.session_state.ozon_header_adjusted = True
-                                    st.rerun()
-                            elif marketplace_type == 'wildberries' and st.session_state.source_header_row != 3:
-                                st.write(f"⚠️ DEBUG: Обнаружен Wildberries, устанавливаем строку заголовков на 3")
-                                st.session_state.source_header_row = 3
-                                if "wb_header_adjusted" not in st.session_state:
-                                    st.session_state.wb_header_adjusted = True
-                                    st.rerun()
-                            elif marketplace_type == 'lemanpro' and st.session_state.source_header_row != 4:
-                                st.write(f"⚠️ DEBUG: Обнаружен ЛеманПро, устанавливаем строку заголовков на 4")
-                                st.session_state.source_header_row = 4
-                                if "lemanpro_header_adjusted" not in st.session_state:
-                                    st.session_state.lemanpro_header_adjusted = True
-                                    st.rerun()
-                            # Если у нас Яндекс.Маркет, нужна специальная обработка для определения, в какой строке заголовки (2 или 4)
-                            elif marketplace_type == 'yandex':
-                                # Проверим, есть ли заголовки в 4-й строке для Яндекс.Маркет
-                                sheet = source_workbook[selected_sheet]
-                                yandex_header_row = 2  # По умолчанию строка 2
-                                
-                                if sheet.max_row >= 4:
-                                    row_values_4 = [str(cell.value).strip().lower() if cell.value else '' for cell in sheet[4]]
-                                    if any('ваш sku' in val for val in row_values_4) or any('качество карточки' in val for val in row_values_4):
-                                        yandex_header_row = 4
-                                
-                                # Проверяем, нужно ли корректировать строку заголовков
-                                if st.session_state.source_header_row != yandex_header_row:
-                                    st.write(f"⚠️ DEBUG: Обнаружен Яндекс.Маркет с заголовками в строке {yandex_header_row}, корректируем")
-                                    st.session_state.source_header_row = yandex_header_row
-                                    if "yandex_header_adjusted" not in st.session_state:
-                                        st.session_state.yandex_header_adjusted = True
-                                        st.rerun()
+            if cached_layout is not None and cached_layout['sheet_name'] in source_sheets:
+                # Расположение таблицы уже определено при предыдущей загрузке этого файла
+                st.session_state.source_sheet_name = cached_layout['sheet_name']
+                st.session_state.source_header_row = cached_layout['header_row']
+                if cached_layout['marketplace']:
+                    st.session_state.source_marketplace = cached_layout['marketplace']
+            elif len(source_sheets) > 0:
+                # Лист, строка заголовков и маркетплейс определяются по верхним строкам листов до разбора листа,
+                # поэтому таблица строится один раз и сразу с правильной строкой заголовков
+                layout = probe_workbook(source_workbook, file_name=getattr(source_file, 'name', None))
+                st.session_state.source_sheet_name = layout['sheet_name']
+                st.session_state.source_header_row = layout['header_row']
+                if layout['marketplace'] != 'other' and layout['confidence'] > 80:
+                    st.session_state.source_marketplace = layout['marketplace']
+                    st.markdown(f"<div style='font-size: 0.7rem; color: #aaa;'>DEBUG: {layout['marketplace']} (уверенность: {layout['confidence']:.1f}%), лист «{layout['sheet_name']}», строка заголовков {layout['header_row']}</div>", unsafe_allow_html=True)
             else:
                 st.error("В исходном файле не найдено листов!")
                 st.session_state.source_data = None
@@ -277,44 +234,15 @@ with col1:
             st.session_state.transfer_complete = False
         
         try:
-            sheet = st.session_state.source_workbook[st.session_state.source_sheet_name]
-            # Определяем заголовки колонок (используем выбранную пользователем строку)
-            header_row = st.session_state.source_header_row
-            headers = []
-            column_indices = []
-            
-            # Собираем заголовки и их индексы
-            for i, cell in enumerate(sheet[header_row]):
-                if cell.value is not None and str(cell.value).strip() != "":
-                    headers.append(str(cell.value))
-                    column_indices.append(i)
-                
-            # Проверяем на дубликаты и исправляем
-            unique_headers = {}
-            for i, header in enumerate(headers):
-                if header in unique_headers:
-                    # Если заголовок уже существует, добавляем суффикс
-                    counter = 1
-                    new_header = f"{header}_{counter}"
-                    while new_header in unique_headers:
-                        counter += 1
-                        new_header = f"{header}_{counter}"
-                    headers[i] = new_header
-                unique_headers[headers[i]] = True
-                
-            # Читаем данные начиная со следующей строки после заголовка
-            data = []
-            for row in sheet.iter_rows(min_row=header_row + 1, values_only=True):
-                if any(cell is not None for cell in row):
-                    # Берем только данные из столбцов с заголовками
-                    row_data = [row[idx] for idx in column_indices]
-                    data.append(row_data)
-            
-            # Создаем DataFrame только с непустыми заголовками
-            df = pd.DataFrame(data, columns=headers)
-            
-            # Преобразуем все данные в строки для избежания ошибок конвертации
-            df = df.astype(str)
+            # Разбираем выбранный лист (или берем готовый результат из кеша)
+            table = get_sheet_table(
+                "source",
+                st.session_state.source_workbook,
+                st.session_state.source_sheet_name,
+                st.session_state.source_header_row
+            )
+            headers = table['headers']
+            df = table['data']
             
             st.session_state.source_data = df
             st.session_state.source_columns = headers
@@ -325,175 +253,19 @@ with col1:
             
             # Определяем и отображаем маркетплейс
             if st.session_state.source_columns:
-                # Проверяем на ЛеманПро по содержимому
-                lemanpro_detected = False
+                # Определяем маркетплейс по заголовкам с учетом строки заголовков и имени листа
+                marketplace, confidence = detect_marketplace_by_columns(
+                    st.session_state.source_columns,
+                    st.session_state.source_header_row,
+                    st.session_state.source_sheet_name
+                )
                 
-                # Особая логика для первой строки: проверка на наличие GUID в первых строках данных
-                if st.session_state.source_header_row == 1:
-                    # Отладочное сообщение
-                    st.write(f"⚠️ DEBUG: Проверяем строку 1 на ЛеманПро")
-                    
-                    # Проверяем, есть ли в данных строки с текстом "GUID"
-                    if st.session_state.source_data is not None and not st.session_state.source_data.empty:
-                        first_rows = st.session_state.source_data.head(5).astype(str)
-                        # Отладочное сообщение - просмотр первых строк
-                        st.write(f"⚠️ DEBUG: Первые строки данных: {first_rows.values.tolist()}")
-                        
-                        for _, row in first_rows.iterrows():
-                            row_text = " ".join(row.values).lower()
-                            # Отладочное сообщение
-                            st.write(f"⚠️ DEBUG: Проверяем текст: {row_text[:50]}...")
-                            
-                            if "guid" in row_text or "идентификатор из 1с" in row_text:
-                                lemanpro_detected = True
-                                marketplace = "lemanpro"
-                                confidence = 95.0
-                                st.write(f"⚠️ DEBUG: Обнаружен ЛеманПро по GUID!")
-                                # Устанавливаем строку заголовков на 4 и делаем rerun для обновления UI
-                                st.session_state.source_header_row = 4
-                                st.write(f"⚠️ DEBUG: Устанавливаем строку заголовков ЛеманПро на 4")
-                                # Добавляем флаг для предотвращения бесконечного цикла
-                                if "lemanpro_header_adjusted" not in st.session_state:
-                                    st.session_state.lemanpro_header_adjusted = True
-                                    st.rerun()
-                                break
-                                
-                # Если строка заголовка равна 4, это может быть ЛеманПро или Яндекс.Маркет
-                elif st.session_state.source_header_row == 4:
-                    # Убираем отладочные сообщения
-                    
-                    # Эталонные заголовки Яндекс.Маркет
-                    yandex_reference_headers = [
-                        'ваш sku *', 'качество карточки', 'рекомендации по заполнению',
-                        'название товара *', 'ссылка на изображение', 'название группы вариантов', 
-                        'штрихкод *', 'тип уценки', 'внешний вид товара', 'описание состояния товара',
-                        'вес, кг'
-                    ]
-                    
-                    # Эталонные заголовки ЛеманПро
-                    lemanpro_reference_headers = [
-                        'guid', 'код тн вэд', 'наименование товара мерчанта', 
-                        'бренд товара', 'изготовитель', 'вес упаковки, кг', 
-                        'габариты упаковки, см'
-                    ]
-                    
-                    # Нормализуем колонки для сравнения
-                    normalized_columns = [str(col).lower() for col in st.session_state.source_columns]
-                    
-                    # Подсчитываем количество совпадений с эталонными заголовками
-                    yandex_matches = sum(1 for header in yandex_reference_headers if any(header.lower() in col for col in normalized_columns))
-                    lemanpro_matches = sum(1 for header in lemanpro_reference_headers if any(header.lower() in col for col in normalized_columns))
-                    
-                    # Определяем тип маркетплейса на основе количества совпадений
-                    if lemanpro_matches >= 2 or any('guid' in col for col in normalized_columns):
-                        lemanpro_detected = True
-                        marketplace = "lemanpro"
-                        confidence = 95.0
-                    elif yandex_matches >= 2:
-                        marketplace = "yandex"
-                        confidence = 95.0
-                # Если строка заголовка равна 2, это может быть Ozon или Яндекс.Маркет
-                elif st.session_state.source_header_row == 2:
-                    # Проверяем наличие характерных заголовков Ozon и Яндекс.Маркета
-                    ozon_indicators = ['название товара*', 'ссылка на главное фото*', 'артикул*', 'бренд*', 'ндс, %*', 'цена, руб.*', 'обязательное поле']
-                    yandex_indicators = ['ваш sku *', 'качество карточки', 'фид', 'товар', 'цена']
-                    
-                    normalized_columns = [str(col).lower() for col in st.session_state.source_columns]
-                    normalized_text = ' '.join(normalized_columns)
-                    
-                    # Проверяем название листа - Ozon часто использует именно "Шаблон"
-                    is_ozon_sheet = False
-                    if hasattr(st.session_state, 'source_sheet_name') and "шаблон" in str(st.session_state.source_sheet_name).lower():
-                        is_ozon_sheet = True
-                    
-                    # Проверяем название листа для Яндекс.Маркет
-                    is_yandex_sheet = False
-                    if hasattr(st.session_state, 'source_sheet_name'):
-                        is_yandex_sheet = "данные о товар" in str(st.session_state.source_sheet_name).lower()
-                    
-                    # ПРИНУДИТЕЛЬНАЯ ПРОВЕРКА НА OZON ПО ОБЯЗАТЕЛЬНЫМ ПРИЗНАКАМ
-                    is_definitely_ozon = (
-                        any('обязательное поле' in col for col in normalized_columns) or
-                        any('цена, руб*' in col for col in normalized_columns) or
-                        any('название товара*' in col for col in normalized_columns) or
-                        any('ссылка на главное фото*' in col for col in normalized_columns) or
-                        any('ссылки на дополнительные фото' in col for col in normalized_columns)
-                    )
-                    
-                    # Проверка наличия звездочек (специфично для Ozon)
-                    asterisk_count = sum(1 for col in normalized_columns if '*' in col)
-                    
-                    # Счетчики для каждого маркетплейса
-                    found_ozon = 0
-                    found_yandex = 0
-                    
-                    for col in normalized_columns:
-                        # Проверка Ozon
-                        for indicator in ozon_indicators:
-                            if indicator in col:
-                                found_ozon += 1
-                                break
-                                
-                        # Проверка Яндекс.Маркет
-                        for indicator in yandex_indicators:
-                            if indicator in col:
-                                found_yandex += 1
-                                break
-                    
-                    # Особые признаки Ozon
-                    has_ozon_links = any('ссылка на' in col for col in normalized_columns)
-                    has_ozon_price = any('цена, руб' in col for col in normalized_columns)
-                    
-                    # Особые признаки Яндекс.Маркет
-                    has_yandex_sku = any('ваш sku' in col for col in normalized_columns)
-                    has_quality = any('качество карточки' in col for col in normalized_columns)
-                    
-                    # Проверка на конкретные признаки Яндекс.Маркет
-                    is_yandex_pattern = (
-                        ("ваш sku" in normalized_text and "качество карточки" in normalized_text) or
-                        ("ваш sku *" in normalized_text) or
-                        (any('param_ids' in col for col in normalized_columns) and any('param_names' in col for col in normalized_columns))
-                    )
-                    
-                    # Определение маркетплейса на основе найденных признаков
-                    if is_definitely_ozon or (found_ozon >= 2) or (is_ozon_sheet and found_ozon >= 1) or (asterisk_count >= 3 and has_ozon_links):
-                        marketplace = "ozon"
-                        confidence = 95.0
-                    elif is_yandex_pattern or (found_yandex >= 1) or (is_yandex_sheet) or has_yandex_sku or has_quality:
-                        marketplace = "yandex"
-                        confidence = 95.0
-                    else:
-                        # Если не смогли определить по признакам, используем стандартную функцию
-                        marketplace, confidence = detect_marketplace_template(st.session_state.source_columns)
-                else:
-                    marketplace, confidence = detect_marketplace_template(st.session_state.source_columns)
-                    
                 if marketplace != 'other':
-                    if marketplace == 'wildberries':
-                        mp_name = "Wildberries"
-                        mp_color = "purple"
-                        marketplace_icon = "attached_assets/wildberries.png"
-                    elif marketplace == 'ozon':
-                        mp_name = "Ozon"
-                        mp_color = "blue"
-                        marketplace_icon = "attached_assets/ozon.png"
-                    elif marketplace == 'lemanpro':
-                        mp_name = "ЛеманПро"
-                        mp_color = "green"
-                        marketplace_icon = "attached_assets/Лемана про.png"
-                    elif marketplace == 'yandex':
-                        mp_name = "Яндекс.Маркет"
-                        mp_color = "orange"
-                        marketplace_icon = "attached_assets/Яндекс маркет.png"
-                    else:
-                        mp_name = marketplace.capitalize()
-                        mp_color = "gray"
-                        marketplace_icon = "attached_assets/xlsx.png"
-                        # Проверяем другие возможные маркетплейсы
-                        if "сбер" in marketplace.lower():
-                            marketplace_icon = "attached_assets/сбермегамаркет.png"
-                        elif "инструмент" in marketplace.lower():
-                            marketplace_icon = "attached_assets/все инструменты.png"
+                    # Название, цвет и иконка берутся из реестра маркетплейсов
+                    mp_info = MARKETPLACES.get(marketplace, {})
+                    mp_name = mp_info.get('title', marketplace.capitalize())
+                    mp_color = mp_info.get('color', "gray")
+                    marketplace_icon = mp_info.get('icon', "attached_assets/xlsx.png")
                     
                     st.caption(f'<span style="display: inline-block;"><img src="data:image/png;base64,{get_image_base64(marketplace_icon)}" width="20" style="margin-right:5px"></span> Распознан шаблон: <span style="color:{mp_color};font-weight:bold;">{mp_name}</span> (уверенность: {confidence:.1f}%)', unsafe_allow_html=True)
             
@@ -521,143 +293,31 @@ with col2:
     if target_file is not None and target_file != st.session_state.target_file:
         st.session_state.target_file = target_file
         try:
+            # Ключ кеша строится по содержимому файла: повторная загрузка того же файла не требует разбора
+            st.session_state.target_file_hash = file_fingerprint(target_file.getvalue())
+            target_layout_key = make_cache_key(st.session_state.target_file_hash, kind="layout", side="target")
+            cached_layout = get_parse_cache().get(target_layout_key)
+            st.session_state.target_layout_key = None if cached_layout else target_layout_key
+            
             target_workbook, target_sheets = load_excel_file(target_file)
             st.session_state.target_workbook = target_workbook
             st.session_state.target_sheets = target_sheets
             
-            if len(target_sheets) > 0:
-                # По умолчанию используем первый лист
-                selected_sheet = target_sheets[0]
-                header_row = 1
-                
-                # Маркетплейсы и характерные для них листы и строки заголовков
-                marketplace_config = {
-                    'ozon': {
-                        'sheet_patterns': ['шаблон', 'template', 'озон', 'ozon'],
-                        'header_row': 2
-                    },
-                    'wildberries': {
-                        'sheet_patterns': ['товары', 'вб', 'wb', 'wildberries'],
-                        'header_row': 3
-                    },
-                    'lemanpro': {
-                        'sheet_patterns': ['леман', 'атем', 'leman', 'atem'],
-                        'header_row': 4
-                    },
-                    'yandex': {
-                        'sheet_patterns': ['данные о товарах', 'яндекс', 'маркет', 'яндекс маркет', 'yandex'],
-                        'header_row': 2
-                    }
-                }
-                
-                # Шаг 1: Ищем подходящий лист по имени
-                sheet_found = False
-                
-                # Специальная проверка для ЛеманПро по имени файла
-                target_filename = getattr(target_file, 'name', '')
-                if target_filename:
-                    # Для ЛеманПро проверяем соответствие имени файла и названия листа
-                    file_base_name = os.path.splitext(os.path.basename(target_filename))[0]
-                    
-                    for sheet_name in target_sheets:
-                        # Ищем лист, в названии которого есть "шаблон" и имя файла
-                        # или характерные для ЛеманПро имена
-                        if ("шаблон" in sheet_name.lower() and file_base_name.lower() in sheet_name.lower()) or \
-                           any(pattern in sheet_name.lower() for pattern in ["атем", "atem", "леман"]):
-                            selected_sheet = sheet_name
-                            header_row = 4  # Для ЛеманПро характерна 4-я строка заголовков
-                            marketplace_type = 'lemanpro'
-                            sheet_found = True
-                            break
-                
-                # Если не нашли ЛеманПро, ищем другие маркетплейсы
-                if not sheet_found:
-                    for sheet_name in target_sheets:
-                        sheet_lower = sheet_name.lower()
-                        for marketplace, config in marketplace_config.items():
-                            if any(pattern in sheet_lower for pattern in config['sheet_patterns']):
-                                selected_sheet = sheet_name
-                                header_row = config['header_row']
-                                marketplace_type = marketplace
-                                sheet_found = True
-                                break
-                        if sheet_found:
-                            break
-                
-                # Устанавливаем лист и строку заголовков
-                st.session_state.target_sheet_name = selected_sheet
-                st.session_state.target_header_row = header_row
-                
-                # Шаг 2: Получаем заголовки из выбранного листа
-                sheet = target_workbook[selected_sheet]
-                if sheet.max_row >= header_row:
-                    # Собираем заголовки
-                    headers = []
-                    for cell in sheet[header_row]:
-                        if cell.value is not None and str(cell.value).strip() != "":
-                            headers.append(str(cell.value))
-                    
-                    # Шаг 3: Определяем маркетплейс по заголовкам с учетом строки и первых 5 колонок
-                    if headers:
-                        # Используем новый модуль распознавания для более точного определения
-                        normalized_columns = [str(h).lower().strip() for h in headers]
-                        marketplace_type, confidence, details = marketplace_detection.detect_marketplace_by_row_headers(
-                            normalized_columns, 
-                            st.session_state.target_header_row
-                        )
-                        
-                        # Проверяем, есть ли в названии листа "Данные" для "Все инструменты"
-                        sheet_name_lower = selected_sheet.lower()
-                        if 'данные' in sheet_name_lower and st.session_state.target_header_row == 2:
-                            # Проверяем на шаблон Все инструменты
-                            has_guid = any('guid*' in col.lower() for col in normalized_columns[:5])
-                            if has_guid and 'код тн вэд' in ' '.join(normalized_columns[:5]).lower():
-                                marketplace_type = 'vseinstrumenty'
-                                confidence = 95.0
-                                st.write("⚠️ DEBUG: Обнаружен шаблон Все инструменты (целевой) по GUID* и коду ТН ВЭД")
-                        
-                        if marketplace_type != 'other' and confidence > 80:
-                            st.session_state.target_marketplace = marketplace_type
-                            # Выводим детали распознавания для отладки
-                            st.markdown(f"<div style='font-size: 0.7rem; color: #aaa;'>DEBUG: {marketplace_type} (уверенность: {confidence:.1f}%)</div>", unsafe_allow_html=True)
-                            
-                            # Установка правильной строки заголовков по типу маркетплейса для целевого файла
-                            if marketplace_type == 'ozon' and st.session_state.target_header_row != 2:
-                                st.write(f"⚠️ DEBUG: Обнаружен Ozon, устанавливаем строку заголовков целевого файла на 2")
-                                st.session_state.target_header_row = 2
-                                if "target_ozon_header_adjusted" not in st.session_state:
-                                    st.session_state.target_ozon_header_adjusted = True
-                                    st.rerun()
-                            # Если у нас Яндекс.Маркет, нужна специальная обработка для определения, в какой строке заголовки (2 или 4)
-                            elif marketplace_type == 'yandex':
-                                # Проверим, есть ли заголовки в 4-й строке для Яндекс.Маркет
-                                sheet = target_workbook[selected_sheet]
-                                yandex_header_row = 2  # По умолчанию строка 2
-                                
-                                if sheet.max_row >= 4:
-                                    row_values_4 = [str(cell.value).strip().lower() if cell.value else '' for cell in sheet[4]]
-                                    if any('ваш sku' in val for val in row_values_4) or any('качество карточки' in val for val in row_values_4):
-                                        yandex_header_row = 4
-                                
-                                # Проверяем, нужно ли корректировать строку заголовков
-                                if st.session_state.target_header_row != yandex_header_row:
-                                    st.write(f"⚠️ DEBUG: Обнаружен Яндекс.Маркет с заголовками в строке {yandex_header_row}, корректируем")
-                                    st.session_state.target_header_row = yandex_header_row
-                                    if "target_yandex_header_adjusted" not in st.session_state:
-                                        st.session_state.target_yandex_header_adjusted = True
-                                        st.rerun()
-                            elif marketplace_type == 'wildberries' and st.session_state.target_header_row != 3:
-                                st.write(f"⚠️ DEBUG: Обнаружен Wildberries, устанавливаем строку заголовков целевого файла на 3")
-                                st.session_state.target_header_row = 3
-                                if "target_wb_header_adjusted" not in st.session_state:
-                                    st.session_state.target_wb_header_adjusted = True
-                                    st.rerun()
-                            elif marketplace_type == 'lemanpro' and st.session_state.target_header_row != 4:
-                                st.write(f"⚠️ DEBUG: Обнаружен ЛеманПро, устанавливаем строку заголовков целевого файла на 4")
-                                st.session_state.target_header_row = 4
-                                if "target_lemanpro_header_adjusted" not in st.session_state:
-                                    st.session_state.target_lemanpro_header_adjusted = True
-                                    st.rerun()
+            if cached_layout is not None and cached_layout['sheet_name'] in target_sheets:
+                # Расположение таблицы уже определено при предыдущей загрузке этого файла
+                st.session_state.target_sheet_name = cached_layout['sheet_name']
+                st.session_state.target_header_row = cached_layout['header_row']
+                if cached_layout['marketplace']:
+                    st.session_state.target_marketplace = cached_layout['marketplace']
+            elif len(target_sheets) > 0:
+                # Лист, строка заголовков и маркетплейс определяются по верхним строкам листов до разбора листа,
+                # поэтому таблица строится один раз и сразу с правильной строкой заголовков
+                layout = probe_workbook(io.BytesIO(target_file.getvalue()), file_name=getattr(target_file, 'name', None))
+                st.session_state.target_sheet_name = layout['sheet_name']
+                st.session_state.target_header_row = layout['header_row']
+                if layout['marketplace'] != 'other' and layout['confidence'] > 80:
+                    st.session_state.target_marketplace = layout['marketplace']
+                    st.markdown(f"<div style='font-size: 0.7rem; color: #aaa;'>DEBUG: {layout['marketplace']} (уверенность: {layout['confidence']:.1f}%), лист «{layout['sheet_name']}», строка заголовков {layout['header_row']}</div>", unsafe_allow_html=True)
             else:
                 st.error("В целевом файле не найдено листов!")
                 st.session_state.target_data = None
@@ -693,44 +353,15 @@ with col2:
             st.session_state.transfer_complete = False
         
         try:
-            sheet = st.session_state.target_workbook[st.session_state.target_sheet_name]
-            # Определяем заголовки колонок (используем выбранную пользователем строку)
-            header_row = st.session_state.target_header_row
-            headers = []
-            column_indices = []
-            
-            # Собираем заголовки и их индексы
-            for i, cell in enumerate(sheet[header_row]):
-                if cell.value is not None and str(cell.value).strip() != "":
-                    headers.append(str(cell.value))
-                    column_indices.append(i)
-                
-            # Проверяем на дубликаты и исправляем
-            unique_headers = {}
-            for i, header in enumerate(headers):
-                if header in unique_headers:
-                    # Если заголовок уже существует, добавляем суффикс
-                    counter = 1
-                    new_header = f"{header}_{counter}"
-                    while new_header in unique_headers:
-                        counter += 1
-                        new_header = f"{header}_{counter}"
-                    headers[i] = new_header
-                unique_headers[headers[i]] = True
-                
-            # Читаем данные начиная со следующей строки после заголовка
-            data = []
-            for row in sheet.iter_rows(min_row=header_row + 1, values_only=True):
-                if any(cell is not None for cell in row):
-                    # Берем только данные из столбцов с заголовками
-                    row_data = [row[idx] for idx in column_indices]
-                    data.append(row_data)
-            
-            # Создаем DataFrame только с непустыми заголовками
-            df = pd.DataFrame(data, columns=headers)
-            
-            # Преобразуем все данные в строки для избежания ошибок конвертации
-            df = df.astype(str)
+            # Разбираем выбранный лист (или берем готовый результат из кеша)
+            table = get_sheet_table(
+                "target",
+                st.session_state.target_workbook,
+                st.session_state.target_sheet_name,
+                st.session_state.target_header_row
+            )
+            headers = table['headers']
+            df = table['data']
             
             st.session_state.target_data = df
             st.session_state.target_columns = headers
@@ -741,193 +372,19 @@ with col2:
             
             # Определяем и отображаем маркетплейс
             if st.session_state.target_columns:
-                # Проверяем на ЛеманПро по содержимому
-                lemanpro_detected = False
-                
-                # Особая логика для первой строки: проверка на наличие GUID в первых строках данных
-                if st.session_state.target_header_row == 1:
-                    # Проверяем, есть ли в данных строки с текстом "GUID"
-                    if st.session_state.target_data is not None and not st.session_state.target_data.empty:
-                        first_rows = st.session_state.target_data.head(5).astype(str)
-                        for _, row in first_rows.iterrows():
-                            row_text = " ".join(row.values).lower()
-                            if "guid" in row_text or "идентификатор из 1с" in row_text:
-                                lemanpro_detected = True
-                                marketplace = "lemanpro"
-                                confidence = 95.0
-                                # Устанавливаем строку заголовков на 4 и делаем rerun для обновления UI
-                                st.session_state.target_header_row = 4
-                                # Добавляем флаг для предотвращения бесконечного цикла
-                                if "target_lemanpro_header_adjusted" not in st.session_state:
-                                    st.session_state.target_lemanpro_header_adjusted = True
-                                    st.rerun()
-                                break
-                                
-                # Если строка заголовка равна 4, это может быть ЛеманПро или Яндекс.Маркет
-                elif st.session_state.target_header_row == 4:
-                    normalized_columns = [str(col).lower() for col in st.session_state.target_columns]
-                    
-                    # Эталонные заголовки Яндекс.Маркет
-                    yandex_reference_headers = [
-                        'ваш sku *', 'качество карточки', 'рекомендации по заполнению',
-                        'название товара *', 'ссылка на изображение', 'название группы вариантов', 
-                        'штрихкод *', 'тип уценки', 'внешний вид товара', 'описание состояния товара',
-                        'вес, кг'
-                    ]
-                    
-                    # Эталонные заголовки ЛеманПро
-                    lemanpro_reference_headers = [
-                        'guid', 'код тн вэд', 'наименование товара мерчанта', 
-                        'бренд товара', 'изготовитель', 'вес упаковки, кг', 
-                        'габариты упаковки, см'
-                    ]
-                    
-                    # Подсчитываем количество совпадений с эталонными заголовками
-                    yandex_matches = sum(1 for header in yandex_reference_headers if any(header.lower() in col for col in normalized_columns))
-                    lemanpro_matches = sum(1 for header in lemanpro_reference_headers if any(header.lower() in col for col in normalized_columns))
-                    
-                    # Определяем тип маркетплейса на основе количества совпадений
-                    if lemanpro_matches >= 2 or any('guid' in col for col in normalized_columns):
-                        lemanpro_detected = True
-                        marketplace = "lemanpro"
-                        confidence = 95.0
-                    elif yandex_matches >= 2:
-                        marketplace = "yandex"
-                        confidence = 95.0
-                
-                # Если строка заголовка равна 2, это может быть Ozon или Яндекс.Маркет
-                elif st.session_state.target_header_row == 2:
-                    # Проверяем наличие характерных заголовков Ozon и Яндекс.Маркета
-                    ozon_indicators = ['название товара*', 'ссылка на главное фото*', 'артикул*', 'бренд*', 'ндс, %*', 'цена, руб.*', 'обязательное поле']
-                    yandex_indicators = ['ваш sku *', 'качество карточки', 'фид', 'товар', 'цена']
-                    
-                    normalized_columns = [str(col).lower() for col in st.session_state.target_columns]
-                    normalized_text = ' '.join(normalized_columns)
-                    
-                    # Проверяем название листа - Ozon часто использует именно "Шаблон"
-                    is_ozon_sheet = False
-                    if hasattr(st.session_state, 'target_sheet_name') and "шаблон" in str(st.session_state.target_sheet_name).lower():
-                        is_ozon_sheet = True
-                    
-                    # Проверяем название листа для Яндекс.Маркет
-                    is_yandex_sheet = False
-                    if hasattr(st.session_state, 'target_sheet_name'):
-                        is_yandex_sheet = "данные о товар" in str(st.session_state.target_sheet_name).lower()
-                    
-                    # ПРИНУДИТЕЛЬНАЯ ПРОВЕРКА НА OZON ПО ОБЯЗАТЕЛЬНЫМ ПРИЗНАКАМ
-                    is_definitely_ozon = (
-                        any('обязательное поле' in col for col in normalized_columns) or
-                        any('цена, руб*' in col for col in normalized_columns) or
-                        any('название товара*' in col for col in normalized_columns) or
-                        any('ссылка на главное фото*' in col for col in normalized_columns) or
-                        any('ссылки на дополнительные фото' in col for col in normalized_columns)
-                    )
-                    
-                    # Проверка наличия звездочек (специфично для Ozon)
-                    asterisk_count = sum(1 for col in normalized_columns if '*' in col)
-                    
-                    # Счетчики для каждого маркетплейса
-                    found_ozon = 0
-                    found_yandex = 0
-                    
-                    for col in normalized_columns:
-                        # Проверка Ozon
-                        for indicator in ozon_indicators:
-                            if indicator in col:
-                                found_ozon += 1
-                                break
-                                
-                        # Проверка Яндекс.Маркет
-                        for indicator in yandex_indicators:
-                            if indicator in col:
-                                found_yandex += 1
-                                break
-                    
-                    # Особые признаки Ozon
-                    has_ozon_links = any('ссылка на' in col for col in normalized_columns)
-                    has_ozon_price = any('цена, руб' in col for col in normalized_columns)
-                    
-                    # Особые признаки Яндекс.Маркет
-                    has_yandex_sku = any('ваш sku' in col for col in normalized_columns)
-                    has_quality = any('качество карточки' in col for col in normalized_columns)
-                    
-                    # Проверка на конкретные признаки Яндекс.Маркет
-                    is_yandex_pattern = (
-                        ("ваш sku" in normalized_text and "качество карточки" in normalized_text) or
-                        ("ваш sku *" in normalized_text) or
-                        (any('param_ids' in col for col in normalized_columns) and any('param_names' in col for col in normalized_columns))
-                    )
-                    
-                    # Определение маркетплейса на основе найденных признаков
-                    if is_definitely_ozon or (found_ozon >= 2) or (is_ozon_sheet and found_ozon >= 1) or (asterisk_count >= 3 and has_ozon_links):
-                        marketplace = "ozon"
-                        confidence = 95.0
-                    elif is_yandex_pattern or (found_yandex >= 1) or (is_yandex_sheet) or has_yandex_sku or has_quality:
-                        marketplace = "yandex"
-                        confidence = 95.0
-                    else:
-                        # Если не смогли определить по признакам, используем стандартную функцию
-                        marketplace, confidence = detect_marketplace_template(st.session_state.target_columns)
-                
-                # Если строка заголовка равна 3, вероятно это Wildberries
-                elif st.session_state.target_header_row == 3:
-                    # Проверяем наличие характерных для WB заголовков
-                    wb_indicators = ['артикул wb', 'баркод', 'номенклатура', 'номер номенклатуры', 'ставка ндс', 'предмет']
-                    normalized_columns = [str(col).lower() for col in st.session_state.target_columns]
-                    
-                    # Проверяем название листа для WB
-                    is_wb_sheet = False
-                    if hasattr(st.session_state, 'target_sheet_name'):
-                        is_wb_sheet = "товары" in str(st.session_state.target_sheet_name).lower()
-                    
-                    # Счетчик для WB
-                    found_wb = 0
-                    for col in normalized_columns:
-                        for indicator in wb_indicators:
-                            if indicator in col:
-                                found_wb += 1
-                                break
-                    
-                    # Уникальные признаки WB
-                    has_wb_features = any('артикул wb' in col for col in normalized_columns) or any('номенклатур' in col for col in normalized_columns)
-                    
-                    # Определяем маркетплейс
-                    if is_wb_sheet or found_wb >= 1 or has_wb_features:
-                        marketplace = "wildberries"
-                        confidence = 95.0
-                    else:
-                        marketplace, confidence = detect_marketplace_template(st.session_state.target_columns)
-                
-                # Если не было особых условий, используем стандартную функцию
-                else:
-                    marketplace, confidence = detect_marketplace_template(st.session_state.target_columns)
+                # Определяем маркетплейс по заголовкам с учетом строки заголовков и имени листа
+                marketplace, confidence = detect_marketplace_by_columns(
+                    st.session_state.target_columns,
+                    st.session_state.target_header_row,
+                    st.session_state.target_sheet_name
+                )
                 
                 if marketplace != 'other':
-                    if marketplace == 'wildberries':
-                        mp_name = "Wildberries"
-                        mp_color = "purple"
-                        marketplace_icon = "attached_assets/wildberries.png"
-                    elif marketplace == 'ozon':
-                        mp_name = "Ozon"
-                        mp_color = "blue"
-                        marketplace_icon = "attached_assets/ozon.png"
-                    elif marketplace == 'lemanpro':
-                        mp_name = "ЛеманПро"
-                        mp_color = "green"
-                        marketplace_icon = "attached_assets/Лемана про.png"
-                    elif marketplace == 'yandex':
-                        mp_name = "Яндекс.Маркет"
-                        mp_color = "orange"
-                        marketplace_icon = "attached_assets/Яндекс маркет.png"
-                    else:
-                        mp_name = marketplace.capitalize()
-                        mp_color = "gray"
-                        marketplace_icon = "attached_assets/xlsx.png"
-                        # Проверяем другие возможные маркетплейсы
-                        if "сбер" in marketplace.lower():
-                            marketplace_icon = "attached_assets/сбермегамаркет.png"
-                        elif "инструмент" in marketplace.lower():
-                            marketplace_icon = "attached_assets/все инструменты.png"
+                    # Название, цвет и иконка берутся из реестра маркетплейсов
+                    mp_info = MARKETPLACES.get(marketplace, {})
+                    mp_name = mp_info.get('title', marketplace.capitalize())
+                    mp_color = mp_info.get('color', "gray")
+                    marketplace_icon = mp_info.get('icon', "attached_assets/xlsx.png")
                     
                     st.caption(f'<span style="display: inline-block;"><img src="data:image/png;base64,{get_image_base64(marketplace_icon)}" width="20" style="margin-right:5px"></span> Распознан шаблон: <span style="color:{mp_color};font-weight:bold;">{mp_name}</span> (уверенность: {confidence:.1f}%)', unsafe_allow_html=True)
             
@@ -955,16 +412,10 @@ if st.session_state.source_data is not None and st.session_state.target_data is
             if source_marketplace == "other" or confidence < 80:
                 sheet_name = st.session_state.source_sheet_name if hasattr(st.session_state, 'source_sheet_name') else ""
                 
-                # Проверка имени листа
-                sheet_name_lower = sheet_name.lower()
-                if "шаблон" in sheet_name_lower:
-                    source_marketplace = "ozon"
-                elif "товары" in sheet_name_lower:
-                    source_marketplace = "wildberries"
-                elif "данные о товарах" in sheet_name_lower:
-                    source_marketplace = "yandex"
-                elif "леман" in sheet_name_lower or "atem" in sheet_name_lower or "атем" in sheet_name_lower:
-                    source_marketplace = "lemanpro"
+                # Проверка имени листа (upload_sheet_patterns в реестре маркетплейсов)
+                sheet_marketplace = marketplace_by_sheet_name(sheet_name)
+                if sheet_marketplace != "other":
+                    source_marketplace = sheet_marketplace
         
         if hasattr(st.session_state, 'target_columns'):
             # Используем унифицированный подход определения маркетплейса через функцию detect_marketplace_template
@@ -974,45 +425,32 @@ if st.session_state.source_data is not None and st.session_state.target_data is
             if target_marketplace == "other" or confidence < 80:
                 sheet_name = st.session_state.target_sheet_name if hasattr(st.session_state, 'target_sheet_name') else ""
                 
-                # Проверка имени листа
-                sheet_name_lower = sheet_name.lower()
-                if "шаблон" in sheet_name_lower:
-                    target_marketplace = "ozon"
-                elif "товары" in sheet_name_lower:
-                    target_marketplace = "wildberries"
-                elif "данные о товарах" in sheet_name_lower:
-                    target_marketplace = "yandex"
-                elif "леман" in sheet_name_lower or "atem" in sheet_name_lower or "атем" in sheet_name_lower:
-                    target_marketplace = "lemanpro"
+                # Проверка имени листа (upload_sheet_patterns в реестре маркетплейсов)
+                sheet_marketplace = marketplace_by_sheet_name(sheet_name)
+                if sheet_marketplace != "other":
+                    target_marketplace = sheet_marketplace
         
         mapping_icon_source = "attached_assets/xlsx.png"
         mapping_icon_target = "attached_assets/xlsx.png"
         
         # Выбираем иконки для источника и цели
-        if source_marketplace == 'wildberries':
-            mapping_icon_source = "attached_assets/wildberries.png"
-        elif source_marketplace == 'ozon':
-            mapping_icon_source = "attached_assets/ozon.png"
-        elif source_marketplace == 'lemanpro':
-            mapping_icon_source = "attached_assets/Лемана про.png"
-        elif "яндекс" in source_marketplace.lower():
-            mapping_icon_source = "attached_assets/Яндекс маркет.png"
-        
-        if target_marketplace == 'wildberries':
-            mapping_icon_target = "attached_assets/wildberries.png"
-        elif target_marketplace == 'ozon':
-            mapping_icon_target = "attached_assets/ozon.png"
-        elif target_marketplace == 'lemanpro':
-            mapping_icon_target = "attached_assets/Лемана про.png"
-        elif "яндекс" in target_marketplace.lower():
-            mapping_icon_target = "attached_assets/Яндекс маркет.png"
+        if source_marketplace in MARKETPLACES:
+            mapping_icon_source = MARKETPLACES[source_marketplace]['icon']
+        if target_marketplace in MARKETPLACES:
+            mapping_icon_target = MARKETPLACES[target_marketplace]['icon']
             
         # HTML не поддерживается в кнопках, используем текстовые обозначения
         if st.button(f"🔄 Автоматический маппинг колонок", use_container_width=True):
             with st.spinner("Выполняется автоматическое сопоставление колонок..."):
-                st.session_state.column_mapping = map_columns_automatically(
+                # Пары подбираются сразу для всех колонок: слабое совпадение не отнимает колонку у более точного
+                st.session_state.column_mapping, st.session_state.column_mapping_scores = map_columns_automatically(
                     st.session_state.source_columns,
-                    st.session_state.target_columns
+                    st.session_state.target_columns,
+                    assignment='optimal',
+                    return_scores=True,
+                    store=get_mapping_store(),
+                    source_values=st.session_state.source_data,
+                    target_values=st.session_state.target_data
                 )
                 st.session_state.auto_mapped = True
                 st.rerun()
@@ -1057,7 +495,8 @@ if st.session_state.source_data is not None and st.session_state.target_data is
                 # Компактное отображение колонок
                 cols = st.columns([3, 3])
                 with cols[0]:
-                    st.markdown(f"**{src_col}**", help="Исходная колонка")
+                    score = st.session_state.column_mapping_scores.get(src_col)
+                    st.markdown(f"**{src_col}**", help="Исходная колонка" if score is None else f"Исходная колонка (схожесть: {score})")
                 with cols[1]:
                     mapping = st.selectbox(
                         "Целевая колонка", 
@@ -1122,6 +561,12 @@ if st.session_state.source_data is not None and st.session_state.target_data is
             # Кнопка для завершения маппинга
             submitted = st.form_submit_button("✅ Подтвердить сопоставление")
             if submitted:
+                # Запоминаем подтвержденное сопоставление для этой пары шаблонов
+                get_mapping_store().save(
+                    st.session_state.source_columns,
+                    st.session_state.target_columns,
+                    st.session_state.column_mapping
+                )
                 st.session_state.mapping_complete = True
                 st.success("Сопоставление колонок выполнено успешно!")
                 st.rerun()
@@ -1207,6 +652,7 @@ if st.session_state.source_data is not None and st.session_state.target_data is
         # Кнопка для сброса маппинга и начала заново
         if st.button("🔄 Сбросить и начать заново"):
             st.session_state.column_mapping = {}
+            st.session_state.column_mapping_scores = {}
             st.session_state.mapping_complete = False
             st.session_state.transfer_complete = False
             st.session_state.auto_mapped = False
@@ -0,0 +1,103 @@
+"""
+Пакетное определение маркетплейса для большого числа файлов поставщиков.
+Для каждого файла читаются только верхние строки листов (см. utils.probe_workbook),
+файлы обрабатываются параллельно в пуле процессов, а результат записывается в JSONL:
+по одной строке на файл с листом, строкой заголовков, маркетплейсом, уверенностью и временем.
+
+Запуск:
+    python batch_detect.py входящие/ --workers 8 --output report.jsonl
+    python batch_detect.py файл1.xlsx файл2.xlsx
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import probe_workbook
+
+def collect_paths(paths):
+    """Раскрывает каталоги в список файлов xlsx (без временных файлов Excel вида ~$имя.xlsx)"""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith('.xlsx') and not name.startswith('~$'):
+                    result.append(os.path.join(path, name))
+        else:
+            result.append(path)
+    return result
+
+def detect_file(path, max_rows=30):
+    """
+    Определяет маркетплейс одного файла по верхним строкам его листов.
+
+    Returns:
+        dict: Запись отчета с ключами file, sheet, header_row, marketplace, confidence, seconds
+              (и error, если файл не удалось прочитать)
+    """
+    start = time.perf_counter()
+    try:
+        probe = probe_workbook(path, max_rows=max_rows)
+        record = {
+            'file': path,
+            'sheet': probe['sheet_name'],
+            'header_row': probe['header_row'],
+            'marketplace': probe['marketplace'],
+            'confidence': probe['confidence']
+        }
+    except Exception as e:
+        record = {
+            'file': path,
+            'sheet': None,
+            'header_row': None,
+            'marketplace': None,
+            'confidence': 0,
+            'error': str(e)
+        }
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+def detect_many(paths, workers=None, max_rows=30):
+    """
+    Определяет маркетплейс для каждого файла из списка.
+
+    Args:
+        paths: Пути к файлам xlsx
+        workers: Число процессов (None или 1 - последовательная обработка)
+        max_rows: Число верхних строк листа, по которым определяется шаблон
+
+    Yields:
+        dict: Записи отчета (см. detect_file) в порядке paths
+    """
+    paths = list(paths)
+    if not workers or workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield detect_file(path, max_rows)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(paths) // (workers * 4))
+        yield from executor.map(detect_file, paths, [max_rows] * len(paths), chunksize=chunksize)
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетное определение маркетплейса по заголовкам файлов xlsx")
+    parser.add_argument('paths', nargs='+', help="Файлы xlsx или каталоги с ними")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Число процессов")
+    parser.add_argument('--max-rows', type=int, default=30, help="Число верхних строк листа для поиска заголовков")
+    parser.add_argument('--output', help="Файл отчета JSONL (по умолчанию - стандартный вывод)")
+    args = parser.parse_args()
+
+    paths = collect_paths(args.paths)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for record in detect_many(paths, workers=args.workers, max_rows=args.max_rows):
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Сравнение скорости чтения исходной таблицы разными движками load_excel_file
+на синтетической выгрузке маркетплейса (по умолчанию 100 000 строк в формате Wildberries).
+
+Запуск:
+    python benchmark_reader.py --rows 100000
+    python benchmark_reader.py --file выгрузка.xlsx --sheet Товары --header-row 3
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import openpyxl
+
+from utils import load_excel_file, read_workbook_table
+
+# Заголовки выгрузки Wildberries (строка 3 листа "Товары")
+WB_HEADERS = [
+    'Группа', 'Артикул продавца', 'Артикул WB', 'Наименование', 'Категория продавца', 'Бренд',
+    'Описание', 'Фото', 'Видео', 'Полное наименование товара', 'Состав', 'Баркоды',
+    'Вес с упаковкой (кг)', 'Высота упаковки', 'Длина упаковки', 'Ширина упаковки',
+    'Дата окончания действия сертификата/декларации', 'Дата регистрации сертификата/декларации',
+    'Номер декларации соответствия', 'Номер сертификата соответствия', 'Свидетельство о регистрации СГР',
+    'SKU', 'Цвет', 'ТНВЭД', 'Ставка НДС', 'Пол', 'Страна производства', 'Комплектация', 'Цена'
+]
+
+def generate_wb_export(path, rows):
+    """Создает файл в формате выгрузки Wildberries с заданным числом строк данных"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Товары')
+    sheet.append(['Основная информация'] + [None] * (len(WB_HEADERS) - 1))
+    sheet.append(['Обязательное поле'] * len(WB_HEADERS))
+    sheet.append(WB_HEADERS)
+    for i in range(rows):
+        sheet.append([
+            None, 100000 + i, 150000000 + i, f'Садовая тачка {i}', None, 'Бренд',
+            'Одноколесная садовая тачка с металлическим корытом', f'https://img.example/{i}/1.jpg;https://img.example/{i}/2.jpg',
+            None, f'Тачка садовая строительная {i}', 'сталь', 4600000000000 + i,
+            12.5, 60, 140, 70, None, None, f'ЕАЭС N RU Д-RU.{i}', None, None,
+            f'SKU-{i}', 'зеленый', 8716800000, 20, None, 'Россия', 'тачка', 3490 + i % 100
+        ])
+    reference = workbook.create_sheet('Справочник')
+    for i in range(5000):
+        reference.append([f'Значение справочника {i}'])
+    workbook.save(path)
+
+def run(label, func):
+    start = time.perf_counter()
+    headers, df = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.2f} с   {df.shape[0]} строк x {df.shape[1]} колонок")
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение движков чтения xlsx")
+    parser.add_argument('--rows', type=int, default=100000, help="Число строк в синтетической выгрузке")
+    parser.add_argument('--file', help="Готовый файл xlsx вместо синтетического")
+    parser.add_argument('--sheet', default='Товары', help="Имя листа")
+    parser.add_argument('--header-row', type=int, default=3, help="Номер строки заголовков")
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'wb_export.xlsx')
+        print(f"Генерация выгрузки на {args.rows} строк: {path}")
+        generate_wb_export(path, args.rows)
+
+    def openpyxl_full():
+        workbook, _ = load_excel_file(path)
+        return read_workbook_table(workbook, args.sheet, args.header_row)
+
+    def openpyxl_read_only():
+        workbook, _ = load_excel_file(path, read_only=True)
+        return read_workbook_table(workbook, args.sheet, args.header_row)
+
+    def xml_columns():
+        workbook, _ = load_excel_file(path, engine='xml')
+        return read_workbook_table(workbook, args.sheet, args.header_row)
+
+    results = [
+        run("openpyxl (полная загрузка)", openpyxl_full),
+        run("openpyxl (read_only)", openpyxl_read_only),
+        run("xml (потоковый разбор в колонки)", xml_columns),
+    ]
+
+    same = all(result.equals(results[0]) for result in results[1:])
+    print(f"Результаты совпадают: {'да' if same else 'НЕТ'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Модуль хранения подтвержденных пользователем сопоставлений колонок.
+Сопоставление запоминается для пары шаблонов: ключ строится из наборов заголовков исходной
+и целевой таблиц, поэтому при повторной обработке той же пары (поставщик -> маркетплейс)
+сохраненное сопоставление возвращается сразу, а для похожих шаблонов служит подсказкой.
+Записи хранятся в локальной базе SQLite и переживают перезапуск приложения.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Минимальная похожесть наборов заголовков (по Жаккару), при которой сохраненное
+# сопоставление другой пары шаблонов используется как подсказка
+NEAR_MATCH_SIMILARITY = 0.6
+
+def normalize_header(header):
+    """Заголовок без учета регистра и пробелов по краям (по нему сравниваются сохраненные пары)"""
+    return str(header).strip().lower()
+
+def normalize_headers(headers):
+    """Набор заголовков без учета порядка, регистра и пробелов по краям (пустые пропускаются)"""
+    return frozenset(
+        normalize_header(header) for header in headers
+        if header is not None and str(header).strip()
+    )
+
+def headers_fingerprint(headers):
+    """
+    Вычисляет отпечаток набора заголовков таблицы.
+
+    Args:
+        headers: Список заголовков
+
+    Returns:
+        str: Шестнадцатеричный SHA-256 хеш нормализованного набора заголовков
+    """
+    return hashlib.sha256('\x1f'.join(sorted(normalize_headers(headers))).encode('utf-8')).hexdigest()
+
+def headers_similarity(first, second):
+    """Похожесть двух нормализованных наборов заголовков (коэффициент Жаккара)"""
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+class MappingStore:
+    """
+    Хранилище сопоставлений колонок в SQLite.
+    Одна запись на пару (отпечаток заголовков источника, отпечаток заголовков цели);
+    повторное подтверждение той же пары заменяет сопоставление.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mappings (
+                    source_fingerprint TEXT NOT NULL,
+                    target_fingerprint TEXT NOT NULL,
+                    source_headers TEXT NOT NULL,
+                    target_headers TEXT NOT NULL,
+                    mapping TEXT NOT NULL,
+                    uses INTEGER NOT NULL DEFAULT 1,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (source_fingerprint, target_fingerprint)
+                )
+                """
+            )
+
+    def get(self, source_headers, target_headers):
+        """
+        Возвращает сохраненное сопоставление для точно такой же пары наборов заголовков.
+
+        Returns:
+            dict: Словарь соответствия {source_column: target_column} или None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mapping FROM mappings WHERE source_fingerprint = ? AND target_fingerprint = ?",
+                (headers_fingerprint(source_headers), headers_fingerprint(target_headers))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_similar(self, source_headers, target_headers, min_similarity=NEAR_MATCH_SIMILARITY):
+        """
+        Ищет сохраненное сопоставление для самой похожей пары шаблонов.
+        Похожесть пары - меньшая из похожестей наборов заголовков источника и цели.
+
+        Returns:
+            tuple: (словарь соответствия, похожесть) или None, если похожих пар нет
+        """
+        source_set = normalize_headers(source_headers)
+        target_set = normalize_headers(target_headers)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT source_headers, target_headers, mapping FROM mappings"
+            ).fetchall()
+
+        best = None
+        for stored_source, stored_target, mapping in rows:
+            similarity = min(
+                headers_similarity(source_set, normalize_headers(json.loads(stored_source))),
+                headers_similarity(target_set, normalize_headers(json.loads(stored_target)))
+            )
+            if similarity >= min_similarity and (best is None or similarity > best[1]):
+                best = (mapping, similarity)
+
+        if best is None:
+            return None
+        return json.loads(best[0]), best[1]
+
+    def save(self, source_headers, target_headers, mapping):
+        """Сохраняет подтвержденное сопоставление колонок для пары наборов заголовков"""
+        values = (
+            headers_fingerprint(source_headers),
+            headers_fingerprint(target_headers),
+            json.dumps([str(header) for header in source_headers], ensure_ascii=False),
+            json.dumps([str(header) for header in target_headers], ensure_ascii=False),
+            json.dumps(mapping, ensure_ascii=False),
+            time.time()
+        )
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO mappings (source_fingerprint, target_fingerprint, source_headers, target_headers, mapping, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source_fingerprint, target_fingerprint) DO UPDATE SET
+                    source_headers = excluded.source_headers,
+                    target_headers = excluded.target_headers,
+                    mapping = excluded.mapping,
+                    uses = uses + 1,
+                    updated_at = excluded.updated_at
+                """,
+                values
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM mappings").fetchone()[0]
+
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._connection.close()
@@ -1,11 +1,20 @@
 """
-Модуль для распознавания шаблонов маркетплейсов (Ozon, Wildberries, ЛеманПро, Яндекс.Маркет)
-на основе заголовков и содержимого файлов Excel.
+Модуль для распознавания шаблонов маркетплейсов (Ozon, Wildberries, ЛеманПро, Яндекс.Маркет, Все инструменты)
+на основе заголовков и содержимого файлов Excel. Описания шаблонов берутся из marketplace_signatures.json.
 """
 
+from functools import lru_cache
+
+from marketplace_signatures import EXPECTED_HEADER_ROWS, MARKETPLACES, SIGNATURE_GROUPS, match_row
+
+# Число наборов заголовков, для которых запоминается результат определения маркетплейса
+# (Streamlit при каждом перезапуске скрипта заново определяет шаблон тех же таблиц)
+DETECTION_CACHE_SIZE = 256
+
 def detect_marketplace_by_row_headers(normalized_columns, row_num):
     """
     Определяет тип маркетплейса на основе заголовков в указанной строке.
+    Результат запоминается для набора заголовков (см. DETECTION_CACHE_SIZE).
     
     Args:
         normalized_columns: Список нормализованных (lowercase) заголовков колонок
@@ -17,160 +26,39 @@ def detect_marketplace_by_row_headers(normalized_columns, row_num):
             - confidence: Число от 0 до 100, указывающее уровень уверенности в определении
             - additional_info: Словарь с дополнительной информацией (для диагностики)
     """
-    # Эталонные заголовки для каждого маркетплейса
-    marketplace_headers = {
-        # Строка 4 - ЛеманПро
-        'lemanpro_row4': [
-            'guid', 'код тн вэд', 'наименование товара мерчанта', 
-            'бренд товара', 'модель товара'
-        ],
-        # Строка 4 - Яндекс.Маркет
-        'yandex_row4': [
-            'ваш sku *', 'качество карточки', 'рекомендации по заполнению', 
-            'название товара *', 'ссылка на изображение *'
-        ],
-        # Строка 2 - Ozon
-        'ozon_row2': [
-            'артикул*', 'название товара*', 'ссылка на главное фото*', 
-            'цена, руб.*', 'бренд*'
-        ],
-        # Строка 2 - Яндекс.Маркет (альтернативный вариант)
-        'yandex_row2': [
-            'ваш sku *', 'качество карточки', 'рекомендации по заполнению', 
-            'название товара *', 'ссылка на изображение *'
-        ],
-        # Строка 3 - Wildberries
-        'wildberries_row3': [
-            'артикул продавца', 'артикул wb', 'наименование', 
-            'бренд', 'фото'
-        ],
-        # Строка 2 - Все инструменты
-        'vseinstrumenty_row2': [
-            'guid*', 'бренд', 'наименование', 'артикул', 'код тн вэд'
-        ]
-    }
-    
-    # Проверка каждого типа шаблона на основе номера строки
+    marketplace, confidence, results = _detect_by_row_headers(tuple(normalized_columns), row_num)
+    # Копия, чтобы изменения словаря вызывающим кодом не попали в кеш
+    return (marketplace, confidence, {name: dict(data) for name, data in results.items()})
+
+@lru_cache(maxsize=DETECTION_CACHE_SIZE)
+def _detect_by_row_headers(normalized_columns, row_num):
+    """Определение маркетплейса по заголовкам строки (normalized_columns - кортеж заголовков)"""
+    # Эталонные первые 5 заголовков каждого шаблона (группы 'row_headers.<маркетплейс>_row<N>')
+    # и его ключевые поля описаны в marketplace_signatures.json;
+    # все ключевые слова ищутся за один проход по заголовкам
+    row = match_row(normalized_columns)
+    
+    # Проверка каждого шаблона, у которого есть эталонные заголовки для этой строки
     results = {}
-    
-    # Для строки 4
-    if row_num == 4:
-        # Проверяем первые 5 колонок на совпадение с эталонными заголовками
-        first_5_columns = normalized_columns[:min(5, len(normalized_columns))]
-        
-        # Проверка на ЛеманПро
-        lemanpro_exact_matches = sum(1 for i, header in enumerate(marketplace_headers['lemanpro_row4']) 
-                                   if i < len(first_5_columns) and header.lower() in first_5_columns[i])
+    for marketplace, info in MARKETPLACES.items():
+        reference = f'row_headers.{marketplace}_row{row_num}'
+        if reference not in SIGNATURE_GROUPS:
+            continue
         
-        # Проверка на Яндекс.Маркет
-        yandex_exact_matches = sum(1 for i, header in enumerate(marketplace_headers['yandex_row4']) 
-                                 if i < len(first_5_columns) and header.lower() in first_5_columns[i])
-        
-        # Дополнительные проверки
-        has_guid = any('guid' in col for col in normalized_columns)
-        has_yandex_sku = any('ваш sku' in col for col in normalized_columns)
-        has_quality = any('качество карточки' in col for col in normalized_columns)
-        
-        # Общие совпадения (просто наличие характерных заголовков)
-        lemanpro_matches = sum(1 for header in marketplace_headers['lemanpro_row4'] if any(header.lower() in col for col in normalized_columns))
-        yandex_matches = sum(1 for header in marketplace_headers['yandex_row4'] if any(header.lower() in col for col in normalized_columns))
-        
-        # Результаты для строки 4
-        results['lemanpro'] = {
-            'exact_matches': lemanpro_exact_matches,
-            'total_matches': lemanpro_matches,
-            'has_guid': has_guid,
-            'confidence': calculate_confidence('lemanpro', lemanpro_exact_matches, has_guid, row_num)
-        }
-        
-        results['yandex'] = {
-            'exact_matches': yandex_exact_matches,
-            'total_matches': yandex_matches,
-            'has_sku': has_yandex_sku,
-            'has_quality': has_quality,
-            'confidence': calculate_confidence('yandex', yandex_exact_matches, has_yandex_sku or has_quality, row_num)
-        }
-    
-    # Для строки 2 (Ozon, Яндекс или Все инструменты)
-    elif row_num == 2:
         # Проверяем первые 5 колонок на совпадение с эталонными заголовками
-        first_5_columns = normalized_columns[:min(5, len(normalized_columns))]
-        
-        # Проверка на Ozon
-        ozon_exact_matches = sum(1 for i, header in enumerate(marketplace_headers['ozon_row2']) 
-                               if i < len(first_5_columns) and header.lower() in first_5_columns[i])
-        
-        # Проверка на Яндекс.Маркет
-        yandex_exact_matches = sum(1 for i, header in enumerate(marketplace_headers['yandex_row2']) 
-                                 if i < len(first_5_columns) and header.lower() in first_5_columns[i])
-        
-        # Проверка на Все инструменты
-        vseinstrumenty_exact_matches = sum(1 for i, header in enumerate(marketplace_headers['vseinstrumenty_row2']) 
-                                        if i < len(first_5_columns) and header.lower() in first_5_columns[i])
-        
-        # Дополнительные проверки
-        has_asterisk = any('*' in col for col in normalized_columns)
-        has_ozon_price = any('цена, руб.*' in col for col in normalized_columns)
-        has_ozon_article = any('артикул*' in col for col in normalized_columns)
-        has_yandex_sku = any('ваш sku' in col for col in normalized_columns)
-        has_quality = any('качество карточки' in col for col in normalized_columns)
-        has_vi_guid = any('guid*' in col.lower() for col in normalized_columns)
-        has_data_sheet = False  # Будет установлено true, если лист называется "Данные"
+        exact_matches = row.positional_count(reference)
         
         # Общие совпадения (просто наличие характерных заголовков)
-        ozon_matches = sum(1 for header in marketplace_headers['ozon_row2'] if any(header.lower() in col for col in normalized_columns))
-        yandex_matches = sum(1 for header in marketplace_headers['yandex_row2'] if any(header.lower() in col for col in normalized_columns))
-        vseinstrumenty_matches = sum(1 for header in marketplace_headers['vseinstrumenty_row2'] if any(header.lower() in col for col in normalized_columns))
-        
-        # Результаты для строки 2
-        results['ozon'] = {
-            'exact_matches': ozon_exact_matches,
-            'total_matches': ozon_matches,
-            'has_asterisk': has_asterisk,
-            'has_ozon_price': has_ozon_price,
-            'has_ozon_article': has_ozon_article,
-            'confidence': calculate_confidence('ozon', ozon_exact_matches, has_ozon_price or has_ozon_article, row_num)
-        }
-        
-        results['yandex'] = {
-            'exact_matches': yandex_exact_matches,
-            'total_matches': yandex_matches,
-            'has_sku': has_yandex_sku,
-            'has_quality': has_quality,
-            'confidence': calculate_confidence('yandex', yandex_exact_matches, has_yandex_sku or has_quality, row_num)
-        }
+        total_matches = row.count(reference)
         
-        results['vseinstrumenty'] = {
-            'exact_matches': vseinstrumenty_exact_matches,
-            'total_matches': vseinstrumenty_matches,
-            'has_guid': has_vi_guid,
-            'is_data_sheet': has_data_sheet,
-            'confidence': calculate_confidence('vseinstrumenty', vseinstrumenty_exact_matches, has_vi_guid, row_num)
-        }
-    
-    # Для строки 3 (Wildberries)
-    elif row_num == 3:
-        # Проверяем первые 5 колонок на совпадение с эталонными заголовками
-        first_5_columns = normalized_columns[:min(5, len(normalized_columns))]
-        
-        # Проверка на Wildberries
-        wb_exact_matches = sum(1 for i, header in enumerate(marketplace_headers['wildberries_row3']) 
-                             if i < len(first_5_columns) and header.lower() in first_5_columns[i])
-        
-        # Дополнительные проверки
-        has_wb_article = any('артикул wb' in col for col in normalized_columns)
-        has_seller_article = any('артикул продавца' in col for col in normalized_columns)
-        
-        # Общие совпадения (просто наличие характерных заголовков)
-        wb_matches = sum(1 for header in marketplace_headers['wildberries_row3'] if any(header.lower() in col for col in normalized_columns))
+        # Дополнительная проверка ключевых полей (GUID, "Ваш SKU", "Артикул WB" и т.д.)
+        has_key_field = any(row.has(field) for field in info.get('key_fields', ()))
         
-        # Результаты для строки 3
-        results['wildberries'] = {
-            'exact_matches': wb_exact_matches,
-            'total_matches': wb_matches,
-            'has_wb_article': has_wb_article,
-            'has_seller_article': has_seller_article,
-            'confidence': calculate_confidence('wildberries', wb_exact_matches, has_wb_article or has_seller_article, row_num)
+        results[marketplace] = {
+            'exact_matches': exact_matches,
+            'total_matches': total_matches,
+            'has_key_field': has_key_field,
+            'confidence': calculate_confidence(marketplace, exact_matches, has_key_field, row_num)
         }
     
     # Определяем лучший результат
@@ -205,13 +93,8 @@ def calculate_confidence(marketplace, exact_matches, has_key_field, row_num):
     base_confidence = 0
     
     # Проверка соответствия "маркетплейс + строка"
-    row_match = False
-    if (marketplace == 'ozon' and row_num == 2) or \
-       (marketplace == 'wildberries' and row_num == 3) or \
-       (marketplace == 'lemanpro' and row_num == 4) or \
-       (marketplace == 'vseinstrumenty' and row_num == 2) or \
-       (marketplace == 'yandex' and (row_num == 2 or row_num == 4)):
-        row_match = True
+    # (ожидаемые строки заголовков описаны в marketplace_signatures.json)
+    if row_num in EXPECTED_HEADER_ROWS.get(marketplace, ()):
         base_confidence += 20  # Бонус за совпадение типичной строки для этого маркетплейса
     
     # Оценка на основе точных совпадений (до 60 баллов)
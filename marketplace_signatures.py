@@ -0,0 +1,275 @@
+"""
+Реестр характерных заголовков маркетплейсов и их поиск в строках листа.
+
+Все знания о шаблонах маркетплейсов (характерные поля, единицы измерения, типичные листы
+и строки заголовков, эталонные заголовки, поля-идентификаторы) хранятся в одном файле
+marketplace_signatures.json. При импорте модуля реестр компилируется в именованные группы
+ключевых слов, таблицы соответствия и ожидаемые строки заголовков, а все ключевые слова -
+в один автомат Ахо-Корасик. Строка листа просматривается за один проход по тексту ее ячеек,
+после чего детекторы шаблонов (find_best_marketplace_sheet, detect_marketplace_template,
+find_header_row, detect_marketplace_by_columns, marketplace_detection) считают совпадения своих групп
+по готовому набору найденных ключевых слов.
+
+Чтобы добавить новый шаблон, достаточно описать его в marketplace_signatures.json.
+"""
+
+import json
+import os
+import weakref
+from collections import deque
+
+# Файл реестра по умолчанию (лежит рядом с модулем)
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'marketplace_signatures.json')
+
+def load_registry(path=REGISTRY_PATH):
+    """Читает реестр сигнатур маркетплейсов из JSON"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compile_groups(registry):
+    """
+    Собирает из реестра именованные группы ключевых слов.
+    Порядок и повторы внутри группы сохраняются: по ним считаются совпадения.
+
+    Группы маркетплейса: '<маркетплейс>.unique_fields', '.units', '.template_fields',
+    '.template_key_fields', '.key_fields', '.instruction_markers', '.fallback_sheet';
+    'header_row.<маркетплейс>' - маркеры строки заголовков; 'row_headers.<маркетплейс>_row<N>' -
+    эталонные первые заголовки в строке N;
+    'column_check.<номер>.indicators' и '.fields' - признаки проверок заголовков (column_checks).
+    """
+    groups = {}
+    for name, info in registry['marketplaces'].items():
+        for key in ('unique_fields', 'units', 'template_fields', 'template_key_fields', 'key_fields', 'instruction_markers'):
+            if key in info:
+                groups[f'{name}.{key}'] = info[key]
+        if 'fallback_sheet' in info:
+            groups[f'{name}.fallback_sheet'] = info['fallback_sheet']['indicators']
+        if 'header_markers' in info:
+            groups[f'header_row.{name}'] = info['header_markers']['fields']
+        for row_num, headers in info.get('reference_headers', {}).items():
+            groups[f'row_headers.{name}_row{row_num}'] = headers
+
+    for rule in registry.get('sheet_rules', []):
+        groups[f"sheet_rule.{rule['marketplace']}"] = rule['key_fields']
+    for check_idx, check in enumerate(registry.get('column_checks', [])):
+        groups[f'column_check.{check_idx}.indicators'] = check['indicators']
+        groups[f'column_check.{check_idx}.fields'] = (
+            check.get('any_fields', [])
+            + [field for fields in check.get('all_fields', []) for field in fields]
+            + ([check['asterisks']['field']] if 'asterisks' in check else [])
+        )
+    groups['id_fields'] = list(registry['id_fields'])
+    groups.update(registry.get('groups', {}))
+    return groups
+
+class RowMatch:
+    """
+    Результат поиска ключевых слов в строке листа.
+    values - нормализованные значения ячеек; cells - наборы ключевых слов, найденных
+    в каждой ячейке; found - во всей строке.
+    """
+
+    def __init__(self, matcher, values, cells):
+        self.matcher = matcher
+        self.values = values
+        self.cells = cells
+        self.found = set().union(*cells)
+
+    def has(self, pattern):
+        """Есть ли ключевое слово хотя бы в одной ячейке строки"""
+        if pattern not in self.matcher.patterns:
+            raise KeyError(f"Ключевое слово '{pattern}' не входит в реестр сигнатур")
+        return pattern in self.found
+
+    def count(self, group):
+        """Число ключевых слов группы, найденных хотя бы в одной ячейке строки"""
+        return sum(1 for pattern in self.matcher.groups[group] if pattern in self.found)
+
+    def positional_count(self, group, limit=5):
+        """Число ключевых слов группы, найденных в ячейке с тем же номером (среди первых limit)"""
+        return sum(
+            1 for i, pattern in enumerate(self.matcher.groups[group][:limit])
+            if i < len(self.cells) and pattern in self.cells[i]
+        )
+
+    def count_cells(self, group):
+        """Число ячеек строки, в которых есть хотя бы одно ключевое слово группы"""
+        patterns = set(self.matcher.groups[group])
+        return sum(1 for cell in self.cells if not cell.isdisjoint(patterns))
+
+class SignatureMatcher:
+    """
+    Автомат Ахо-Корасик для одновременного поиска всех ключевых слов реестра.
+    Текст каждой ячейки просматривается один раз, независимо от числа ключевых слов.
+    """
+
+    def __init__(self, groups):
+        self.groups = {name: tuple(patterns) for name, patterns in groups.items()}
+        self.patterns = frozenset(pattern for patterns in self.groups.values() for pattern in patterns if pattern)
+
+        # Бор ключевых слов: переходы, суффиксные ссылки и найденные в состоянии слова
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for pattern in sorted(self.patterns):
+            self._add_pattern(pattern)
+        self._build_links()
+
+    def _add_pattern(self, pattern):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].add(pattern)
+
+    def _build_links(self):
+        """Строит суффиксные ссылки обходом бора в ширину"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+        self._output = [frozenset(output) for output in self._output]
+
+    def find(self, text):
+        """Возвращает набор ключевых слов, входящих в текст"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def match(self, values):
+        """
+        Ищет ключевые слова в ячейках строки.
+
+        Args:
+            values: Нормализованные (lowercase) значения ячеек строки
+
+        Returns:
+            RowMatch: Найденные ключевые слова по ячейкам и по строке
+        """
+        values = list(values)
+        return RowMatch(self, values, [self.find(value) if value else set() for value in values])
+
+# Реестр, скомпилированный при импорте модуля
+REGISTRY = load_registry()
+
+# Описания маркетплейсов (порядок важен: при равных оценках выбирается более ранний)
+MARKETPLACES = REGISTRY['marketplaces']
+
+# Поля-идентификаторы товара и маркетплейсы, к которым они относятся (порядок важен)
+ID_FIELD_MARKETPLACES = REGISTRY['id_fields']
+
+# Строки, в которых у маркетплейса ожидаются заголовки
+EXPECTED_HEADER_ROWS = {name: frozenset(info.get('expected_header_rows', ())) for name, info in MARKETPLACES.items()}
+
+# Маркетплейсы, участвующие в поиске листа (find_best_marketplace_sheet) и в определении по заголовкам
+SHEET_MARKETPLACES = [name for name, info in MARKETPLACES.items() if 'sheet_names' in info]
+TEMPLATE_MARKETPLACES = [name for name, info in MARKETPLACES.items() if 'template_fields' in info]
+
+# Поля, которые в заголовках сравниваются целиком, а не как подстроки
+TEMPLATE_EXACT_FIELDS = {
+    name: frozenset(MARKETPLACES[name].get('template_exact_fields', ())) for name in TEMPLATE_MARKETPLACES
+}
+TEMPLATE_SPECIAL_MARKERS = {
+    name: frozenset(MARKETPLACES[name].get('template_special_markers', ())) for name in TEMPLATE_MARKETPLACES
+}
+
+# Типичные строки заголовков и группы их маркеров в порядке проверки (find_header_row)
+HEADER_ROWS_TO_CHECK = [
+    (row_num, f'header_row.{name}')
+    for name, info in MARKETPLACES.items() if 'header_markers' in info
+    for row_num in info['header_markers']['rows']
+]
+
+# Правила выбора листа и строки заголовков по имени листа и файла
+FORCED_SHEETS = REGISTRY.get('forced_sheets', [])
+SHEET_RULES = REGISTRY.get('sheet_rules', [])
+FILE_NAME_RULES = REGISTRY.get('file_name_rules', [])
+
+# Проверки заголовков для уточнения маркетплейса по строке заголовков: номер строки -> [(индекс, проверка)]
+COLUMN_CHECKS = {}
+for check_idx, check in enumerate(REGISTRY.get('column_checks', [])):
+    COLUMN_CHECKS.setdefault(check['row'], []).append((check_idx, check))
+
+SIGNATURE_GROUPS = compile_groups(REGISTRY)
+
+# Автомат по всем ключевым словам реестра
+SIGNATURE_MATCHER = SignatureMatcher(SIGNATURE_GROUPS)
+
+def match_row(values):
+    """Ищет ключевые слова реестра в нормализованных значениях ячеек строки"""
+    return SIGNATURE_MATCHER.match(values)
+
+class NormalizedRowCache:
+    """
+    Верхние строки листа, прочитанные из листа один раз.
+    Для каждой строки хранятся исходные значения ячеек, их нормализованный текст (str, strip, lower)
+    и найденные в нем ключевые слова реестра; детекторы шаблонов берут строки отсюда
+    вместо повторного обращения worksheet[N] и повторной нормализации.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self._raw = {}
+        self._values = {}
+        self._matches = {}
+
+    def raw(self, row_idx):
+        """Исходные значения ячеек строки"""
+        if row_idx not in self._raw:
+            self._raw[row_idx] = tuple(cell.value for cell in self.worksheet[row_idx])
+        return self._raw[row_idx]
+
+    def values(self, row_idx):
+        """Нормализованные значения ячеек строки (пустая ячейка - пустая строка)"""
+        if row_idx not in self._values:
+            self._values[row_idx] = ['' if value is None else str(value).strip().lower() for value in self.raw(row_idx)]
+        return self._values[row_idx]
+
+    def match(self, row_idx):
+        """Ключевые слова реестра, найденные в строке (см. SignatureMatcher.match)"""
+        if row_idx not in self._matches:
+            self._matches[row_idx] = SIGNATURE_MATCHER.match(self.values(row_idx))
+        return self._matches[row_idx]
+
+    def non_empty(self, row_idx):
+        """Число ячеек строки с непустым значением"""
+        return sum(1 for value in self.raw(row_idx) if value)
+
+    def filled(self, row_idx):
+        """Число ячеек строки с непустым значением, не состоящим из одних пробелов"""
+        return sum(1 for value, text in zip(self.raw(row_idx), self.values(row_idx)) if value and text)
+
+# Кеши строк по листам; запись удаляется вместе с листом
+_row_caches = weakref.WeakKeyDictionary()
+
+def get_row_cache(worksheet):
+    """Возвращает кеш нормализованных строк листа (создается при первом обращении)"""
+    cache = _row_caches.get(worksheet)
+    if cache is None:
+        cache = _row_caches[worksheet] = NormalizedRowCache(worksheet)
+    return cache
+
+def discard_row_cache(worksheet):
+    """Сбрасывает кеш строк листа (после изменения ячеек листа)"""
+    _row_caches.pop(worksheet, None)
@@ -0,0 +1,137 @@
+"""
+Модуль кеширования результатов разбора загруженных книг Excel.
+Ключ кеша строится из хеша содержимого файла и параметров загрузки, поэтому повторная
+загрузка того же файла (в том числе в новой сессии) не требует повторного разбора.
+Записи хранятся в ограниченном LRU-кеше в памяти и при вытеснении могут выгружаться на диск.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+def file_fingerprint(data):
+    """
+    Вычисляет хеш содержимого файла.
+
+    Args:
+        data: Содержимое файла (bytes) или файловый объект
+
+    Returns:
+        str: Шестнадцатеричный SHA-256 хеш содержимого
+    """
+    if hasattr(data, 'getvalue'):
+        data = data.getvalue()
+    elif hasattr(data, 'read'):
+        position = data.tell() if hasattr(data, 'tell') else None
+        content = data.read()
+        if position is not None:
+            data.seek(position)
+        data = content
+    return hashlib.sha256(data).hexdigest()
+
+def make_cache_key(fingerprint, **options):
+    """
+    Строит ключ кеша из хеша файла и параметров загрузки.
+
+    Args:
+        fingerprint: Хеш содержимого файла (см. file_fingerprint)
+        **options: Параметры загрузки (лист, строка заголовков, режим чтения и т.д.)
+
+    Returns:
+        str: Ключ кеша
+    """
+    digest = hashlib.sha256(fingerprint.encode('utf-8'))
+    digest.update(json.dumps(options, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class ParseCache:
+    """
+    LRU-кеш результатов разбора книг.
+    В памяти хранится не более max_entries записей; если задан spill_dir, вытесненные записи
+    сохраняются туда (pickle) и подгружаются обратно при следующем обращении.
+    """
+
+    def __init__(self, max_entries=16, spill_dir=None):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.pkl")
+
+    def _spill(self, key, value):
+        """Сохраняет вытесненную запись на диск (ошибки записи не критичны для работы)"""
+        if not self.spill_dir:
+            return
+        path = self._spill_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def get(self, key, default=None):
+        """Возвращает запись по ключу (из памяти или с диска) или default"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = self._load_spilled(key)
+        if value is None:
+            return default
+
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Сохраняет запись и вытесняет самые давно использованные записи сверх лимита"""
+        evicted = []
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+
+        for evicted_key, evicted_value in evicted:
+            self._spill(evicted_key, evicted_value)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.spill_dir) and os.path.exists(self._spill_path(key))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        """Очищает кеш в памяти и выгруженные на диск записи"""
+        with self._lock:
+            self._entries.clear()
+        if self.spill_dir and os.path.isdir(self.spill_dir):
+            for name in os.listdir(self.spill_dir):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.spill_dir, name))
@@ -45,7 +45,7 @@ with col1:
         
         if wb_file:
             with open(wb_file, "rb") as f:
-                workbook, sheets = load_excel_file(f)
+                workbook, sheets = load_excel_file(f, read_only=True)
                 
                 # Ищем лист "Товары"
                 target_sheet = None
@@ -117,7 +117,7 @@ with col2:
         
         if ozon_file:
             with open(ozon_file, "rb") as f:
-                workbook, sheets = load_excel_file(f)
+                workbook, sheets = load_excel_file(f, read_only=True)
                 
                 # Ищем лист "Шаблон"
                 target_sheet = None
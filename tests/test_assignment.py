@@ -0,0 +1,58 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from utils import DICTIONARY_MAPPING_SCORE, map_columns_automatically, solve_assignment
+
+
+def brute_force_best(weights):
+    """Наибольшая сумма весов перебором всех назначений (для малых матриц)."""
+    n_rows, n_cols = weights.shape
+    if n_rows <= n_cols:
+        return max(sum(weights[row, col] for row, col in zip(range(n_rows), cols))
+                   for cols in itertools.permutations(range(n_cols), n_rows))
+    return brute_force_best(weights.T)
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5), (2, 7)])
+def test_solve_assignment_matches_brute_force(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        weights = rng.integers(0, 100, size=shape).astype(np.float64)
+        pairs = solve_assignment(weights)
+
+        assert len(pairs) == min(shape)
+        rows, cols = zip(*pairs)
+        assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+        assert list(rows) == sorted(rows)
+        assert sum(weights[row, col] for row, col in pairs) == brute_force_best(weights)
+
+
+def test_solve_assignment_empty():
+    assert solve_assignment(np.zeros((0, 3))) == []
+    assert solve_assignment(np.zeros((3, 0))) == []
+
+
+def test_solve_assignment_prefers_total_over_greedy_pick():
+    # Жадный выбор взял бы (0, 0) и оставил строке 1 только вес 1
+    weights = np.array([[10, 9], [8, 1]])
+    assert solve_assignment(weights) == [(0, 1), (1, 0)]
+
+
+def test_optimal_mapping_assigns_each_target_once():
+    source = ['Цена продажи', 'Цена']
+    target = ['Цена', 'Цена продажи, руб']
+    mapping = map_columns_automatically(source, target, assignment='optimal')
+    assert mapping == {'Цена продажи': 'Цена продажи, руб', 'Цена': 'Цена'}
+
+
+@pytest.mark.parametrize('assignment', ['greedy', 'optimal'])
+def test_dictionary_pairs_report_a_defined_score(assignment):
+    source = ['Баркоды', 'Артикул продавца', 'Наименование', 'Бренд', 'Предмет', 'Цена']
+    target = ['Артикул*', 'Штрихкод (Серийный номер / EAN)', 'Название товара*', 'Бренд*', 'Цена, руб.*', 'Тип*']
+    mapping, scores = map_columns_automatically(source, target, assignment=assignment, return_scores=True)
+
+    # "Баркоды" -> "Штрихкод..." берется из словаря WB -> Ozon, а не по схожести названий
+    assert mapping['Баркоды'] == 'Штрихкод (Серийный номер / EAN)'
+    assert scores['Баркоды'] == DICTIONARY_MAPPING_SCORE
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+from utils import (
+    COLUMN_MAPPING_GRAPH,
+    MARKETPLACE_COLUMN_MAPS,
+    UNIT_PAIR_BONUS,
+    column_similarity_matrix,
+    column_value_fingerprints,
+    compile_column_mapping_graph,
+    get_prepared_columns,
+    plan_column_transfer,
+    value_similarity_matrix,
+)
+
+
+def test_prepared_columns_are_reused_for_the_same_columns():
+    columns = ['Артикул', 'Масса, г']
+    prepared = get_prepared_columns(columns)
+    assert prepared is get_prepared_columns(list(columns))
+    assert prepared.g.tolist() == [False, True]
+    assert prepared.weight.tolist() == [False, True]
+
+
+def test_similarity_matrix_prefers_matching_names():
+    scores = column_similarity_matrix(['Цена', 'Бренд'], ['Бренд*', 'Цена, руб.*'])
+    assert scores.shape == (2, 2)
+    assert scores[0, 1] > scores[0, 0]
+    assert scores[1, 0] > scores[1, 1]
+
+
+def test_similarity_matrix_rewards_unit_pairs():
+    scores = column_similarity_matrix(['Масса, кг'], ['Масса, г', 'Масса, мм'])
+    assert scores[0, 0] - scores[0, 1] == UNIT_PAIR_BONUS
+
+
+def test_mapping_graph_composes_missing_directions():
+    graph = compile_column_mapping_graph({
+        ('a', 'b'): {'x': 'y', 'lost': 'nowhere'},
+        ('b', 'c'): {'y': ['z1', 'z2']},
+    })
+
+    assert graph[('a', 'b')] == {'x': ('y',), 'lost': ('nowhere',)}
+    assert graph[('a', 'c')] == {'x': ('z1', 'z2')}
+    assert ('c', 'a') not in graph
+
+
+def test_mapping_graph_keeps_direct_maps_and_adds_composed_ones():
+    for direction in MARKETPLACE_COLUMN_MAPS:
+        assert direction in COLUMN_MAPPING_GRAPH
+    # У WB -> ЛеманПро нет своего словаря: он составлен через Ozon
+    assert ('wildberries', 'lemanpro') not in MARKETPLACE_COLUMN_MAPS
+    assert COLUMN_MAPPING_GRAPH[('wildberries', 'lemanpro')]
+
+
+def test_value_fingerprints_recognise_barcodes_links_and_numbers():
+    df = pd.DataFrame({
+        'Штрихкод': ['4006381333931', '5901234123457', None],
+        'Фото': ['https://a/1.jpg', 'www.b.ru/2.jpg', 'https://c/3.jpg'],
+        'Цена': ['1 200,50', 300, 45.5],
+        'Пусто': [None, None, None],
+    })
+    fingerprints, has_values = column_value_fingerprints(df, ['Штрихкод', 'Фото', 'Цена', 'Пусто', 'Нет колонки'])
+
+    assert has_values.tolist() == [True, True, True, False, False]
+    assert fingerprints[0, 1] == 1.0      # штрихкоды EAN-13 с верной контрольной цифрой
+    assert fingerprints[1, 2] == 1.0      # ссылки
+    assert fingerprints[2, 0] == 1.0      # числа
+    assert np.isnan(fingerprints[1, 3])   # у ссылок нет порядка чисел
+
+
+def test_value_similarity_matches_columns_by_contents():
+    source = pd.DataFrame({'Код': ['4006381333931', '5901234123457'], 'Картинка': ['https://a/1.jpg', 'https://a/2.jpg']})
+    target = pd.DataFrame({'Фото': ['https://b/1.jpg'], 'EAN': ['4600000000008'], 'Пусто': [None]})
+    similarity = value_similarity_matrix(source, target, ['Код', 'Картинка'], ['Фото', 'EAN', 'Пусто'])
+
+    assert similarity.argmax(axis=1).tolist() == [1, 0]
+    assert (similarity[:, 2] == 0).all()
+
+
+def test_plan_column_transfer_skips_excluded_and_missing_columns():
+    target_indices = {'Артикул*': 1, 'Вес в упаковке, г*': 2, 'Фото': 3, 'Артикул WB': 4}
+    mapping = {
+        'Артикул продавца': 'Артикул*',
+        'Вес с упаковкой (кг)': 'Вес в упаковке, г*',
+        'Артикул WB': 'Артикул WB',
+        'Нет в источнике': 'Фото',
+        'Цвет': 'Нет в шаблоне',
+    }
+    source_columns = ['Артикул продавца', 'Вес с упаковкой (кг)', 'Артикул WB', 'Цвет']
+    plan = plan_column_transfer(mapping, source_columns, target_indices)
+
+    assert [(source_col, target_idx) for source_col, target_idx, _ in plan] == [
+        ('Артикул продавца', 1), ('Вес с упаковкой (кг)', 2)
+    ]
+
+    source_df = pd.DataFrame({'Артикул продавца': [12345, 'A-1'], 'Вес с упаковкой (кг)': ['0,5', 2]})
+    article, weight = (converter(source_df[source_col], source_df) for source_col, _, converter in plan)
+    assert article.tolist() == ['12345', 'A-1']
+    assert weight.tolist() == [500.0, 2000]
+
+
+def test_plan_column_transfer_merges_ozon_photos_for_wb():
+    mapping = {'Ссылка на главное фото*': 'Фото', 'Ссылки на дополнительные фото': 'Фото'}
+    source_df = pd.DataFrame({
+        'Ссылка на главное фото*': ['https://a/1.jpg', None],
+        'Ссылки на дополнительные фото': ['https://a/2.jpg\nhttps://a/3.jpg', 'https://b/2.jpg'],
+    })
+    plan = plan_column_transfer(mapping, source_df.columns, {'Фото': 1})
+
+    assert len(plan) == 1
+    _, _, converter = plan[0]
+    assert converter(source_df['Ссылка на главное фото*'], source_df).tolist() == [
+        'https://a/1.jpg;https://a/2.jpg;https://a/3.jpg',
+        'https://b/2.jpg',
+    ]
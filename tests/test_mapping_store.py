@@ -0,0 +1,67 @@
+import pytest
+
+from mapping_store import MappingStore, headers_fingerprint
+from utils import map_columns_automatically, resolve_stored_mapping
+
+SOURCE = ['Артикул', 'Цена', 'Бренд']
+TARGET = ['Артикул*', 'Цена, руб.*', 'Бренд*', 'Описание']
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MappingStore(str(tmp_path / 'mappings.sqlite'))
+    yield store
+    store.close()
+
+
+def test_fingerprint_ignores_order_case_and_spaces():
+    assert headers_fingerprint(['Артикул', 'Цена']) == headers_fingerprint([' цена ', 'АРТИКУЛ'])
+    assert headers_fingerprint(['Артикул']) != headers_fingerprint(['Артикул', 'Цена'])
+
+
+def test_save_get_and_replace(store):
+    store.save(SOURCE, TARGET, {'Артикул': 'Артикул*'})
+    assert store.get(['бренд', 'артикул ', 'ЦЕНА'], TARGET) == {'Артикул': 'Артикул*'}
+    assert store.get(SOURCE, TARGET[:3]) is None
+
+    store.save(SOURCE, TARGET, {'Цена': 'Цена, руб.*'})
+    assert len(store) == 1
+    assert store.get(SOURCE, TARGET) == {'Цена': 'Цена, руб.*'}
+
+
+def test_saved_mappings_survive_reopen(tmp_path):
+    path = str(tmp_path / 'mappings.sqlite')
+    store = MappingStore(path)
+    store.save(SOURCE, TARGET, {'Артикул': 'Артикул*'})
+    store.close()
+
+    reopened = MappingStore(path)
+    try:
+        assert reopened.get(SOURCE, TARGET) == {'Артикул': 'Артикул*'}
+    finally:
+        reopened.close()
+
+
+def test_find_similar_respects_threshold(store):
+    store.save(SOURCE + ['Цвет'], TARGET, {'Бренд': 'Бренд*'})
+
+    mapping, similarity = store.find_similar(SOURCE, TARGET)
+    assert mapping == {'Бренд': 'Бренд*'}
+    assert similarity == pytest.approx(3 / 4)
+    assert store.find_similar(['Штрихкод', 'Вес'], TARGET) is None
+
+
+def test_resolve_stored_mapping_uses_current_names():
+    stored = {'Артикул': 'Артикул*', 'Цена': 'Цена, руб.*', 'Удалено': 'Описание'}
+    resolved = resolve_stored_mapping(stored, ['артикул ', 'ЦЕНА'], TARGET)
+    assert resolved == {'артикул ': 'Артикул*', 'ЦЕНА': 'Цена, руб.*'}
+
+
+def test_exact_hit_keeps_saved_pairs_and_maps_the_rest(store):
+    # Сохраненная пара нарочно не совпадает с той, что подобрал бы поиск по названиям
+    store.save(SOURCE, TARGET, {'Артикул': 'Описание', 'Цена': 'Цена, руб.*'})
+
+    mapping = map_columns_automatically(['артикул ', 'ЦЕНА', 'Бренд'], TARGET, store=store)
+    assert mapping['артикул '] == 'Описание'
+    assert mapping['ЦЕНА'] == 'Цена, руб.*'
+    assert mapping['Бренд'] == 'Бренд*'
@@ -0,0 +1,46 @@
+from io import BytesIO
+
+import pandas as pd
+
+from parse_cache import ParseCache, file_fingerprint, make_cache_key
+
+
+def test_file_fingerprint_keeps_stream_position():
+    stream = BytesIO(b'xlsx content')
+    stream.seek(4)
+    assert file_fingerprint(stream) == file_fingerprint(b'xlsx content')
+    assert stream.tell() == 4
+
+
+def test_cache_key_depends_on_options():
+    fingerprint = file_fingerprint(b'xlsx content')
+    assert make_cache_key(fingerprint, sheet='Товары', header_row=1) == make_cache_key(fingerprint, header_row=1, sheet='Товары')
+    assert make_cache_key(fingerprint, sheet='Товары', header_row=1) != make_cache_key(fingerprint, sheet='Товары', header_row=2)
+
+
+def test_parse_cache_evicts_least_recently_used():
+    cache = ParseCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert len(cache) == 2
+    assert 'b' not in cache
+    assert cache.get('b', 'нет') == 'нет'
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_parse_cache_spills_evicted_entries_to_disk(tmp_path):
+    cache = ParseCache(max_entries=1, spill_dir=str(tmp_path))
+    table = pd.DataFrame({'Цена': [1.5, 2.5]})
+    cache.put('table', table)
+    cache.put('other', 'значение')
+
+    assert 'table' in cache
+    pd.testing.assert_frame_equal(cache.get('table'), table)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert 'table' not in cache
+    assert not list(tmp_path.glob('*.pkl'))
@@ -0,0 +1,121 @@
+import datetime
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from utils import iter_sheet_rows, load_excel_file, read_workbook_table
+import xlsx_reader
+from xlsx_reader import LazyWorkbook
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    """Книга из двух листов: описание и таблица товаров с пустой строкой внутри."""
+    workbook = openpyxl.Workbook()
+    info = workbook.active
+    info.title = 'Инструкция'
+    info['A1'] = 'Заполните лист Товары'
+
+    sheet = workbook.create_sheet('Товары')
+    sheet.append(['Артикул', 'Наименование', 'Цена', 'Количество', 'Дата поставки'])
+    sheet.append([10001, 'Чайник', 1500.5, 3, datetime.datetime(2024, 1, 2)])
+    sheet.append([None, None, None, None, None])
+    sheet.append(['A-2', 'Кружка', 250, None, datetime.datetime(2024, 2, 3, 10, 30)])
+
+    path = tmp_path / 'товары.xlsx'
+    workbook.save(path)
+    return str(path)
+
+
+def test_lazy_workbook_reads_directory_without_parsing_sheets(workbook_path):
+    workbook, sheet_names = load_excel_file(workbook_path, lazy=True)
+    try:
+        assert isinstance(workbook, LazyWorkbook)
+        assert sheet_names == ['Инструкция', 'Товары']
+        assert workbook.loaded_sheetnames == []
+        assert workbook.get_dimensions('Товары') == (1, 1, 5, 4)
+        with pytest.raises(KeyError):
+            workbook.get_sheet_info('Нет такого листа')
+    finally:
+        workbook.close()
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'read_only': True},
+    {'lazy': True},
+    {'engine': 'xml'},
+])
+def test_all_engines_read_the_same_table(workbook_path, options):
+    expected_workbook, _ = load_excel_file(workbook_path)
+    expected_headers, expected = read_workbook_table(expected_workbook, 'Товары', 1)
+
+    workbook, _ = load_excel_file(workbook_path, **options)
+    try:
+        headers, df = read_workbook_table(workbook, 'Товары', 1)
+    finally:
+        workbook.close()
+
+    assert headers == expected_headers == ['Артикул', 'Наименование', 'Цена', 'Количество', 'Дата поставки']
+    pd.testing.assert_frame_equal(df, expected)
+
+    # Пустая строка отброшена, артикулы - строки, целые с пропуском остаются целыми
+    assert df['Артикул'].tolist() == ['10001', 'A-2']
+    assert df['Количество'].tolist() == [3, None]
+    assert df['Дата поставки'].tolist() == [pd.Timestamp(2024, 1, 2), pd.Timestamp(2024, 2, 3, 10, 30)]
+
+
+def test_iter_sheet_rows_takes_id_columns_from_the_header_row():
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    # Пояснение над заголовками упоминает "код", но колонка не идентификатор
+    sheet.append(['Код ТН ВЭД указывается ниже', 'Пояснение'])
+    sheet.append(['Цена', 'Артикул'])
+    sheet.append([100, 12345])
+
+    rows = list(iter_sheet_rows(sheet, header_row=2))
+    assert rows[2] == (100, '12345')
+    assert list(iter_sheet_rows(sheet, header_row=2, min_row=3)) == [(100, '12345')]
+
+
+def test_parallel_load_matches_serial_load(workbook_path, monkeypatch):
+    serial = LazyWorkbook(workbook_path, engine='xml')
+    try:
+        expected = [list(sheet.values) for sheet in serial.load_sheets()]
+    finally:
+        serial.close()
+
+    # Пул процессов запускается даже для маленькой книги на одном процессоре
+    monkeypatch.setattr(xlsx_reader, 'PARALLEL_MIN_SHEET_BYTES', 0)
+    monkeypatch.setattr(xlsx_reader.os, 'cpu_count', lambda: 2)
+    workbook = LazyWorkbook(workbook_path, engine='xml')
+    try:
+        assert [list(sheet.values) for sheet in workbook.load_sheets(workers=2)] == expected
+    finally:
+        workbook.close()
+
+
+def test_parallel_load_requires_xml_engine(workbook_path):
+    workbook = LazyWorkbook(workbook_path)
+    try:
+        with pytest.raises(ValueError):
+            workbook.load_sheets(workers=2)
+    finally:
+        workbook.close()
+
+
+def test_broken_file_releases_the_mapping(tmp_path, monkeypatch):
+    path = tmp_path / 'битый.xlsx'
+    path.write_bytes(b'not a zip archive')
+
+    opened = []
+    def open_mapped(file_path):
+        opened.append(xlsx_reader.MappedFile(file_path))
+        return opened[-1]
+    monkeypatch.setattr(xlsx_reader, 'open_mapped', open_mapped)
+
+    with pytest.raises(zipfile.BadZipFile):
+        LazyWorkbook(str(path))
+    assert opened and opened[0].closed
@@ -0,0 +1,99 @@
+import datetime
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+from utils import columns_to_dataframe, transfer_data_between_tables
+
+
+def build_template():
+    """Шаблон: заголовки, подсказки и одна строка-образец с форматированием."""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Товары'
+    sheet.append(['Артикул', 'Цена', 'Количество'])
+    sheet.append(['Уникальный код товара', 'Цена в рублях', 'Остаток на складе'])
+    sheet.append(['образец', 1.0, 1])
+
+    sheet['A3'].font = Font(bold=True, color='FF0000FF')
+    sheet['A3'].alignment = Alignment(horizontal='center')
+    sheet['B3'].number_format = '#,##0.00 ₽'
+    sheet['B3'].fill = PatternFill(fill_type='solid', fgColor='FFFFFF00')
+    sheet['C3'].number_format = '0'
+    sheet['C3'].border = Border(bottom=Side(style='thin'))
+    return workbook
+
+
+def save_and_reload(workbook):
+    buffer = BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return openpyxl.load_workbook(buffer)
+
+
+def test_transfer_styles_survive_reload():
+    """Форматирование строки-образца переносится на все строки и сохраняется в файле."""
+    source_df = pd.DataFrame({
+        'Артикул продавца': ['A-1', 'A-2', 'A-3'],
+        'Цена': [100.5, 200.0, 300.25],
+        'Количество': [1, 2, 3],
+    })
+    mapping = {'Артикул продавца': 'Артикул', 'Цена': 'Цена', 'Количество': 'Количество'}
+
+    workbook = transfer_data_between_tables(source_df, build_template(), 'Товары', mapping, target_header_row=1)
+    sheet = save_and_reload(workbook)['Товары']
+
+    # Подсказки остаются на месте, данные начинаются сразу после них
+    assert sheet['A2'].value == 'Уникальный код товара'
+    assert [sheet.cell(row=row, column=1).value for row in range(3, 6)] == ['A-1', 'A-2', 'A-3']
+    assert [sheet.cell(row=row, column=2).value for row in range(3, 6)] == [100.5, 200.0, 300.25]
+    assert [sheet.cell(row=row, column=3).value for row in range(3, 6)] == [1, 2, 3]
+
+    for row in range(3, 6):
+        assert sheet.cell(row=row, column=1).font.b
+        assert sheet.cell(row=row, column=1).font.color.rgb == 'FF0000FF'
+        assert sheet.cell(row=row, column=1).alignment.horizontal == 'center'
+        assert sheet.cell(row=row, column=2).number_format == '#,##0.00 ₽'
+        assert sheet.cell(row=row, column=2).fill.fgColor.rgb == 'FFFFFF00'
+        assert sheet.cell(row=row, column=3).number_format == '0'
+        assert sheet.cell(row=row, column=3).border.bottom.style == 'thin'
+
+    # Подсказки не получают форматирование данных
+    assert not sheet['A2'].font.b
+    assert sheet['B2'].number_format == 'General'
+
+
+def test_transfer_writes_blanks_dates_and_integers():
+    """Пропуски дают пустые ячейки, даты - ячейки с форматом даты, целые с пропусками остаются целыми."""
+    source_df = columns_to_dataframe(
+        ['Количество', 'Дата поставки', 'Цена'],
+        [
+            [5, None, 7],
+            [datetime.datetime(2024, 1, 2), None, datetime.datetime(2024, 1, 3, 5, 6)],
+            [100.5, None, 300.25],
+        ],
+    )
+    assert source_df['Количество'].tolist() == [5, None, 7]
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Поставки'
+    sheet.append(['Количество', 'Дата поставки', 'Цена'])
+    mapping = {column: column for column in source_df.columns}
+
+    workbook = transfer_data_between_tables(source_df, workbook, 'Поставки', mapping, target_header_row=1)
+    sheet = save_and_reload(workbook)['Поставки']
+
+    assert [sheet.cell(row=row, column=1).value for row in range(2, 5)] == [5, None, 7]
+    assert isinstance(sheet['A2'].value, int)
+    assert [sheet.cell(row=row, column=3).value for row in range(2, 5)] == [100.5, None, 300.25]
+
+    assert sheet['B2'].value == datetime.datetime(2024, 1, 2)
+    assert sheet['B2'].number_format == 'dd.mm.yyyy'
+    assert sheet['B4'].value == datetime.datetime(2024, 1, 3, 5, 6)
+    assert sheet['B4'].number_format == 'dd.mm.yyyy hh:mm:ss'
+
+    # Пустые ячейки не попадают в файл
+    assert all(sheet.cell(row=3, column=col).value is None for col in range(1, 4))
@@ -1,63 +1,195 @@
 import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_datetime64_any_dtype
 import numpy as np
 import openpyxl
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
-from fuzzywuzzy import fuzz
+from openpyxl.styles import NamedStyle
+from openpyxl.styles.numbers import is_date_format
+from fuzzywuzzy import utils as fuzz_utils
+from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
 import io
 import re
+import datetime
 import os
+import functools
+
+import marketplace_detection
+from marketplace_signatures import (
+    COLUMN_CHECKS,
+    FILE_NAME_RULES,
+    FORCED_SHEETS,
+    HEADER_ROWS_TO_CHECK,
+    ID_FIELD_MARKETPLACES,
+    MARKETPLACES,
+    SHEET_MARKETPLACES,
+    SHEET_RULES,
+    TEMPLATE_EXACT_FIELDS,
+    TEMPLATE_MARKETPLACES,
+    TEMPLATE_SPECIAL_MARKERS,
+    discard_row_cache,
+    get_row_cache,
+    match_row
+)
+from mapping_store import normalize_header
+from xlsx_reader import LazyWorkbook, WorkbookHead, open_mapped
 
 # Глобальные переменные
 # Колонки, которые не должны переноситься при копировании данных
 excluded_columns = ['Артикул WB', 'Название модели (для объединения в одну карточку)*']
 
-def load_excel_file(file):
+# Ключевые слова в заголовках, по которым колонка считается идентификатором (артикул, SKU и т.д.)
+ID_COLUMN_KEYWORDS = ['артикул', 'sku', 'guid', 'штрихкод', 'баркод', 'код']
+
+def is_id_header(value):
+    """Проверяет, является ли заголовок колонки заголовком идентификатора (артикул, SKU и т.д.)"""
+    if not value or not isinstance(value, str):
+        return False
+    value_lower = value.lower()
+    return any(id_word in value_lower for id_word in ID_COLUMN_KEYWORDS)
+
+def get_id_columns(headers):
+    """
+    Возвращает заголовки колонок-идентификаторов из строки заголовков.
+    
+    Args:
+        headers: Список заголовков колонок
+        
+    Returns:
+        list: Заголовки, значения которых нужно хранить как строки
+    """
+    return [header for header in headers if is_id_header(header)]
+
+def coerce_id_columns(df, id_columns=None):
+    """
+    Преобразует значения колонок-идентификаторов в строки целиком по колонке.
+    Пустые значения остаются пустыми (None), а не превращаются в строку 'None'.
+    
+    DataFrame должен быть построен с dtype=object, иначе числовые идентификаторы
+    с пропусками успеют превратиться в float (например, '4600000000000.0').
+    
+    Args:
+        df: DataFrame с данными листа
+        id_columns: Список колонок-идентификаторов (по умолчанию определяется по заголовкам)
+        
+    Returns:
+        DataFrame: Тот же DataFrame с преобразованными колонками
+    """
+    if id_columns is None:
+        id_columns = get_id_columns(df.columns)
+    
+    for col in id_columns:
+        values = df[col].to_numpy(dtype=object)
+        mask = pd.notna(values)
+        if mask.any():
+            values = values.copy()
+            values[mask] = values[mask].astype(str)
+            df[col] = values
+    
+    return df
+
+def iter_sheet_rows(sheet, header_row, min_row=1, max_row=None):
+    """
+    Лениво возвращает значения строк листа (как iter_rows(values_only=True)),
+    на лету преобразуя в строки значения колонок-идентификаторов под строкой заголовков.
+    Колонки-идентификаторы определяются по заголовкам строки header_row.
+    Работает как с обычными листами, так и с листами книги, открытой в режиме read_only.
+    
+    Args:
+        sheet: Лист Excel
+        header_row: Номер строки с заголовками (начиная с 1)
+        min_row: Номер первой возвращаемой строки (начиная с 1)
+        max_row: Номер последней возвращаемой строки или None (до конца листа)
+        
+    Yields:
+        tuple: Значения ячеек строки
+    """
+    first_row = min(min_row, header_row)
+    id_columns = []
+    
+    for row_idx, row in enumerate(sheet.iter_rows(min_row=first_row, max_row=max_row, values_only=True), start=first_row):
+        if row_idx == header_row:
+            id_columns = [col_idx for col_idx, value in enumerate(row) if is_id_header(value)]
+        elif id_columns and row_idx > header_row:
+            values = list(row)
+            for col_idx in id_columns:
+                if col_idx < len(values) and values[col_idx] is not None:
+                    values[col_idx] = str(values[col_idx])
+            row = tuple(values)
+        
+        if row_idx >= min_row:
+            yield row
+
+def load_excel_file(file, read_only=False, lazy=False, engine='openpyxl', workers=None):
     """
     Загружает Excel файл и возвращает объект рабочей книги и список листов.
-    Обрабатывает и преобразует специфические для маркетплейсов поля (артикулы, SKU) в строковый формат
-    для избежания ошибок конвертации.
+    
+    Значения идентификаторов (артикулы, SKU) в книге не переписываются: они преобразуются
+    в строки по колонкам при построении DataFrame (см. coerce_id_columns) или на лету
+    при чтении строк через iter_sheet_rows.
+    
+    В режиме read_only книга открывается потоково: ячейки не загружаются в память целиком,
+    а читаются при обходе листа.
+    
+    В режиме lazy возвращается LazyWorkbook: сначала читается только оглавление книги
+    (xl/workbook.xml), а лист разбирается при первом обращении и кешируется.
+    
+    Движок engine='xml' (только для чтения, всегда с ленивой загрузкой листов) разбирает
+    sharedStrings.xml и XML листов собственным потоковым парсером без объектов ячеек openpyxl
+    и умеет читать таблицу листа сразу в колонки (см. read_workbook_table).
+    
+    Параметр workers (только для engine='xml') сразу разбирает все листы книги параллельно
+    в пуле из workers процессов; это полезно для многолистовых шаблонов, где поиск нужного
+    листа (find_best_marketplace_sheet) все равно обращается к каждому листу.
+    
+    Файл можно передать путем (для пакетной обработки файлов с диска): при полной загрузке
+    он открывается через mmap, и члены архива читаются прямо из отображения, не копируя архив
+    в память процесса; в режиме read_only файл открывает и закрывает (workbook.close()) сама книга.
     
     Args:
-        file: Загруженный файл в формате BytesIO
+        file: Загруженный файл в формате BytesIO или путь к файлу
+        read_only: Открыть книгу в потоковом режиме только для чтения (для исходных файлов)
+        lazy: Разбирать листы только при первом обращении к ним (только для чтения)
+        engine: Движок чтения: 'openpyxl' или 'xml'
+        workers: Число процессов для параллельного разбора листов (None - без предварительного разбора)
         
     Returns:
         Tuple: (workbook, list_of_sheets)
     """
     try:
-        # Загружаем с data_only=True, чтобы получить значения, а не формулы
-        workbook = openpyxl.load_workbook(file, data_only=True)
-        sheets = workbook.sheetnames
+        if lazy or engine != 'openpyxl':
+            # Читаем только оглавление книги, листы будут разобраны по требованию
+            workbook = LazyWorkbook(file, engine=engine)
+            if workers:
+                workbook.load_sheets(workers=workers)
+            return workbook, workbook.sheetnames
         
-        # Обрабатываем все листы для преобразования идентификаторов в строки
-        for sheet_name in sheets:
-            sheet = workbook[sheet_name]
-            
-            # Находим заголовки, которые содержат идентификаторы (артикулы, SKU и т.д.)
-            id_columns = []  # Столбцы, содержащие идентификаторы
-            header_row = 1  # По умолчанию проверяем первые 5 строк
+        if read_only:
+            # Потоковый режим: листы разбираются только при обращении к их строкам.
+            # Путь передается openpyxl как есть, без mmap: архив сам открывает файл и закрывает его
+            # вместе с книгой (workbook.close()), а переданный ему файловый объект ZipFile не закрывает
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
             
-            # Ищем заголовки в первых 5 строках
-            for row_idx in range(1, 6):
-                for col_idx in range(1, sheet.max_column + 1):
-                    cell = sheet.cell(row=row_idx, column=col_idx)
-                    if cell.value and isinstance(cell.value, str):
-                        cell_value_lower = cell.value.lower()
-                        # Проверяем, содержит ли заголовок ключевые слова для идентификаторов
-                        if any(id_word in cell_value_lower for id_word in ['артикул', 'sku', 'guid', 'штрихкод', 'баркод', 'код']):
-                            id_columns.append(col_idx)
-                            header_row = row_idx
+            # Некоторые программы не записывают размеры листа; вычисляем их, чтобы max_row был определен
+            for sheet in workbook.worksheets:
+                if sheet.max_row is None:
+                    sheet.calculate_dimension(force=True)
             
-            # Если нашли идентификаторы, преобразуем их значения в строки
-            if id_columns:
-                for col_idx in id_columns:
-                    for row_idx in range(header_row + 1, sheet.max_row + 1):
-                        cell = sheet.cell(row=row_idx, column=col_idx)
-                        if cell.value is not None:
-                            # Преобразуем все в строку, включая числа
-                            cell.value = str(cell.value)
-        
-        return workbook, sheets
+            return workbook, workbook.sheetnames
+        
+        mapped = None
+        if isinstance(file, (str, os.PathLike)):
+            file = mapped = open_mapped(file)
+        
+        # Загружаем с data_only=True, чтобы получить значения, а не формулы
+        try:
+            workbook = openpyxl.load_workbook(file, data_only=True)
+        finally:
+            # После полной загрузки архив больше не нужен
+            if mapped is not None:
+                mapped.close()
+        
+        return workbook, workbook.sheetnames
     except Exception as e:
         error_str = str(e)
         if "expected <class 'openpyxl.worksheet.cell_range.MultiCellRange'>" in error_str:
@@ -66,6 +198,232 @@ def load_excel_file(file):
         else:
             raise Exception(f"Ошибка при загрузке Excel файла: {error_str}")
             
+def make_unique_headers(headers):
+    """
+    Делает заголовки уникальными: повторяющиеся получают суффикс _1, _2 и т.д.
+    
+    Args:
+        headers: Список заголовков
+        
+    Returns:
+        list: Новый список уникальных заголовков
+    """
+    headers = list(headers)
+    unique_headers = {}
+    for i, header in enumerate(headers):
+        if header in unique_headers:
+            # Если заголовок уже существует, добавляем суффикс
+            counter = 1
+            new_header = f"{header}_{counter}"
+            while new_header in unique_headers:
+                counter += 1
+                new_header = f"{header}_{counter}"
+            headers[i] = new_header
+        unique_headers[headers[i]] = True
+    return headers
+
+def columns_to_dataframe(headers, columns):
+    """
+    Строит DataFrame из готовых колонок, сохраняя собственные типы данных.
+    Колонки-идентификаторы (артикулы, SKU, штрихкоды) приводятся к строкам,
+    остальные получают свой тип (числа остаются числами, пустые ячейки - пропусками).
+    
+    Args:
+        headers: Список заголовков
+        columns: Список колонок (последовательностей значений) в порядке заголовков
+        
+    Returns:
+        DataFrame: Таблица с данными
+    """
+    # Сначала строим с dtype=object, чтобы числовые идентификаторы не превратились в float
+    df = pd.DataFrame(dict(enumerate(columns)), columns=range(len(headers)), dtype=object)
+    df.columns = headers
+    
+    # Идентификаторы приводим к строкам целиком по колонкам
+    id_columns = [df.columns[i] for i, header in enumerate(headers) if is_id_header(header)]
+    if id_columns:
+        df = coerce_id_columns(df, id_columns)
+    
+    # Остальным колонкам возвращаем собственные типы (int, float, datetime)
+    inferred = df.infer_objects()
+    
+    # Целые числа с пустыми ячейками infer_objects переводит в float (1 -> 1.0):
+    # такие колонки оставляем объектами, чтобы целые остались целыми, а пропуски - None
+    for col_idx in np.flatnonzero((inferred.dtypes == np.float64).to_numpy()):
+        column = df.iloc[:, col_idx]
+        filled = column[column.notna()]
+        if len(filled) < len(column) and all(
+            isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in filled
+        ):
+            inferred.isetitem(col_idx, column)
+    return inferred
+
+def sheet_to_dataframe(sheet, header_row):
+    """
+    Читает таблицу с листа в DataFrame: заголовки из строки header_row и данные под ними.
+    Колонки строятся напрямую из значений листа за один проход по строкам, полностью
+    пустые строки отбрасываются, а строковое преобразование применяется только к идентификаторам.
+    Пустые заголовки пропускаются, дублирующиеся получают суффикс _1, _2 и т.д.
+    
+    Args:
+        sheet: Лист Excel (openpyxl или LazyWorkbook)
+        header_row: Номер строки с заголовками (начиная с 1)
+        
+    Returns:
+        DataFrame: Таблица с данными (заголовки - в df.columns)
+    """
+    headers = []
+    column_indices = []
+    
+    # Собираем заголовки и их индексы
+    for i, cell in enumerate(sheet[header_row]):
+        if cell.value is not None and str(cell.value).strip() != "":
+            headers.append(str(cell.value))
+            column_indices.append(i)
+    
+    # Проверяем на дубликаты и исправляем
+    headers = make_unique_headers(headers)
+    
+    # Раскладываем значения строк сразу по колонкам таблицы (короткие строки дополняются None);
+    # идентификаторы приводятся к строкам уже в columns_to_dataframe
+    columns = [[] for _ in column_indices]
+    for row in sheet.iter_rows(min_row=header_row + 1, values_only=True):
+        # Полностью пустые строки отбрасываем
+        if all(value is None for value in row):
+            continue
+        row_length = len(row)
+        for column, col_idx in zip(columns, column_indices):
+            column.append(row[col_idx] if col_idx < row_length else None)
+    
+    return columns_to_dataframe(headers, columns)
+
+def read_workbook_table(workbook, sheet_name, header_row):
+    """
+    Читает таблицу листа книги так же, как sheet_to_dataframe.
+    Для книги с движком 'xml' значения читаются из XML сразу в колонки, без построения строк.
+    
+    Args:
+        workbook: Рабочая книга (openpyxl или LazyWorkbook)
+        sheet_name: Имя листа
+        header_row: Номер строки с заголовками (начиная с 1)
+        
+    Returns:
+        tuple: (список заголовков, DataFrame с данными)
+    """
+    if not isinstance(workbook, LazyWorkbook) or workbook.engine != 'xml':
+        df = sheet_to_dataframe(workbook[sheet_name], header_row)
+        return list(df.columns), df
+    
+    header_cells, columns = workbook.read_columns(sheet_name, header_row)
+    header_cells = [(col_idx, str(value)) for col_idx, value in header_cells if str(value).strip() != ""]
+    headers = make_unique_headers([value for _, value in header_cells])
+    
+    df = columns_to_dataframe(headers, [columns[col_idx] for col_idx, _ in header_cells])
+    return headers, df
+
+# Оценки строки-кандидата в заголовки (rank_header_rows)
+HEADER_RULE_SCORE = 100.0       # ключевое поле правила по имени листа в ожидаемой строке
+HEADER_TYPICAL_SCORE = 50.0     # не меньше 2 маркеров маркетплейса в его типичной строке заголовков
+HEADER_MARKER_WEIGHT = 5.0      # за каждый общий маркер заголовков (артикул, цена, бренд...)
+HEADER_MAX_MARKERS = 6
+HEADER_MAX_TEXT_CELLS = 10      # короткие текстовые ячейки (по 1 баллу)
+HEADER_LONG_CELL_LENGTH = 80    # ячейки длиннее считаются текстом инструкции, а не заголовком
+HEADER_LONG_CELL_PENALTY = 2.0
+HEADER_NUMERIC_CELL_PENALTY = 1.0
+HEADER_MIN_SCORE = 5.0          # минимальная оценка строки заголовков по содержимому
+HEADER_LOOKAHEAD_ROWS = 5       # сколько строк просматривается после лучшей найденной
+# HEADER_TYPICAL_SCORE больше наибольшей оценки по содержимому
+# (HEADER_MARKER_WEIGHT * HEADER_MAX_MARKERS + HEADER_MAX_TEXT_CELLS = 40)
+
+def score_header_row(rows, row_idx):
+    """
+    Оценивает строку листа как строку заголовков по ее содержимому: общие маркеры заголовков
+    и короткие текстовые ячейки повышают оценку, длинный текст (баннеры и инструкции, как
+    в первой строке шаблона Ozon) и числа (строки данных) - понижают.
+    
+    Args:
+        rows: Кеш строк листа (marketplace_signatures.NormalizedRowCache)
+        row_idx: Номер строки (начиная с 1)
+        
+    Returns:
+        float: Оценка строки
+    """
+    text_cells = long_cells = numeric_cells = 0
+    for value, text in zip(rows.raw(row_idx), rows.values(row_idx)):
+        if not value or not text:
+            continue
+        if isinstance(value, (int, float)) or text.replace('.', '', 1).replace(',', '', 1).isdigit():
+            numeric_cells += 1
+        elif len(text) > HEADER_LONG_CELL_LENGTH:
+            long_cells += 1
+        else:
+            text_cells += 1
+    
+    markers = rows.match(row_idx).count('header_row.all_markers')
+    return (
+        HEADER_MARKER_WEIGHT * min(markers, HEADER_MAX_MARKERS)
+        + min(text_cells, HEADER_MAX_TEXT_CELLS)
+        - HEADER_LONG_CELL_PENALTY * long_cells
+        - HEADER_NUMERIC_CELL_PENALTY * numeric_cells
+    )
+
+def rank_header_rows(worksheet, sheet_name=None, max_rows=30):
+    """
+    Оценивает строки верхней части листа как строки заголовков и возвращает кандидатов
+    по убыванию оценки. Сначала проверяются строки из правил по имени листа, затем типичные
+    строки заголовков маркетплейсов (marketplace_signatures.json); их оценка выше любой оценки
+    по содержимому, поэтому при совпадении остальные строки не читаются. Иначе строки
+    просматриваются сверху вниз и просмотр заканчивается через HEADER_LOOKAHEAD_ROWS строк
+    после лучшей строки (ниже заголовков идут данные).
+    
+    Args:
+        worksheet: Лист Excel
+        sheet_name: Имя листа (для специальной обработки шаблонов)
+        max_rows: Максимальное количество строк для поиска заголовков
+        
+    Returns:
+        list: Кортежи (номер строки, оценка) по убыванию оценки (при равенстве - верхняя строка);
+              пустой список, если строк нет
+    """
+    sheet_name_lower = (sheet_name or "").lower()
+    
+    # Строки листа читаются и нормализуются один раз (см. marketplace_signatures.NormalizedRowCache),
+    # даже если строку проверяют несколько правил или другие детекторы
+    rows = get_row_cache(worksheet)
+    last_row = min(max_rows, worksheet.max_row)
+    
+    # Правила по имени листа (sheet_rules в marketplace_signatures.json): например, Ozon - строка 2
+    # на листе "Шаблон", Wildberries - строка 3 на листе "Товары", Яндекс.Маркет - сначала строка 4,
+    # затем 2 на листе "Данные о товарах", ЛеманПро - строка 4
+    for rule in SHEET_RULES:
+        if any(name in sheet_name_lower for name in rule['sheet_names']):
+            for row_idx in rule['rows']:
+                if worksheet.max_row >= row_idx:
+                    row = rows.match(row_idx)
+                    if any(row.has(field) for field in rule['key_fields']):
+                        return [(row_idx, HEADER_RULE_SCORE + score_header_row(rows, row_idx))]
+    
+    # Типичные строки заголовков каждого маркетплейса (хотя бы 2 маркера шаблона)
+    scores = {}
+    for row_idx, markers in HEADER_ROWS_TO_CHECK:
+        if worksheet.max_row >= row_idx and row_idx not in scores:
+            if rows.match(row_idx).count(markers) >= 2:
+                scores[row_idx] = HEADER_TYPICAL_SCORE + score_header_row(rows, row_idx)
+    if scores:
+        # Оценка типичной строки выше наибольшей оценки по содержимому - остальные строки не нужны
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    
+    # Оценка по содержимому строк сверху вниз
+    best_row = None
+    for row_idx in range(1, last_row + 1):
+        scores[row_idx] = score_header_row(rows, row_idx)
+        if scores[row_idx] >= HEADER_MIN_SCORE and (best_row is None or scores[row_idx] > scores[best_row]):
+            best_row = row_idx
+        if best_row is not None and row_idx - best_row >= HEADER_LOOKAHEAD_ROWS:
+            break
+    
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
 def find_header_row(worksheet, sheet_name=None, max_rows=30):
     """
     Находит строку заголовков в Excel файле с учетом типичного расположения для каждого маркетплейса.
@@ -74,6 +432,7 @@ def find_header_row(worksheet, sheet_name=None, max_rows=30):
     - Wildberries: строка 3 на листе "Товары"
     - ЛеманПро: строка 4 (имя листа часто совпадает с именем файла)
     - Яндекс.Маркет: строка 2 на листе "Данные о товарах"
+    Остальные листы оцениваются по содержимому строк (см. rank_header_rows).
     
     Args:
         worksheet: Лист Excel
@@ -83,86 +442,9 @@ def find_header_row(worksheet, sheet_name=None, max_rows=30):
     Returns:
         int: Номер строки с заголовками (начиная с 1) или 1, если не найдено
     """
-    if not sheet_name:
-        sheet_name = ""
-    
-    sheet_name_lower = sheet_name.lower()
-    
-    # ПРАВИЛО 1: Ozon - строка 2 на листе "Шаблон"
-    if "шаблон" in sheet_name_lower or "template" in sheet_name_lower or "ozon" in sheet_name_lower:
-        # Проверим заголовки второй строки на типичные для Ozon
-        if worksheet.max_row >= 2:
-            row_values = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[2]]
-            if any('артикул*' in val for val in row_values) or any('название товара*' in val for val in row_values):
-                return 2
-    
-    # ПРАВИЛО 2: Wildberries - строка 3 на листе "Товары"
-    if "товары" in sheet_name_lower or "wildberries" in sheet_name_lower or "wb" in sheet_name_lower:
-        # Проверим заголовки третьей строки на типичные для WB
-        if worksheet.max_row >= 3:
-            row_values = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[3]]
-            if any('артикул продавца' in val for val in row_values) or any('артикул wb' in val for val in row_values):
-                return 3
-    
-    # ПРАВИЛО 3: Яндекс.Маркет - проверяем и строку 2, и строку 4 на листе "Данные о товарах"
-    if "данные о товарах" in sheet_name_lower or "яндекс" in sheet_name_lower or "market" in sheet_name_lower:
-        # Сначала проверим заголовки в 4-й строке (приоритетно)
-        if worksheet.max_row >= 4:
-            row_values_4 = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[4]]
-            if any('ваш sku' in val for val in row_values_4) or any('качество карточки' in val for val in row_values_4):
-                return 4
-                
-        # Затем проверим заголовки во 2-й строке
-        if worksheet.max_row >= 2:
-            row_values_2 = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[2]]
-            if any('ваш sku' in val for val in row_values_2) or any('качество карточки' in val for val in row_values_2):
-                return 2
-    
-    # ПРАВИЛО 4: ЛеманПро - строка 4, имя листа часто совпадает с именем файла
-    # Для ЛеманПро сначала проверим 4-ю строку
-    if "леман" in sheet_name_lower or "leman" in sheet_name_lower or "атем" in sheet_name_lower or "atem" in sheet_name_lower:
-        if worksheet.max_row >= 4:
-            row_values = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[4]]
-            if any('guid' in val for val in row_values) or any('товара мерчанта' in val for val in row_values):
-                return 4
-    
-    # Если не сработали правила по имени листа, проверяем содержимое по строкам
-    
-    # Сначала проверяем типичные строки заголовков для каждого маркетплейса
-    header_rows_to_check = [
-        (2, ['артикул*', 'название товара*', 'цена, руб.*', 'ozon id']),  # Ozon
-        (3, ['артикул продавца', 'артикул wb', 'наименование', 'фото']),  # Wildberries
-        (4, ['guid', 'наименование товара мерчанта', 'бренд товара']),     # ЛеманПро
-        (4, ['ваш sku', 'ваш sku *', 'название товара *', 'качество карточки']), # Яндекс.Маркет (строка 4)
-        (2, ['ваш sku', 'ваш sku *', 'название товара *', 'качество карточки'])  # Яндекс.Маркет (строка 2)
-    ]
-    
-    for row_idx, markers in header_rows_to_check:
-        if worksheet.max_row >= row_idx:
-            row_values = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[row_idx]]
-            matches = sum(1 for marker in markers if any(marker in val for val in row_values))
-            if matches >= 2:  # Если нашли хотя бы 2 маркера
-                return row_idx
-    
-    # Если не нашли по типичным строкам, проверяем все строки до max_rows
-    # Определим характерные маркеры для всех маркетплейсов
-    all_markers = [
-        'артикул', 'название', 'наименование', 'цена', 'бренд', 'фото', 'sku',
-        'guid', 'баркод', 'штрихкод', 'группа', 'категория'
-    ]
-    
-    for row_idx in range(1, min(max_rows + 1, worksheet.max_row + 1)):
-        row_values = [str(cell.value).strip().lower() if cell.value else '' for cell in worksheet[row_idx]]
-        
-        # Считаем количество найденных маркеров
-        matches = sum(1 for marker in all_markers if any(marker in val for val in row_values))
-        
-        # Также проверяем количество непустых ячеек
-        non_empty_count = sum(1 for val in row_values if val)
-        
-        # Если нашли много маркеров или много непустых ячеек, считаем это строкой заголовков
-        if matches >= 3 or non_empty_count >= 5:
-            return row_idx
+    candidates = rank_header_rows(worksheet, sheet_name, max_rows)
+    if candidates and candidates[0][1] >= HEADER_MIN_SCORE:
+        return candidates[0][0]
     
     # Если ничего не нашли, возвращаем 1 (первая строка)
     return 1
@@ -193,91 +475,26 @@ def find_best_marketplace_sheet(workbook):
     Returns:
         tuple: (имя_листа, тип_маркетплейса, строка_с_заголовками)
     """
-    # 1. Жесткая обработка для шаблона АТЁМ - важно, чтобы работало во всех случаях
-    for sheet_name in workbook.sheetnames:
-        if "атём" in sheet_name.lower() or "атем" in sheet_name.lower() or "atem" in sheet_name.lower():
-            return sheet_name, 'lemanpro', 4
-    
-    # Характерные признаки для каждого маркетплейса на основе реальных примеров заголовков
-    marketplace_signatures = {
-        'ozon': {
-            'unique_fields': [
-                'артикул*', 'название товара*', 'название товара', 'бренд*', 'бренд', 'цена, руб.*', 'цена, руб',
-                'ндс, %*', 'вес в упаковке, г*', 'ширина упаковки, мм*', 'длина упаковки, мм*', 
-                'высота упаковки, мм*', 'ссылка на главное фото*', 'ссылки на дополнительные фото',
-                'ozon id', 'название модели', 'тип*'
-            ],
-            'common_sheet_names': ['шаблон', 'template', 'import', 'товары ozon', 'озон'],
-            'header_rows': [2, 1],
-            'units': ['мм', 'г'],  # Использует миллиметры и граммы
-            'asterisk': True  # Обязательные поля помечены *
-        },
-        'wildberries': {
-            'unique_fields': [
-                'артикул wb', 'артикул продавца', 'категория продавца', 'баркод', 'штрихкод',
-                'группа', 'наименование', 'бренд', 'описание', 'фото', 'видео', 'цвет', 
-                'вес с упаковкой (кг)', 'ставка ндс', 'высота упаковки', 'ширина упаковки',
-                'длина упаковки'
-            ],
-            'common_sheet_names': ['товары', 'products', 'карточки', 'номенклатуры', 'wildberries', 'вб'],
-            'header_rows': [3, 2, 1],
-            'units': ['кг'],  # Использует килограммы
-            'asterisk': False  # Не использует звездочки для обязательных полей
-        },
-        'lemanpro': {
-            'unique_fields': [
-                'guid', 'наименование товара мерчанта', 'бренд товара', 'модель товара', 
-                'артикул товара', 'серия/коллекция', 'штрих-код', 'размеры в упаковке: ширина (мм)',
-                'размеры в упаковке: длина (мм)', 'размеры в упаковке: высота (мм)', 
-                'цветовая палитра', 'тип упаковки', 'тип продукта', 'основной материал',
-                'нетто', 'страна производства'
-            ],
-            'common_sheet_names': ['леманпро', 'leman', 'lp', 'товары леман'],
-            'header_rows': [4, 3],
-            'units': ['мм', 'кг'],  # Использует миллиметры и килограммы
-            'asterisk': False,  # Не использует звездочки для обязательных полей
-            'row4_headers': ['guid', 'код тн вэд', 'наименование товара мерчанта', 'бренд товара', 'модель товара'] # Типичные первые 5 заголовков ЛеманПро в строке 4
-        },
-        'yandex': {
-            'unique_fields': [
-                'ваш sku', 'ваш sku *', 'качество карточки', 'рекомендации по заполнению', 
-                'название группы вариантов', 'название товара *', 'название товара', 
-                'ссылка на изображение *', 'ссылка на изображение', 'изображение для миниатюры', 
-                'бренд *', 'бренд', 'штрихкод *', 'штрихкод', 'теги', 'габариты с упаковкой, см',
-                'цена *', 'зачёркнутая цена', 'sku на маркете', 'в архиве',
-                'грузоподъемность, кг', 'диаметр колеса, см'
-            ],
-            'common_sheet_names': ['данные о товарах', 'товары яндекс', 'яндекс маркет', 'yandex', 'маркет'],
-            'header_rows': [4, 2, 1],  # Добавляем строку 4 как приоритетную для Яндекс.Маркет
-            'units': ['см', 'кг'],  # Использует сантиметры и килограммы
-            'asterisk': True,  # Обязательные поля помечены *
-            'row4_headers': ['ваш sku *', 'качество карточки', 'рекомендации по заполнению', 'название товара *', 'ссылка на изображение *'] # Типичные первые 5 заголовков Яндекс.Маркет в строке 4
-        }
-    }
+    # Характерные признаки каждого маркетплейса (типичные имена листов, строки заголовков, характерные поля,
+    # единицы измерения, звездочки у обязательных полей) описаны в реестре marketplace_signatures.json
     
-    # Словарь для маппинга уникальных идентификаторов товара между площадками
-    id_mappings = {
-        'guid': 'lemanpro',
-        'артикул товара': 'lemanpro',
-        'артикул продавца': 'wildberries',
-        'ваш sku': 'yandex',
-        'ваш sku *': 'yandex',
-        'артикул*': 'ozon',
-        'артикул wb': 'wildberries'
-    }
+    # 1. Жесткая обработка листов, которые всегда относятся к одному шаблону (например, АТЁМ)
+    for rule in FORCED_SHEETS:
+        for sheet_name in workbook.sheetnames:
+            if any(name in sheet_name.lower() for name in rule['sheet_names']):
+                return sheet_name, rule['marketplace'], rule['header_row']
     
-    # Функция для нормализации текста
-    def normalize_text(text):
-        if text is None:
-            return ''
-        return str(text).lower().strip()
+    # Строки листов читаются и нормализуются один раз (см. marketplace_signatures.NormalizedRowCache)
+    def match_sheet_row(sheet, row_idx):
+        return get_row_cache(sheet).match(row_idx)
     
     # 2. Проверяем характерные имена листов
     for sheet_name in workbook.sheetnames:
         sheet_name_lower = sheet_name.lower()
         
-        for marketplace, signature in marketplace_signatures.items():
-            for common_name in signature['common_sheet_names']:
+        for marketplace in SHEET_MARKETPLACES:
+            signature = MARKETPLACES[marketplace]
+            for common_name in signature['sheet_names']:
                 if common_name in sheet_name_lower:
                     # Нашли потенциальное совпадение по имени листа
                     sheet = workbook[sheet_name]
@@ -285,11 +502,8 @@ def find_best_marketplace_sheet(workbook):
                     # Проверяем характерные строки заголовков для данного маркетплейса
                     for header_row in signature['header_rows']:
                         if sheet.max_row >= header_row:
-                            header_values = [normalize_text(cell.value) for cell in sheet[header_row]]
-                            
                             # Проверяем наличие характерных полей
-                            unique_fields_found = sum(1 for field in signature['unique_fields'] 
-                                                     if any(field in val for val in header_values))
+                            unique_fields_found = match_sheet_row(sheet, header_row).count(f'{marketplace}.unique_fields')
                             
                             # Если нашли достаточно характерных полей, считаем, что определили маркетплейс
                             if unique_fields_found >= 3:  # Минимум 3 характерных поля для надежного определения
@@ -302,46 +516,35 @@ def find_best_marketplace_sheet(workbook):
         # Проверяем строки с 1 по 5, где могут быть заголовки
         for row_idx in range(1, min(6, sheet.max_row + 1)):
             if sheet.max_row >= row_idx:
-                row_values = [normalize_text(cell.value) for cell in sheet[row_idx]]
+                row = match_sheet_row(sheet, row_idx)
+                has_asterisks = row.has('*')
                 
                 # Проверяем каждый маркетплейс
                 marketplace_scores = {}
                 
-                for marketplace, signature in marketplace_signatures.items():
+                for marketplace in SHEET_MARKETPLACES:
+                    signature = MARKETPLACES[marketplace]
                     score = 0
                     
-                    # Проверяем наличие уникальных полей
-                    for field in signature['unique_fields']:
-                        for val in row_values:
-                            if field in val:
-                                score += 2  # Более высокий вес для уникальных полей
-                                break  # Идем к следующему полю
+                    # Проверяем наличие уникальных полей (более высокий вес)
+                    score += 2 * row.count(f'{marketplace}.unique_fields')
                     
                     # Проверяем наличие звездочек (характерно для Ozon и Яндекс.Маркет)
-                    has_asterisks = any('*' in val for val in row_values if val)
                     if has_asterisks == signature['asterisk']:
                         score += 3
                     
                     # Проверяем используемые единицы измерения
-                    for unit in signature['units']:
-                        if any(unit in val for val in row_values):
-                            score += 1
+                    score += row.count(f'{marketplace}.units')
                     
                     # Проверяем идентификаторы товаров 
-                    for id_field, id_marketplace in id_mappings.items():
-                        if id_marketplace == marketplace and any(id_field in val for val in row_values):
+                    for id_field, id_marketplace in ID_FIELD_MARKETPLACES.items():
+                        if id_marketplace == marketplace and row.has(id_field):
                             score += 4  # Высокий вес для полей-идентификаторов
                     
-                    # Особая проверка для ЛеманПро - заголовки в 4-й строке
-                    if row_idx == 4 and marketplace == 'lemanpro':
-                        score += 5
-                        
-                    # Особая проверка для Ozon - заголовки во 2-й строке
-                    if row_idx == 2 and marketplace == 'ozon' and has_asterisks:
-                        score += 5
-                        
-                    # Особая проверка для WB - заголовки в 3-й строке
-                    if row_idx == 3 and marketplace == 'wildberries' and any('артикул wb' in val for val in row_values):
+                    # Особая проверка типичной строки заголовков (ЛеманПро - 4-я строка,
+                    # Ozon - 2-я строка со звездочками, WB - 3-я строка с артикулом WB)
+                    bonus = signature.get('row_bonus')
+                    if bonus and row_idx == bonus['row'] and (bonus['requires'] is None or row.has(bonus['requires'])):
                         score += 5
                     
                     # Сохраняем оценку для маркетплейса
@@ -352,20 +555,16 @@ def find_best_marketplace_sheet(workbook):
                 if best_marketplace[1] >= 5:  # Минимальный порог оценки для надежного определения
                     return sheet_name, best_marketplace[0], row_idx
     
-    # 4. Проверка для шаблонов Ozon (характерная черта - лист "Шаблон")
-    if 'Шаблон' in workbook.sheetnames:
-        sheet = workbook['Шаблон']
-        # В шаблонах Ozon заголовки обычно на второй строке
-        if sheet.max_row >= 2:
-            row_values = [str(cell.value).strip() if cell.value else '' for cell in sheet[2]]
-            header_indicators = ['артикул', 'название', 'фото', 'бренд', 'цена']
-            found_headers = 0
-            for val in row_values:
-                if any(indicator in val.lower() for indicator in header_indicators):
-                    found_headers += 1
-                    
-            if found_headers >= 1:
-                return 'Шаблон', 'ozon', 2
+    # 4. Проверка характерных листов (например, лист "Шаблон" у Ozon с заголовками во второй строке)
+    for marketplace in SHEET_MARKETPLACES:
+        fallback = MARKETPLACES[marketplace].get('fallback_sheet')
+        if fallback and fallback['name'] in workbook.sheetnames:
+            sheet = workbook[fallback['name']]
+            if sheet.max_row >= fallback['row']:
+                found_headers = match_sheet_row(sheet, fallback['row']).count_cells(f'{marketplace}.fallback_sheet')
+                
+                if found_headers >= 1:
+                    return fallback['name'], marketplace, fallback['row']
     
     # 5. Если всё еще не нашли, применяем эвристику - ищем строку с большим количеством ячеек
     max_cells = 0
@@ -375,7 +574,7 @@ def find_best_marketplace_sheet(workbook):
     for sheet_name in workbook.sheetnames:
         sheet = workbook[sheet_name]
         for row_idx in range(1, min(15, sheet.max_row + 1)):
-            non_empty = sum(1 for cell in sheet[row_idx] if cell.value)
+            non_empty = get_row_cache(sheet).non_empty(row_idx)
             if non_empty > max_cells:
                 max_cells = non_empty
                 max_cells_row = row_idx
@@ -384,28 +583,27 @@ def find_best_marketplace_sheet(workbook):
     # Если нашли строку с хотя бы 5 ячейками, считаем её заголовком
     if max_cells >= 5:
         # Попытаемся определить тип маркетплейса по содержимому заголовков
-        header_values = [normalize_text(cell.value) for cell in workbook[max_cells_sheet][max_cells_row]]
+        row = match_sheet_row(workbook[max_cells_sheet], max_cells_row)
         
         # Проверяем специфические идентификаторы для каждого маркетплейса
-        for id_field, marketplace in id_mappings.items():
-            if any(id_field in val for val in header_values):
+        for id_field, marketplace in ID_FIELD_MARKETPLACES.items():
+            if row.has(id_field):
                 return max_cells_sheet, marketplace, max_cells_row
         
         # Проверяем наличие звездочек
-        has_asterisks = any('*' in val for val in header_values if val)
-        if has_asterisks:
+        if row.has('*'):
             # Если есть звездочки, скорее всего это Ozon или Яндекс
-            if any('мм' in val for val in header_values):
+            if row.has('мм'):
                 return max_cells_sheet, 'ozon', max_cells_row
-            elif any('см' in val for val in header_values):
+            elif row.has('см'):
                 return max_cells_sheet, 'yandex', max_cells_row
         else:
             # Если нет звездочек, проверяем другие признаки
-            if any('артикул wb' in val for val in header_values):
+            if row.has('артикул wb'):
                 return max_cells_sheet, 'wildberries', max_cells_row
-            elif any('артикул продавца' in val for val in header_values):
+            elif row.has('артикул продавца'):
                 return max_cells_sheet, 'wildberries', max_cells_row
-            elif any('guid' in val for val in header_values) or max_cells_row == 4:
+            elif row.has('guid') or max_cells_row == 4:
                 return max_cells_sheet, 'lemanpro', max_cells_row
         
         return max_cells_sheet, 'other', max_cells_row
@@ -417,6 +615,8 @@ def detect_marketplace_template(columns):
     """
     Определяет, к какому маркетплейсу относится таблица по её заголовкам,
     используя простую проверку на наличие характерных заголовков маркетплейса.
+    Результат запоминается для набора нормализованных заголовков
+    (см. marketplace_detection.DETECTION_CACHE_SIZE).
     
     Args:
         columns: Список названий колонок
@@ -427,79 +627,37 @@ def detect_marketplace_template(columns):
     if not columns:
         return "other", 0
     
-    # Нормализуем заголовки для простоты поиска
-    normalized_columns = [str(col).lower().strip() if col is not None else '' for col in columns]
-    
-    # Проверка для OZON
-    ozon_key_fields = ['название товара*', 'артикул*', 'цена, руб.*', 'ндс, %*', 'бренд*', 'обязательное поле']
-    ozon_matches = 0
-    for field in ozon_key_fields:
-        if any(field in col for col in normalized_columns):
-            ozon_matches += 1
-    
-    # Если нашли достаточно полей Ozon
-    if ozon_matches >= 3 or any('обязательное поле' in col for col in normalized_columns):
-        return 'ozon', 95.0
-    
-    # Проверка для Wildberries
-    wb_key_fields = ['артикул продавца', 'артикул wb', 'наименование', 'группа', 'фото']
-    wb_matches = 0
-    for field in wb_key_fields:
-        if any(field in col for col in normalized_columns):
-            wb_matches += 1
-    
-    # Если нашли достаточно полей Wildberries
-    if wb_matches >= 3 or any('артикул wb' in col for col in normalized_columns):
-        return 'wildberries', 95.0
-    
-    # Проверка для ЛеманПро
-    lemanpro_key_fields = ['guid', 'код тн вэд', 'наименование товара мерчанта', 'бренд товара', 'модель товара']
-    lemanpro_matches = 0
-    for field in lemanpro_key_fields:
-        if any(field in col for col in normalized_columns):
-            lemanpro_matches += 1
-    
-    # Если нашли достаточно полей ЛеманПро или есть ключевое поле GUID
-    if lemanpro_matches >= 3 or any('guid' in col for col in normalized_columns):
-        return 'lemanpro', 95.0
-    
-    # Проверка для Яндекс.Маркет
-    yandex_key_fields = ['ваш sku *', 'качество карточки', 'рекомендации по заполнению', 
-                         'название группы вариантов', 'название товара *', 'ссылка на изображение *']
-    
-    # Добавим дополнительные поля, которые встречаются в разных вариантах шаблонов Яндекс.Маркет
-    yandex_additional_fields = ['ваш sku', 'уникальный идентификатор товара', 'входит в категорию', 
-                               'не входит в категорию', 'param_names', 'param_ids', 'header']
-    
-    yandex_matches = 0
-    
-    # Основная проверка по ключевым полям
-    for field in yandex_key_fields:
-        if any(field in col for col in normalized_columns):
-            yandex_matches += 1
-    
-    # Дополнительная проверка по характерным для Яндекс.Маркет полям
-    for field in yandex_additional_fields:
-        if any(field == col for col in normalized_columns):  # Точное совпадение
-            yandex_matches += 1
-    
-    # Проверка на особые маркеры в Яндекс шаблоне (header, param_names, param_ids)
-    special_markers = sum(1 for col in normalized_columns if col in ['header', 'param_names', 'param_ids'])
-    if special_markers >= 2:
-        yandex_matches += 3  # Большой вес для этих специальных маркеров
-    
-    # Если нашли достаточно полей Яндекс или есть характерное поле "Ваш SKU" или специальные маркеры
-    if yandex_matches >= 3 or any('ваш sku' in col for col in normalized_columns) or special_markers >= 2:
-        return 'yandex', 95.0
+    # Нормализуем заголовки для простоты поиска; кортеж заголовков - ключ кеша
+    return _detect_marketplace_template(tuple(str(col).lower().strip() if col is not None else '' for col in columns))
+
+@functools.lru_cache(maxsize=marketplace_detection.DETECTION_CACHE_SIZE)
+def _detect_marketplace_template(normalized_columns):
+    """Определение маркетплейса по кортежу нормализованных заголовков (см. detect_marketplace_template)"""
+    # Ищем ключевые поля всех маркетплейсов за один проход по заголовкам (см. marketplace_signatures)
+    row = match_row(normalized_columns)
+    
+    # Проверяем маркетплейсы по очереди (ключевые поля описаны в marketplace_signatures.json)
+    column_set = set(normalized_columns)
+    matches = {}
+    for marketplace in TEMPLATE_MARKETPLACES:
+        # Основная проверка по ключевым полям (подстроки)
+        count = row.count(f'{marketplace}.template_fields')
+        
+        # Дополнительная проверка по характерным полям (точное совпадение), например для Яндекс.Маркет
+        count += sum(1 for field in TEMPLATE_EXACT_FIELDS[marketplace] if field in column_set)
+        
+        # Проверка на особые маркеры шаблона (например, header, param_names, param_ids у Яндекс.Маркет)
+        special_markers = sum(1 for col in normalized_columns if col in TEMPLATE_SPECIAL_MARKERS[marketplace])
+        if special_markers >= 2:
+            count += 3  # Большой вес для этих специальных маркеров
+        
+        matches[marketplace] = count
+        
+        # Если нашли достаточно полей, есть ключевое поле (например, GUID у ЛеманПро) или специальные маркеры
+        if count >= 3 or any(row.has(field) for field in MARKETPLACES[marketplace]['template_key_fields']) or special_markers >= 2:
+            return marketplace, 95.0
     
     # Если не удалось определить по ключевым полям, пробуем по общему числу совпадений
-    matches = {
-        'ozon': ozon_matches,
-        'wildberries': wb_matches,
-        'lemanpro': lemanpro_matches,
-        'yandex': yandex_matches
-    }
-    
     best_marketplace, max_count = max(matches.items(), key=lambda x: x[1])
     
     if max_count >= 2:
@@ -509,21 +667,702 @@ def detect_marketplace_template(columns):
     # Если не нашли достаточно совпадений
     return 'other', 0
 
-def map_columns_automatically(source_columns, target_columns, threshold=70):
+def detect_marketplace_by_columns(headers, header_row, sheet_name=None):
+    """
+    Определяет маркетплейс по заголовкам таблицы с учетом строки заголовков и имени листа.
+    Проверки для каждой строки заголовков описаны в разделе column_checks реестра
+    marketplace_signatures.json и применяются по порядку; если ни одна не сработала,
+    используется detect_marketplace_template.
+    
+    Args:
+        headers: Список заголовков таблицы
+        header_row: Номер строки заголовков (начиная с 1)
+        sheet_name: Имя листа
+        
+    Returns:
+        tuple: (marketplace, confidence)
+    """
+    normalized_columns = [str(col).lower() for col in headers]
+    row = match_row(normalized_columns)
+    sheet_name_lower = str(sheet_name).lower() if sheet_name else ''
+    
+    for check_idx, check in COLUMN_CHECKS.get(header_row, []):
+        group = f'column_check.{check_idx}.indicators'
+        # Число найденных эталонных заголовков или число колонок с характерными заголовками
+        found = row.count(group) if check['count'] == 'fields' else row.count_cells(group)
+        is_check_sheet = any(name in sheet_name_lower for name in check.get('sheet_names', []))
+        
+        matched = (
+            found >= check['min_indicators'] or
+            (is_check_sheet and found >= check['min_indicators_on_sheet']) or
+            any(row.has(field) for field in check.get('any_fields', [])) or
+            any(all(row.has(field) for field in fields) for fields in check.get('all_fields', []))
+        )
+        # Звездочки в заголовках вместе с характерным полем (обязательные поля Ozon)
+        if not matched and 'asterisks' in check:
+            asterisk_count = sum(1 for col in normalized_columns if '*' in col)
+            matched = asterisk_count >= check['asterisks']['min_count'] and row.has(check['asterisks']['field'])
+        
+        if matched:
+            return check['marketplace'], 95.0
+    
+    return detect_marketplace_template(headers)
+
+# Число строк под первой строкой листа, в которых ищутся пояснения к полям шаблона
+# (например, "GUID идентификатор из 1С" у ЛеманПро, когда заголовки ниже)
+INSTRUCTION_SCAN_ROWS = 5
+
+# Минимальная уверенность, при которой маркетплейс считается определенным
+RELIABLE_CONFIDENCE = 80
+
+def _row_headers(sheet, header_row):
+    """Непустые значения строки заголовков листа (из кеша строк)"""
+    if sheet.max_row < header_row:
+        return []
+    return [
+        str(value) for value in get_row_cache(sheet).raw(header_row)
+        if value is not None and str(value).strip() != ""
+    ]
+
+def marketplace_by_sheet_name(sheet_name):
+    """
+    Определяет маркетплейс по характерному имени листа (upload_sheet_patterns
+    в marketplace_signatures.json).
+    
+    Returns:
+        str: маркетплейс или 'other', если имя листа ни на что не похоже
+    """
+    sheet_lower = str(sheet_name).lower() if sheet_name else ''
+    for marketplace, info in MARKETPLACES.items():
+        if any(pattern in sheet_lower for pattern in info.get('upload_sheet_patterns', ())):
+            return marketplace
+    return 'other'
+
+def _layout_by_sheet_name(sheet_names, file_name=None):
+    """
+    Ищет лист шаблона по имени листа и файла (file_name_rules и upload_sheet_patterns
+    в marketplace_signatures.json).
+    
+    Returns:
+        tuple: (лист, строка заголовков) или None, если подходящего листа нет
+    """
+    file_base_name = os.path.splitext(os.path.basename(file_name))[0].lower() if file_name else None
+    
+    # Шаблоны, которые узнаются по имени файла в названии листа (например, "Шаблон АТЕМ" у ЛеманПро)
+    for rule in FILE_NAME_RULES:
+        for sheet_name in sheet_names:
+            sheet_lower = sheet_name.lower()
+            if (file_base_name and rule['template_sheet'] in sheet_lower and file_base_name in sheet_lower) or \
+               any(pattern in sheet_lower for pattern in rule['sheet_names']):
+                return sheet_name, rule['header_row']
+    
+    # Характерные имена листов маркетплейсов
+    for sheet_name in sheet_names:
+        marketplace = marketplace_by_sheet_name(sheet_name)
+        if marketplace != 'other':
+            return sheet_name, MARKETPLACES[marketplace]['expected_header_rows'][0]
+    
+    return None
+
+def _expected_header_row(sheet, marketplace, header_row):
+    """
+    Строка заголовков, ожидаемая для маркетплейса: первая из его типичных строк
+    с ключевым полем (Яндекс.Маркет - строка 2 или 4), иначе основная типичная строка.
+    """
+    expected = MARKETPLACES[marketplace]['expected_header_rows']
+    if header_row in expected and len(expected) == 1:
+        return header_row
+    
+    rows = get_row_cache(sheet)
+    key_group = f'{marketplace}.key_fields'
+    for row_idx in sorted(expected, reverse=True):
+        if sheet.max_row >= row_idx and rows.match(row_idx).count(key_group):
+            return row_idx
+    return expected[0]
+
+def probe_workbook(file, max_rows=30, file_name=None):
+    """
+    Определяет расположение таблицы (лист и строку заголовков) и маркетплейс по верхним строкам листов.
+    Это единственный этап определения шаблона: его результат используется для разбора листа,
+    поэтому таблица строится один раз, сразу с правильной строкой заголовков.
+    Листы не разбираются целиком: из XML каждого листа читаются только первые max_rows строк
+    (см. read_workbook_table).
+    
+    Порядок определения:
+    1. Лучший лист и строка заголовков по содержимому (find_best_marketplace_sheet, find_header_row)
+    2. Если маркетплейс не определен надежно - лист по имени листа и файла
+    3. Строка заголовков уточняется по маркетплейсу (Ozon - 2, Wildberries - 3, ЛеманПро - 4,
+       Яндекс.Маркет - 2 или 4)
+    4. Заголовки в первой строке проверяются на пояснения шаблона ЛеманПро под ними
+    
+    Args:
+        file: Путь к файлу, файловый объект или уже открытая LazyWorkbook
+        max_rows: Число верхних строк листа, по которым определяется шаблон
+        file_name: Имя загруженного файла (по умолчанию - путь, если file задан путем)
+        
+    Returns:
+        dict: Словарь с ключами sheet_name, header_row, marketplace, confidence и headers
+    """
+    if file_name is None and isinstance(file, (str, os.PathLike)):
+        file_name = os.fspath(file)
+    
+    workbook = file if isinstance(file, LazyWorkbook) else LazyWorkbook(file, engine='xml')
+    try:
+        head = WorkbookHead(workbook, max_rows)
+        sheet_name, marketplace, header_row = find_best_marketplace_sheet(head)
+        
+        # Если маркетплейс не определен, ищем строку заголовков по содержимому листа
+        if marketplace == 'other':
+            header_row = find_header_row(head[sheet_name], sheet_name, max_rows)
+        
+        marketplace, confidence = _detect_layout_marketplace(head[sheet_name], sheet_name, header_row, marketplace)
+        
+        # Не удалось надежно определить шаблон по содержимому - ищем лист по имени листа и файла
+        if marketplace == 'other' or confidence <= RELIABLE_CONFIDENCE:
+            named_layout = _layout_by_sheet_name(head.sheetnames, file_name)
+            if named_layout is not None and named_layout != (sheet_name, header_row):
+                named_marketplace, named_confidence = _detect_layout_marketplace(head[named_layout[0]], *named_layout)
+                if named_marketplace != 'other' and named_confidence > confidence:
+                    sheet_name, header_row = named_layout
+                    marketplace, confidence = named_marketplace, named_confidence
+        
+        sheet = head[sheet_name]
+        if marketplace in MARKETPLACES and confidence > RELIABLE_CONFIDENCE:
+            # Шаблон определен: заголовки должны быть в его типичной строке
+            header_row = _expected_header_row(sheet, marketplace, header_row)
+        elif header_row == 1:
+            # Пояснения к полям под первой строкой означают, что заголовки шаблона ниже (ЛеманПро - строка 4)
+            rows = get_row_cache(sheet)
+            for name, info in MARKETPLACES.items():
+                if 'instruction_markers' not in info:
+                    continue
+                if any(
+                    rows.match(row_idx).count(f'{name}.instruction_markers')
+                    for row_idx in range(2, min(sheet.max_row, 1 + INSTRUCTION_SCAN_ROWS) + 1)
+                ):
+                    marketplace, confidence = name, 95.0
+                    header_row = info['expected_header_rows'][0]
+                    break
+        
+        return {
+            'sheet_name': sheet_name,
+            'header_row': header_row,
+            'marketplace': marketplace,
+            'confidence': confidence,
+            'headers': _row_headers(sheet, header_row)
+        }
+    finally:
+        if workbook is not file:
+            workbook.close()
+
+def _detect_layout_marketplace(sheet, sheet_name, header_row, marketplace='other'):
+    """
+    Определяет маркетплейс по заголовкам строки header_row листа.
+    marketplace - маркетплейс, определенный только по имени листа и расположению заголовков
+    (ему назначается уверенность 50, если заголовки его не подтвердили).
+    
+    Returns:
+        tuple: (marketplace, confidence)
+    """
+    headers = _row_headers(sheet, header_row)
+    normalized_columns = [header.lower().strip() for header in headers]
+    
+    # Уверенность определяем по заголовкам найденной строки
+    detected, confidence, _ = marketplace_detection.detect_marketplace_by_row_headers(normalized_columns, header_row)
+    template_marketplace, template_confidence = detect_marketplace_template(headers)
+    if template_marketplace != 'other' and template_confidence > confidence:
+        detected, confidence = template_marketplace, template_confidence
+    
+    # Шаблон "Все инструменты": лист "Данные", GUID* и код ТН ВЭД среди первых колонок
+    data_sheet = MARKETPLACES['vseinstrumenty']['data_sheet']
+    if data_sheet['sheet_name'] in sheet_name.lower() and header_row == data_sheet['row']:
+        first_columns = normalized_columns[:5]
+        if any(data_sheet['key_field'] in col for col in first_columns) and data_sheet['required_text'] in ' '.join(first_columns):
+            detected, confidence = 'vseinstrumenty', 95.0
+    
+    if detected != 'other':
+        return detected, confidence
+    if marketplace != 'other':
+        # Маркетплейс определен только по имени листа и расположению заголовков
+        return marketplace, 50.0
+    return 'other', confidence
+
+# Нормализация имен колонок для сопоставления (normalize_column_name)
+# Специальные маркеры заголовков маркетплейсов: звездочки, восклицательные знаки и т.д.
+_COLUMN_MARKERS_RE = re.compile(r'[*!№\+]')
+_COLUMN_SPECIAL_CHARS_RE = re.compile(r'[^\w\s\-\.]')
+_SPACES_RE = re.compile(r'\s+')
+_PARENTHESES_RE = re.compile(r'\([^)]*\)')
+_UNIT_SUFFIX_RE = re.compile(r',\s*(шт|г|кг|мл|л|см|мм|м|руб|rub|₽|%)$')
+_TRAILING_DIGITS_RE = re.compile(r'\d+$')
+
+# Распространенные суффиксы и префиксы, которые удаляются из имени колонки
+COLUMN_SUFFIXES = (
+    " товара", " продукта", " позиции", " изделия", " шт", " г", " кг", " мл", " л",
+    " см", " мм", " м", " руб", " rub", " ₽", " %", " руб."
+)
+COLUMN_PREFIXES = (
+    "код ", "номер ", "ид ", "тип ", "название ", "наименование ", "цена ", "стоимость ",
+    "размер ", "вес ", "масса ", "ширина ", "высота ", "глубина ", "длина "
+)
+
+# Сокращения в начале имени колонки и их полные формы (порядок важен: применяется первое подходящее)
+COLUMN_ABBREVIATIONS = {
+    "артик": "артикул",
+    "наим": "название",
+    "наимен": "название",
+    "описан": "описание",
+    "кол-во": "количество",
+    "кол во": "количество",
+    "колво": "количество",
+    "кол": "количество",
+    "хар-ки": "характеристики",
+    "хар ки": "характеристики",
+    "харки": "характеристики",
+    "хар-ка": "характеристика",
+    "хар ка": "характеристика",
+    "харка": "характеристика",
+    "спец": "спецификация",
+    "габар": "габариты",
+    "разм": "размер",
+    "фото": "изображение",
+    "изобр": "изображение",
+    "изобрa": "изображение",
+    "картин": "изображение",
+    "шир": "ширина",
+    "дл": "длина",
+    "выс": "высота",
+    "глуб": "глубина"
+}
+
+# Стандартизация распространенных названий колонок для маркетплейсов
+STANDARD_COLUMN_ALIASES = {
+    # Ключевые атрибуты
+    "артикул": ["арт", "артик", "код товара", "номер артикула", "skuмагазина", "sku", "id товара", 
+              "код позиции", "wb sku", "артикул продавца"],
+    "название": ["наименование", "имя", "наимен", "назв", "имя товара", "заголовок", "title", 
+               "наименование товара", "название товара", "наименование позиции", "полное название"],
+    "цена": ["стоимость", "розн цена", "цена продажи", "price", "розничная цена", "прайс", 
+            "цена товара", "цена со скидкой", "розничная", "цена розничная", "руб"],
+    "описание": ["описание товара", "полное описание", "detail", "детальное описание", "description", 
+                "расширенное описание", "контент", "content", "информация о товаре", "товар описание"],
+    "категория": ["раздел", "группа", "группа товаров", "category", "тип товара", "тип изделия", 
+                "категория товара", "родительская категория", "товарная категория", "предметная группа"],
+    "бренд": ["брэнд", "марка", "производитель", "brand", "изготовитель", "торговая марка", "тм", 
+             "товарный знак", "компания производитель", "марка производитель"],
+    
+    # Габаритные характеристики
+    "вес": ["масса", "вес товара", "вес в упаковке", "вес без упаковки", "вес брутто", "вес нетто", 
+           "weight", "масса товара", "масса в упаковке", "объемный вес"],
+    "ширина": ["width", "ширина товара", "ширина упаковки", "ширина изделия", "ширина габарит",
+              "ширина в упаковке", "ширина без упаковки", "габариты ширина"],
+    "высота": ["height", "высота товара", "высота упаковки", "высота изделия", "высота габарит",
+              "высота в упаковке", "высота без упаковки", "габариты высота"],
+    "длина": ["length", "глубина", "длина товара", "длина упаковки", "длина изделия", "длина габарит",
+             "длина в упаковке", "длина без упаковки", "габариты длина", "глубина габарит"],
+    
+    # Логистика и наличие
+    "количество": ["кол-во", "остаток", "остатки", "наличие", "колво", "qty", "quantity", 
+                  "количество штук", "доступное количество", "количество в наличии"],
+    "баркод": ["штрихкод", "шк", "баркод товара", "ean", "ean13", "gtin", "upc", "код товара", 
+              "штрих код", "barcode", "штрихкод товара"],
+    
+    # Дополнительные атрибуты
+    "материал": ["состав", "материал изготовления", "материал товара", "материал изделия", 
+                "основной материал", "material", "ткань", "основа", "сырье"],
+    "цвет": ["color", "расцветка", "цвет товара", "цвет изделия", "основной цвет", 
+            "цветовой тон", "оттенок", "цвет и оттенок", "цветовое решение"],
+    "размер": ["габариты", "size", "размерный ряд", "размер товара", "размер изделия", 
+              "линейные размеры", "типоразмер", "размерность", "габаритные размеры"],
+            
+    # Фотографии
+    "фото": ["изображение", "картинка", "главное фото", "основное фото", "фотография", "photo", "image", 
+            "ссылка на фото", "фото товара", "фотки", "снимки", "изображения", "ссылки на фото", 
+            "picture", "ссылка на изображение", "ссылки на изображения", "ссылка на главное фото", 
+            "ссылка на основное фото", "ссылки на фотографии", "ссылки на картинки", "фото 360"],
+    "главное фото": ["ссылка на главное фото", "основное фото", "главное изображение", "main photo", 
+                   "main image", "первое фото", "фото основное", "фото в карточке", "основная картинка", 
+                   "основное изображение", "главная фотография", "главное фото товара"],
+    "дополнительные фото": ["ссылки на дополнительные фото", "дополнительные изображения", "additional photos", 
+                         "дополнительные картинки", "доп. фото", "доп фото", "галерея", "gallery", 
+                         "фото галерея", "дополнительные фотографии", "фото товара"]
+}
+
+# Ключевые атрибуты, к которым приводятся обязательные (со звездочкой) колонки
+REQUIRED_KEY_COLUMNS = ('артикул', 'название', 'цена')
+
+# Обратные индексы: позиция сокращения в COLUMN_ABBREVIATIONS и стандартное имя по синониму
+# (при повторах побеждает более раннее, как при последовательном просмотре словарей)
+_ABBREVIATION_ORDER = {abbr: order for order, abbr in enumerate(COLUMN_ABBREVIATIONS)}
+_STANDARD_COLUMN_BY_ALIAS = {}
+for _standard, _aliases in STANDARD_COLUMN_ALIASES.items():
+    _STANDARD_COLUMN_BY_ALIAS.setdefault(_standard, _standard)
+    for _alias in _aliases:
+        _STANDARD_COLUMN_BY_ALIAS.setdefault(_alias, _standard)
+
+def normalize_column_name(col_name):
+    """
+    Приводит имя колонки к виду для сопоставления: без маркеров обязательности, спецсимволов,
+    единиц измерения и типичных префиксов, с раскрытыми сокращениями и стандартными именами
+    ключевых атрибутов. Результат для каждого имени вычисляется один раз за процесс.
+    """
+    if not isinstance(col_name, str):
+        return str(col_name).lower()
+    return _normalize_column_name(col_name)
+
+@functools.lru_cache(maxsize=None)
+def _normalize_column_name(col_name):
+    # Удаляем специальные маркеры из заголовков маркетплейсов: звездочки, восклицательные знаки и т.д.
+    normalized = _COLUMN_MARKERS_RE.sub('', col_name)
+    
+    # Удаляем спецсимволы и лишние пробелы (переносы строк тоже заменяются пробелом)
+    normalized = _COLUMN_SPECIAL_CHARS_RE.sub(' ', normalized)
+    normalized = _SPACES_RE.sub(' ', normalized).strip().lower()
+    
+    # Удаляем распространенные суффиксы
+    for suffix in COLUMN_SUFFIXES:
+        if normalized.endswith(suffix):
+            normalized = normalized[:-len(suffix)]
+    
+    # Удаляем общие префиксы и пояснения в скобках
+    normalized = _PARENTHESES_RE.sub('', normalized).strip()
+    for prefix in COLUMN_PREFIXES:
+        if normalized.startswith(prefix):
+            normalized = normalized[len(prefix):]
+    
+    # Обрабатываем заголовки с единицами измерения через запятую
+    normalized = _UNIT_SUFFIX_RE.sub('', normalized)
+    
+    # Преобразуем сокращения в полные формы: сокращение - это все имя или его начало до пробела
+    # (в сокращениях не больше одного пробела, поэтому достаточно первых двух слов)
+    words = normalized.split(' ', 2)
+    candidates = {normalized, words[0], ' '.join(words[:2])}
+    matched = [abbr for abbr in candidates if abbr in _ABBREVIATION_ORDER and (abbr == normalized or normalized.startswith(abbr + ' '))]
+    if matched:
+        abbr = min(matched, key=_ABBREVIATION_ORDER.get)
+        normalized = normalized.replace(abbr, COLUMN_ABBREVIATIONS[abbr], 1)
+    
+    # Проверяем, соответствует ли нормализованное имя одному из стандартных имён
+    standard = _STANDARD_COLUMN_BY_ALIAS.get(normalized)
+    if standard is not None:
+        return standard
+    
+    # Для оригинальных имен колонок с маркерами обязательности (звездочка и др.)
+    # добавляем повышенный приоритет для ключевых атрибутов
+    if '*' in col_name or '!' in col_name:
+        for key_field in REQUIRED_KEY_COLUMNS:
+            for alias in STANDARD_COLUMN_ALIASES[key_field]:
+                if alias in normalized or normalized in alias:
+                    return key_field
+    
+    # Если колонка содержит цифры (например, Артикул1, Артикул2), очищаем от них
+    return _TRAILING_DIGITS_RE.sub('', normalized).strip()
+
+# Слова, по которым колонка относится к весу или к размерам (бонус за пары единиц кг <-> г и мм <-> см)
+WEIGHT_WORDS = ('вес', 'масса')
+DIMENSION_WORDS = ('длина', 'ширина', 'высота', 'глубина', 'габарит', 'размер')
+
+# Бонусы к оценке схожести пары колонок
+EXACT_NAME_BONUS = 30
+PARTIAL_NAME_BONUS = 15
+UNIT_PAIR_BONUS = 20
+
+# Бонус паре из сохраненного сопоставления похожей пары шаблонов (см. mapping_store)
+# и оценка пар сопоставления, сохраненного для этой же пары шаблонов
+LEARNED_PAIR_BONUS = 100
+LEARNED_MAPPING_SCORE = 100
+
+# Оценка пар, взятых из словаря соответствия маркетплейсов (COLUMN_MAPPING_GRAPH)
+DICTIONARY_MAPPING_SCORE = 100
+
+# Сравнение колонок по значениям (value_similarity_matrix): размер выборки строк,
+# наибольший бонус к оценке пары и вклад совпадения числовых колонок (менее характерного,
+# чем штрихкоды EAN-13 или ссылки)
+VALUE_SAMPLE_ROWS = 500
+VALUE_MATCH_BONUS = 50
+VALUE_NUMERIC_SPECIFICITY = 0.5
+
+# Границы интервалов длины значения для гистограммы длин и разброс порядка чисел
+# (в десятичных порядках), при котором колонки считаются совсем разными
+VALUE_LENGTH_BINS = np.array([4, 8, 13, 14, 31, 101])
+VALUE_MAGNITUDE_SPAN = 3.0
+
+# Веса цифр штрихкода EAN-13 при вычислении контрольной цифры
+EAN13_WEIGHTS = np.array([1, 3] * 6)
+
+def _contains_any(texts, words):
+    """Маска: есть ли в тексте хотя бы одно из слов"""
+    return np.array([any(word in text for word in words) for text in texts], dtype=bool)
+
+class PreparedColumns:
+    """
+    Колонки шаблона, подготовленные для сопоставления: нормализованные имена (в том числе
+    с предобработкой fuzzywuzzy) и признаки единиц измерения. Строятся один раз на набор
+    колонок (см. get_prepared_columns) и используются повторно.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.normalized = [normalize_column_name(col) for col in self.columns]
+        # Имена с той же предобработкой, что в fuzzywuzzy
+        self.processed = [fuzz_utils.full_process(name, force_ascii=True) for name in self.normalized]
+        self.names = np.array(self.normalized, dtype=str)
+        
+        lower = [str(col).lower() for col in self.columns]
+        self.kg = _contains_any(lower, ['кг'])
+        self.g = _contains_any(lower, ['г']) & ~self.kg
+        self.mm = _contains_any(lower, ['мм'])
+        self.cm = _contains_any(lower, ['см'])
+        self.weight = _contains_any(self.normalized, WEIGHT_WORDS)
+        self.dimension = _contains_any(self.normalized, DIMENSION_WORDS)
+
+    def __len__(self):
+        return len(self.columns)
+
+@functools.lru_cache(maxsize=64)
+def _prepared_columns(columns):
+    return PreparedColumns(columns)
+
+def get_prepared_columns(columns):
+    """Подготовленные колонки шаблона (кешируются в процессе по набору колонок, общие для всех сессий)"""
+    return _prepared_columns(tuple(columns))
+
+def column_similarity_matrix(source_columns, target_columns):
     """
-    Автоматически сопоставляет колонки на основе схожести названий
+    Считает оценки схожести всех пар колонок одним пакетным вызовом.
+    Основа оценки - fuzz.token_sort_ratio нормализованных имен (normalize_column_name),
+    посчитанный сразу для всей матрицы rapidfuzz.process.cdist и округленный так же,
+    как в fuzzywuzzy; колонки целевого шаблона готовятся один раз (get_prepared_columns).
+    Бонусы накладываются масками на всю матрицу: за совпадение нормализованных имен
+    или вхождение одного в другое, за пары единиц вес кг <-> г и размер мм <-> см.
     
     Args:
         source_columns: Список колонок исходной таблицы
         target_columns: Список колонок целевой таблицы
-        threshold: Порог схожести для сопоставления (0-100)
         
     Returns:
-        Dict: Словарь соответствия {source_column: target_column}
+        np.ndarray: Матрица оценок (строки - исходные колонки, столбцы - целевые)
+    """
+    if len(source_columns) == 0 or len(target_columns) == 0:
+        return np.zeros((len(source_columns), len(target_columns)), dtype=np.int64)
+    
+    target = get_prepared_columns(target_columns)
+    source = PreparedColumns(source_columns)
+    
+    # token_sort_ratio с той же предобработкой строк, что в fuzzywuzzy
+    scores = rapid_process.cdist(
+        source.processed, target.processed,
+        scorer=rapid_fuzz.token_sort_ratio, processor=None, dtype=np.float64, workers=-1
+    )
+    scores = np.rint(scores).astype(np.int64)
+    
+    # Повышаем вес для точных соответствий, иначе - для частичных (одно имя входит в другое)
+    source_names = source.names[:, None]
+    target_names = target.names[None, :]
+    exact = source_names == target_names
+    partial = (np.char.find(target_names, source_names) >= 0) | (np.char.find(source_names, target_names) >= 0)
+    scores += np.where(exact, EXACT_NAME_BONUS, np.where(partial, PARTIAL_NAME_BONUS, 0))
+    
+    # Вес: кг <-> г
+    weight_units = (source.kg[:, None] & target.g[None, :]) | (source.g[:, None] & target.kg[None, :])
+    weight_names = source.weight[:, None] & target.weight[None, :]
+    
+    # Размеры: мм <-> см
+    size_units = (source.mm[:, None] & target.cm[None, :]) | (source.cm[:, None] & target.mm[None, :])
+    size_names = source.dimension[:, None] & target.dimension[None, :]
+    
+    scores += UNIT_PAIR_BONUS * (weight_units & weight_names) + UNIT_PAIR_BONUS * (size_units & size_names)
+    return scores
+
+def sample_column_values(df, max_rows=VALUE_SAMPLE_ROWS):
+    """Ограниченная выборка строк таблицы для сравнения колонок по значениям (при повторных вызовах - та же)"""
+    if len(df) <= max_rows:
+        return df
+    return df.sample(n=max_rows, random_state=0)
+
+def column_value_fingerprints(df, columns):
+    """
+    Считает отпечатки значений колонок по выборке строк (sample_column_values).
+    Все значения выборки обрабатываются одним столбцом pandas, средние по колонкам -
+    через np.bincount.
+    
+    Отпечаток колонки: доля чисел (запятая считается десятичным разделителем), доля штрихкодов
+    EAN-13 с верной контрольной цифрой, доля ссылок, медианный десятичный порядок чисел
+    (NaN, если чисел нет) и гистограмма длин значений (доли по интервалам VALUE_LENGTH_BINS).
+    
+    Args:
+        df: DataFrame со значениями колонок
+        columns: Список колонок, для которых нужны отпечатки
+        
+    Returns:
+        tuple: (np.ndarray отпечатков (len(columns) x признаки),
+                np.ndarray bool: есть ли у колонки непустые значения в выборке)
+    """
+    n_bins = len(VALUE_LENGTH_BINS) + 1
+    fingerprints = np.zeros((len(columns), 4 + n_bins))
+    fingerprints[:, 3] = np.nan
+    has_values = np.zeros(len(columns), dtype=bool)
+    if df is None or len(columns) == 0:
+        return fingerprints, has_values
+    
+    # Колонки таблицы по имени (при повторяющихся именах - первая)
+    positions = {}
+    for col_idx, col in enumerate(df.columns):
+        positions.setdefault(col, col_idx)
+    rows = [row for row, col in enumerate(columns) if col in positions]
+    if not rows or len(df) == 0:
+        return fingerprints, has_values
+    
+    sample = sample_column_values(df).iloc[:, [positions[columns[row]] for row in rows]]
+    values = pd.Series(sample.to_numpy(dtype=object).ravel(order='F'))
+    codes = np.repeat(np.arange(len(rows)), len(sample))
+    
+    filled = values.notna().to_numpy()
+    text = values[filled].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    codes = codes[filled][(text != '').to_numpy()]
+    text = text[text != '']
+    counts = np.bincount(codes, minlength=len(rows))
+    column_counts = np.maximum(counts, 1)
+    
+    def column_share(mask):
+        return np.bincount(codes, weights=mask.astype(np.float64), minlength=len(rows)) / column_counts
+    
+    numbers = pd.to_numeric(text.str.replace(',', '.', regex=False).str.replace(r'\s', '', regex=True), errors='coerce').to_numpy(dtype=np.float64)
+    is_number = ~np.isnan(numbers)
+    
+    # Штрихкоды EAN-13: 13 цифр, последняя - контрольная
+    is_ean = text.str.fullmatch(r'\d{13}').to_numpy(dtype=bool)
+    if is_ean.any():
+        digits = np.frombuffer(''.join(text[is_ean]).encode('ascii'), dtype=np.uint8).reshape(-1, 13).astype(np.int64) - ord('0')
+        is_ean[is_ean] = (10 - (digits[:, :12] @ EAN13_WEIGHTS) % 10) % 10 == digits[:, 12]
+    
+    is_url = text.str.match(r'(?:https?://|www\.)', case=False).to_numpy(dtype=bool)
+    
+    # Медианный десятичный порядок ненулевых чисел колонки
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitudes = np.log10(np.abs(numbers))
+    finite = np.isfinite(magnitudes)
+    column_magnitudes = pd.Series(magnitudes[finite]).groupby(codes[finite]).median()
+    
+    length_bins = np.digitize(text.str.len().to_numpy(), VALUE_LENGTH_BINS)
+    histogram = np.bincount(codes * n_bins + length_bins, minlength=len(rows) * n_bins).reshape(len(rows), n_bins)
+    
+    rows = np.array(rows)
+    fingerprints[rows, 0] = column_share(is_number)
+    fingerprints[rows, 1] = column_share(is_ean)
+    fingerprints[rows, 2] = column_share(is_url)
+    fingerprints[rows[column_magnitudes.index.to_numpy()], 3] = column_magnitudes.to_numpy()
+    fingerprints[rows, 4:] = histogram / column_counts[:, None]
+    has_values[rows] = counts > 0
+    return fingerprints, has_values
+
+def value_similarity_matrix(source_values, target_values, source_columns, target_columns):
+    """
+    Оценивает схожесть пар колонок по их значениям (column_value_fingerprints).
+    Схожесть - близость отпечатков (доли чисел, штрихкодов, ссылок, порядок чисел, гистограмма
+    длин), умноженная на характерность общего вида значений: совпадение колонок штрихкодов
+    или ссылок весомее совпадения числовых колонок, а у текстовых колонок она нулевая.
+    
+    Args:
+        source_values: DataFrame со значениями исходной таблицы
+        target_values: DataFrame со значениями целевой таблицы
+        source_columns: Список колонок исходной таблицы
+        target_columns: Список колонок целевой таблицы
+        
+    Returns:
+        np.ndarray: Матрица схожести от 0 до 1 (строки - исходные колонки, столбцы - целевые);
+                    0 у пар, где у одной из колонок нет значений
+    """
+    source, source_filled = column_value_fingerprints(source_values, source_columns)
+    target, target_filled = column_value_fingerprints(target_values, target_columns)
+    if not source_filled.any() or not target_filled.any():
+        return np.zeros((len(source_columns), len(target_columns)))
+    
+    source, target = source[:, None, :], target[None, :, :]
+    shares = np.abs(source[..., :3] - target[..., :3])
+    histogram = 0.5 * np.abs(source[..., 4:] - target[..., 4:]).sum(axis=2)
+    magnitude = np.minimum(np.abs(source[..., 3] - target[..., 3]), VALUE_MAGNITUDE_SPAN) / VALUE_MAGNITUDE_SPAN
+    # Колонка без чисел отличается по доле чисел, порядок не сравнивается
+    magnitude = np.nan_to_num(magnitude, nan=0.0)
+    agreement = 1 - (shares.sum(axis=2) + histogram + magnitude) / 5
+    
+    common = np.minimum(source[..., :3], target[..., :3])
+    specificity = np.maximum.reduce([common[..., 1], common[..., 2], VALUE_NUMERIC_SPECIFICITY * common[..., 0]])
+    return np.where(source_filled[:, None] & target_filled[None, :], agreement * specificity, 0.0)
+
+def solve_assignment(weights):
+    """
+    Находит пары строк и столбцов матрицы с наибольшей суммой весов: каждой строке - не больше
+    одного столбца и наоборот (венгерский алгоритм, поиск кратчайших увеличивающих путей;
+    шаг по всем столбцам выполняется векторно в NumPy).
+    
+    Args:
+        weights: Матрица неотрицательных весов (строки x столбцы)
+        
+    Returns:
+        list: Пары (строка, столбец) в порядке возрастания строки
     """
-    # Готовые словари соответствия между маркетплейсами на основе реальных данных
+    weights = np.asarray(weights, dtype=np.float64)
+    transposed = weights.shape[0] > weights.shape[1]
+    if transposed:
+        weights = weights.T
+    n_rows, n_cols = weights.shape
+    if n_rows == 0:
+        return []
+    
+    # Минимизируем стоимость (max - вес); нулевой столбец и нулевая строка - служебные
+    cost = weights.max() - weights
+    row_potential = np.zeros(n_rows + 1)
+    col_potential = np.zeros(n_cols + 1)
+    col_owner = np.zeros(n_cols + 1, dtype=np.int64)   # строка (с 1), занимающая столбец; 0 - свободен
+    way = np.zeros(n_cols + 1, dtype=np.int64)
+    
+    for row in range(1, n_rows + 1):
+        col_owner[0] = row
+        current_col = 0
+        min_reduced = np.full(n_cols + 1, np.inf)
+        visited = np.zeros(n_cols + 1, dtype=bool)
+        while True:
+            visited[current_col] = True
+            current_row = col_owner[current_col]
+            reduced = cost[current_row - 1] - row_potential[current_row] - col_potential[1:]
+            free = ~visited[1:]
+            
+            improved = free & (reduced < min_reduced[1:])
+            min_reduced[1:][improved] = reduced[improved]
+            way[1:][improved] = current_col
+            
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+            
+            visited_cols = np.flatnonzero(visited)
+            row_potential[col_owner[visited_cols]] += delta
+            col_potential[visited_cols] -= delta
+            min_reduced[1:][free] -= delta
+            
+            current_col = next_col
+            if col_owner[current_col] == 0:
+                break
+        
+        # Перекладываем пары вдоль найденного пути
+        while current_col:
+            previous_col = way[current_col]
+            col_owner[current_col] = col_owner[previous_col]
+            current_col = previous_col
+    
+    pairs = [(int(col_owner[col]) - 1, col - 1) for col in range(1, n_cols + 1) if col_owner[col]]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted(pairs)
+
+# Готовые словари соответствия колонок между маркетплейсами на основе реальных данных:
+# (маркетплейс источника, маркетплейс цели) -> {колонка источника: колонка цели или список
+# колонок цели в порядке предпочтения}. Направления без своего словаря выводятся
+# композицией (см. compile_column_mapping_graph)
+MARKETPLACE_COLUMN_MAPS = {
     # Словарь WB -> Ozon
-    wb_to_ozon = {
+    ('wildberries', 'ozon'): {
         'Артикул продавца': 'Артикул*',
         'Наименование': 'Название товара*',
         'Бренд': 'Бренд*',
@@ -550,10 +1389,10 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'Ставка НДС': 'НДС, %*',
         'Пол': 'Хештеги'  # Может использоваться для хештегов типа #мужской #женский
         # 'Категория продавца': не маппится, используется имя файла
-    }
-    
+    },
+
     # Словарь Ozon -> WB
-    ozon_to_wb = {
+    ('ozon', 'wildberries'): {
         'Артикул*': 'Артикул продавца',
         'Название товара*': 'Наименование',
         'Бренд*': 'Бренд',
@@ -579,10 +1418,10 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'НДС, %*': 'Ставка НДС',
         'Хештеги': 'Пол'  # Может использоваться для хештегов типа #мужской #женский
         # 'Категория продавца': Не маппится, для WB шаблона используется имя файла
-    }
-    
+    },
+
     # Словарь WB -> Яндекс
-    wb_to_yandex = {
+    ('wildberries', 'yandex'): {
         'Артикул продавца': 'Ваш SKU *',
         'Наименование': 'Название товара *',
         'Бренд': 'Бренд *',
@@ -605,10 +1444,10 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'Грузоподъемность': 'Грузоподъемность, кг',
         'Объем': 'Объем, л',
         'Артикул WB': 'Артикул производителя'
-    }
-    
+    },
+
     # Словарь Яндекс -> WB
-    yandex_to_wb = {
+    ('yandex', 'wildberries'): {
         'Ваш SKU *': 'Артикул продавца',
         'Название товара *': 'Наименование',
         'Бренд *': 'Бренд',
@@ -629,10 +1468,10 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'Грузоподъемность, кг': 'Грузоподъемность',
         'Объем, л': 'Объем',
         'Артикул производителя': 'Артикул WB'
-    }
-    
+    },
+
     # Словарь Ozon -> Яндекс
-    ozon_to_yandex = {
+    ('ozon', 'yandex'): {
         'Артикул*': 'Ваш SKU *',
         'Название товара*': 'Название товара *',
         'Бренд*': 'Бренд *',
@@ -655,10 +1494,10 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'Макс. нагрузка, кг': 'Грузоподъемность, кг',
         'Объем, л': 'Объем, л',
         'Хештеги': 'Теги'
-    }
-    
+    },
+
     # Словарь Ozon -> ЛеманПро
-    ozon_to_lemanpro = {
+    ('ozon', 'lemanpro'): {
         'Артикул*': 'Артикул товара',
         'Название товара*': 'Наименование товара мерчанта',
         'Бренд*': 'Бренд товара',
@@ -676,10 +1515,10 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'Вес товара, г': 'Вес нетто (кг)',  # Требует конвертации г -> кг
         'Гарантийный срок': 'Гарантия (лет)',  # Может требовать преобразования формата
         'НДС, %*': 'НДС'
-    }
-    
+    },
+
     # Словарь ЛеманПро -> Ozon
-    lemanpro_to_ozon = {
+    ('lemanpro', 'ozon'): {
         'Артикул товара': 'Артикул*',
         'Наименование товара мерчанта': 'Название товара*',
         'Бренд товара': 'Бренд*',
@@ -698,247 +1537,490 @@ def map_columns_automatically(source_columns, target_columns, threshold=70):
         'Гарантия (лет)': 'Гарантийный срок',  # Может требовать преобразования формата
         'НДС': 'НДС, %*'
     }
+}
+
+def _compose_column_maps(first, second):
+    """Композиция словарей соответствия: колонка A -> B по first, затем B -> C по second"""
+    composed = {}
+    for source_col, middle_cols in first.items():
+        target_cols = []
+        for middle_col in middle_cols:
+            for target_col in second.get(middle_col, ()):
+                if target_col not in target_cols:
+                    target_cols.append(target_col)
+        if target_cols:
+            composed[source_col] = tuple(target_cols)
+    return composed
+
+def compile_column_mapping_graph(column_maps):
+    """
+    Собирает граф переноса между маркетплейсами: вершины - маркетплейсы, ребра - словари
+    соответствия колонок. Для пары без своего словаря берется кратчайший путь по ребрам
+    (поиск в ширину, при равной длине - по порядку словарей), и словари пути компонуются,
+    например WB -> Ozon -> ЛеманПро.
+    
+    Args:
+        column_maps: Словари соответствия {(маркетплейс источника, маркетплейс цели): {колонка: колонка(и)}}
+        
+    Returns:
+        dict: {(маркетплейс источника, маркетплейс цели): {колонка источника: кортеж колонок цели}}
+              для всех достижимых пар маркетплейсов
+    """
+    edges = {}
+    for (source_marketplace, target_marketplace), column_map in column_maps.items():
+        edges.setdefault(source_marketplace, {})[target_marketplace] = {
+            source_col: (target_cols,) if isinstance(target_cols, str) else tuple(target_cols)
+            for source_col, target_cols in column_map.items()
+        }
+    
+    graph = {}
+    for start in edges:
+        # Поиск в ширину: у каждого достигнутого маркетплейса - словарь соответствия от start
+        reached = {start: None}
+        queue = [start]
+        for marketplace in queue:
+            for next_marketplace, column_map in edges.get(marketplace, {}).items():
+                if next_marketplace in reached:
+                    continue
+                reached[next_marketplace] = column_map if marketplace == start else _compose_column_maps(reached[marketplace], column_map)
+                queue.append(next_marketplace)
+        for marketplace, column_map in reached.items():
+            if marketplace != start:
+                graph[(start, marketplace)] = column_map
+    return graph
+
+# Словари соответствия для всех пар маркетплейсов, собранные при импорте модуля
+COLUMN_MAPPING_GRAPH = compile_column_mapping_graph(MARKETPLACE_COLUMN_MAPS)
+
+def resolve_stored_mapping(stored_mapping, source_columns, target_columns):
+    """
+    Переводит сохраненное сопоставление (mapping_store) на колонки текущих таблиц: заголовки
+    сравниваются без учета регистра и пробелов по краям (как в отпечатке набора заголовков),
+    при повторяющихся заголовках берется первый. Пары, колонок которых в таблицах нет, пропускаются.
     
-    # Поля, которые не должны переноситься
-    excluded_columns = ['Артикул WB']
+    Returns:
+        dict: Словарь соответствия {source_column: target_column} с именами колонок текущих таблиц
+    """
+    source_by_header = {}
+    for source_col in source_columns:
+        source_by_header.setdefault(normalize_header(source_col), source_col)
+    target_by_header = {}
+    for target_col in target_columns:
+        target_by_header.setdefault(normalize_header(target_col), target_col)
     
+    mapping = {}
+    for source_col, target_col in stored_mapping.items():
+        source_header, target_header = normalize_header(source_col), normalize_header(target_col)
+        if source_header in source_by_header and target_header in target_by_header:
+            mapping[source_by_header[source_header]] = target_by_header[target_header]
+    return mapping
+
+def map_columns_automatically(source_columns, target_columns, threshold=70, assignment='greedy', return_scores=False, store=None,
+                              source_values=None, target_values=None):
+    """
+    Автоматически сопоставляет колонки на основе схожести названий.
+    Сначала применяется готовый словарь соответствия для направления между маркетплейсами
+    источника и цели (COLUMN_MAPPING_GRAPH), оставшиеся колонки подбираются по схожести
+
+    Args:
+        source_columns: Список колонок исходной таблицы
+        target_columns: Список колонок целевой таблицы
+        threshold: Порог схожести для сопоставления (0-100)
+        assignment: Способ сопоставления по схожести названий:
+            'greedy' - исходные колонки по порядку занимают лучшую из свободных целевых;
+            'optimal' - пары подбираются сразу для всей матрицы оценок с наибольшей суммой
+            оценок (solve_assignment), ранняя слабая пара не отнимает колонку у более точной
+        return_scores: Вернуть также оценки сопоставленных пар: у пар из сохраненного сопоставления
+            этой же пары шаблонов - LEARNED_MAPPING_SCORE, у пар из словаря соответствия
+            маркетплейсов - DICTIONARY_MAPPING_SCORE, у остальных - оценка схожести
+            (с бонусами за единицы измерения, значения и похожие сохраненные сопоставления)
+        store: Хранилище подтвержденных сопоставлений (mapping_store.MappingStore): пары,
+            сохраненные для этой же пары наборов заголовков, берутся без подбора (остальные колонки
+            подбираются как обычно), а сохраненные для похожей пары повышают оценки своих пар
+        source_values: DataFrame со значениями исходной таблицы (колонки - source_columns)
+        target_values: DataFrame со значениями целевой таблицы (колонки - target_columns);
+            если заданы обе таблицы, к оценкам пар добавляется бонус за схожесть значений
+            по выборке строк (value_similarity_matrix, до VALUE_MATCH_BONUS)
+        
+    Returns:
+        Dict: Словарь соответствия {source_column: target_column}
+              (при return_scores - кортеж (словарь соответствия, {source_column: оценка}))
+    """
     mapping = {}
     used_target_columns = set()
-    
-    # Улучшенная нормализация имен колонок
-    def normalize_column_name(col_name):
-        if not isinstance(col_name, str):
-            return str(col_name).lower()
-        
-        # Сохраняем исходное имя колонки для дальнейшего анализа
-        original_name = col_name
-        
-        # Удаляем специальные маркеры из заголовков маркетплейсов: звездочки, восклицательные знаки и т.д.
-        normalized = re.sub(r'[*!№\+]', '', col_name)
-        
-        # Удаляем спецсимволы и лишние пробелы
-        normalized = re.sub(r'[^\w\s\-\.]', ' ', normalized)
-        normalized = re.sub(r'\s+', ' ', normalized).strip().lower()
-        
-        # Обрабатываем многострочные заголовки (перенос строки заменяем на пробел)
-        normalized = re.sub(r'\n', ' ', normalized)
-        
-        # Удаляем распространенные суффиксы
-        common_suffixes = [
-            " товара", " продукта", " позиции", " изделия", " шт", " г", " кг", " мл", " л",
-            " см", " мм", " м", " руб", " rub", " ₽", " %", " руб."
-        ]
-        for suffix in common_suffixes:
-            if normalized.endswith(suffix.lower()):
-                normalized = normalized[:-len(suffix)]
-        
-        # Удаляем общие префиксы и пояснения в скобках
-        normalized = re.sub(r'\([^)]*\)', '', normalized).strip()
-        common_prefixes = [
-            "код ", "номер ", "ид ", "тип ", "название ", "наименование ", "цена ", "стоимость ",
-            "размер ", "вес ", "масса ", "ширина ", "высота ", "глубина ", "длина "
-        ]
-        for prefix in common_prefixes:
-            if normalized.startswith(prefix):
-                normalized = normalized[len(prefix):]
-        
-        # Обрабатываем заголовки с единицами измерения через запятую
-        normalized = re.sub(r',\s*(шт|г|кг|мл|л|см|мм|м|руб|rub|₽|%)$', '', normalized)
-        
-        # Преобразуем сокращения в полные формы
-        abbreviations = {
-            "артик": "артикул",
-            "наим": "название",
-            "наимен": "название",
-            "описан": "описание",
-            "кол-во": "количество",
-            "кол во": "количество",
-            "колво": "количество",
-            "кол": "количество",
-            "хар-ки": "характеристики",
-            "хар ки": "характеристики",
-            "харки": "характеристики",
-            "хар-ка": "характеристика",
-            "хар ка": "характеристика",
-            "харка": "характеристика",
-            "спец": "спецификация",
-            "габар": "габариты",
-            "разм": "размер",
-            "фото": "изображение",
-            "изобр": "изображение",
-            "изобрa": "изображение",
-            "картин": "изображение",
-            "шир": "ширина",
-            "дл": "длина",
-            "выс": "высота",
-            "глуб": "глубина"
-        }
-        for abbr, full in abbreviations.items():
-            if normalized == abbr or normalized.startswith(abbr + " "):
-                normalized = normalized.replace(abbr, full, 1)
-                break
-                
-        # Стандартизация распространенных названий колонок для маркетплейсов
-        marketplace_columns = {
-            # Ключевые атрибуты
-            "артикул": ["арт", "артик", "код товара", "номер артикула", "skuмагазина", "sku", "id товара", 
-                      "код позиции", "wb sku", "артикул продавца"],
-            "название": ["наименование", "имя", "наимен", "назв", "имя товара", "заголовок", "title", 
-                       "наименование товара", "название товара", "наименование позиции", "полное название"],
-            "цена": ["стоимость", "розн цена", "цена продажи", "price", "розничная цена", "прайс", 
-                    "цена товара", "цена со скидкой", "розничная", "цена розничная", "руб"],
-            "описание": ["описание товара", "полное описание", "detail", "детальное описание", "description", 
-                        "расширенное описание", "контент", "content", "информация о товаре", "товар описание"],
-            "категория": ["раздел", "группа", "группа товаров", "category", "тип товара", "тип изделия", 
-                        "категория товара", "родительская категория", "товарная категория", "предметная группа"],
-            "бренд": ["брэнд", "марка", "производитель", "brand", "изготовитель", "торговая марка", "тм", 
-                     "товарный знак", "компания производитель", "марка производитель"],
-            
-            # Габаритные характеристики
-            "вес": ["масса", "вес товара", "вес в упаковке", "вес без упаковки", "вес брутто", "вес нетто", 
-                   "weight", "масса товара", "масса в упаковке", "объемный вес"],
-            "ширина": ["width", "ширина товара", "ширина упаковки", "ширина изделия", "ширина габарит",
-                      "ширина в упаковке", "ширина без упаковки", "габариты ширина"],
-            "высота": ["height", "высота товара", "высота упаковки", "высота изделия", "высота габарит",
-                      "высота в упаковке", "высота без упаковки", "габариты высота"],
-            "длина": ["length", "глубина", "длина товара", "длина упаковки", "длина изделия", "длина габарит",
-                     "длина в упаковке", "длина без упаковки", "габариты длина", "глубина габарит"],
-            
-            # Логистика и наличие
-            "количество": ["кол-во", "остаток", "остатки", "наличие", "колво", "qty", "quantity", 
-                          "количество штук", "доступное количество", "количество в наличии"],
-            "баркод": ["штрихкод", "шк", "баркод товара", "ean", "ean13", "gtin", "upc", "код товара", 
-                      "штрих код", "barcode", "штрихкод товара"],
+    dictionary_columns = set()
+    
+    learned_mapping = {}
+    confirmed_mapping = {}
+    if store is not None:
+        stored_mapping = store.get(source_columns, target_columns)
+        if stored_mapping is not None:
+            # Сопоставление для этой же пары шаблонов: сохраненные пары берутся как есть,
+            # остальные колонки подбираются обычным способом
+            confirmed_mapping = resolve_stored_mapping(stored_mapping, source_columns, target_columns)
+            mapping.update(confirmed_mapping)
+            used_target_columns.update(confirmed_mapping.values())
+        else:
+            similar = store.find_similar(source_columns, target_columns)
+            if similar is not None:
+                learned_mapping = resolve_stored_mapping(similar[0], source_columns, target_columns)
+    
+    # Определяем маркетплейсы исходных и целевых колонок и применяем готовый словарь
+    # соответствия для этого направления (прямой или составленный из нескольких)
+    source_marketplace, _ = detect_marketplace_template(source_columns)
+    target_marketplace, _ = detect_marketplace_template(target_columns)
+    column_map = COLUMN_MAPPING_GRAPH.get((source_marketplace, target_marketplace), {})
+    if column_map:
+        target_set = set(target_columns)
+        confirmed_targets = set(confirmed_mapping.values())
+        for source_col in source_columns:
+            if source_col in confirmed_mapping:
+                continue
+            # Первая из колонок цели словаря, которая есть в целевой таблице и не занята подтвержденной парой
+            best_match = next((
+                target_col for target_col in column_map.get(source_col, ())
+                if target_col in target_set and target_col not in confirmed_targets
+            ), None)
+            if best_match is not None:
+                mapping[source_col] = best_match
+                used_target_columns.add(best_match)
+                dictionary_columns.add(source_col)
+    
+    # Оценки всех пар колонок считаются сразу (см. column_similarity_matrix)
+    scores = column_similarity_matrix(source_columns, target_columns)
+    if source_values is not None and target_values is not None:
+        scores += np.rint(VALUE_MATCH_BONUS * value_similarity_matrix(
+            source_values, target_values, source_columns, target_columns
+        )).astype(np.int64)
+    target_positions = {}
+    for target_idx, target_col in enumerate(target_columns):
+        target_positions.setdefault(target_col, []).append(target_idx)
+    available = np.array([target_col not in used_target_columns for target_col in target_columns], dtype=bool)
+    source_positions = {}
+    for source_idx, source_col in enumerate(source_columns):
+        source_positions.setdefault(source_col, []).append(source_idx)
+    
+    # Пары из сопоставления похожей пары шаблонов получают бонус к оценке
+    if learned_mapping:
+        for source_col, target_col in learned_mapping.items():
+            scores[np.ix_(source_positions[source_col], target_positions[target_col])] += LEARNED_PAIR_BONUS
+    
+    if assignment == 'optimal':
+        # Оставшиеся исходные колонки и свободные целевые (повторяющиеся имена - по первому вхождению)
+        source_rows = list({
+            source_col: source_idx for source_idx, source_col in reversed(list(enumerate(source_columns)))
+            if source_col not in mapping
+        }.items())[::-1]
+        target_cols = [positions[0] for positions in target_positions.values() if available[positions[0]]]
+        
+        # Пары ниже порога не рассматриваются: их вес нулевой
+        weights = scores[np.ix_([source_idx for _, source_idx in source_rows], target_cols)] if source_rows and target_cols else np.zeros((0, 0))
+        weights = np.where((weights >= threshold) & (weights > 0), weights, 0)
+        
+        # Строки и столбцы без единой пары выше порога в решении не участвуют
+        match_rows = np.flatnonzero(weights.any(axis=1))
+        match_cols = np.flatnonzero(weights.any(axis=0))
+        for row, col in solve_assignment(weights[np.ix_(match_rows, match_cols)]):
+            row, col = match_rows[row], match_cols[col]
+            if weights[row, col] > 0:
+                best_match = target_columns[target_cols[col]]
+                mapping[source_rows[row][0]] = best_match
+                used_target_columns.add(best_match)
+    elif assignment == 'greedy':
+        # Проверка схожести названий колонок для оставшихся колонок: каждой исходной колонке
+        # по порядку достается лучшая из еще не занятых целевых (при равенстве - более ранняя)
+        for source_idx, source_col in enumerate(source_columns):
+            if source_col in mapping or not available.any():
+                continue
             
-            # Дополнительные атрибуты
-            "материал": ["состав", "материал изготовления", "материал товара", "материал изделия", 
-                        "основной материал", "material", "ткань", "основа", "сырье"],
-            "цвет": ["color", "расцветка", "цвет товара", "цвет изделия", "основной цвет", 
-                    "цветовой тон", "оттенок", "цвет и оттенок", "цветовое решение"],
-            "размер": ["габариты", "size", "размерный ряд", "размер товара", "размер изделия", 
-                      "линейные размеры", "типоразмер", "размерность", "габаритные размеры"],
-                    
-            # Фотографии
-            "фото": ["изображение", "картинка", "главное фото", "основное фото", "фотография", "photo", "image", 
-                    "ссылка на фото", "фото товара", "фотки", "снимки", "изображения", "ссылки на фото", 
-                    "picture", "ссылка на изображение", "ссылки на изображения", "ссылка на главное фото", 
-                    "ссылка на основное фото", "ссылки на фотографии", "ссылки на картинки", "фото 360"],
-            "главное фото": ["ссылка на главное фото", "основное фото", "главное изображение", "main photo", 
-                           "main image", "первое фото", "фото основное", "фото в карточке", "основная картинка", 
-                           "основное изображение", "главная фотография", "главное фото товара"],
-            "дополнительные фото": ["ссылки на дополнительные фото", "дополнительные изображения", "additional photos", 
-                                 "дополнительные картинки", "доп. фото", "доп фото", "галерея", "gallery", 
-                                 "фото галерея", "дополнительные фотографии", "фото товара"]
+            row_scores = np.where(available, scores[source_idx], -1)
+            best_idx = int(np.argmax(row_scores))
+            best_score = row_scores[best_idx]
+            if best_score > 0 and best_score >= threshold:
+                best_match = target_columns[best_idx]
+                mapping[source_col] = best_match
+                used_target_columns.add(best_match)
+                available[target_positions[best_match]] = False
+    else:
+        raise ValueError(f"Неизвестный способ сопоставления колонок: {assignment}")
+    
+    if return_scores:
+        pair_scores = {
+            source_col: LEARNED_MAPPING_SCORE if source_col in confirmed_mapping
+            else DICTIONARY_MAPPING_SCORE if source_col in dictionary_columns
+            else int(scores[source_positions[source_col][0], target_positions[target_col][0]])
+            for source_col, target_col in mapping.items()
         }
-        
-        # Проверяем, соответствует ли нормализованное имя одному из стандартных имён
-        for standard, aliases in marketplace_columns.items():
-            if normalized == standard or normalized in aliases:
-                return standard
-                
-        # Для оригинальных имен колонок с маркерами обязательности (звездочка и др.)
-        # добавляем повышенный приоритет для ключевых атрибутов
-        if '*' in original_name or '!' in original_name:
-            for key_field, aliases in {'артикул': marketplace_columns['артикул'], 
-                                      'название': marketplace_columns['название'], 
-                                      'цена': marketplace_columns['цена']}.items():
-                for alias in aliases:
-                    if alias in normalized or normalized in alias:
-                        return key_field
-                        
-        # Если колонка содержит цифры (например, Артикул1, Артикул2), очищаем от них
-        normalized = re.sub(r'\d+$', '', normalized).strip()
-                
-        return normalized
+        return mapping, pair_scores
     
-    # Функция для определения типа маркетплейса только по столбцам
-    def detect_marketplace_from_columns(columns):
-        if not columns:
-            return 'unknown'
-            
-        # Характерные колонки для Wildberries
-        wb_indicators = ['Артикул продавца', 'Артикул WB', 'Номер номенклатуры', 'Наименование']
+    return mapping
+
+# Слова в названии колонки, по которым определяется перевод единиц измерения при переносе
+WEIGHT_COLUMN_WORDS = ['вес', 'масса']
+SIZE_COLUMN_WORDS = ['длина', 'ширина', 'высота', 'глубина', 'диаметр', 'упаковк']
+
+# Перевод единиц измерения числовых значений (plan_column_transfer)
+UNIT_CONVERTERS = {
+    'kg_to_g': lambda value: value * 1000,
+    'g_to_kg': lambda value: value / 1000,
+    'mm_to_cm': lambda value: value / 10,
+    'cm_to_mm': lambda value: value * 10
+}
+
+# Целевые колонки-идентификаторы: значения переносятся строкой. Числа, записанные строкой,
+# сохраняются в исходном виде для полей ID_TEXT_FIELDS, остальные значения переводятся в строку
+# для полей ID_TARGET_FIELDS
+ID_TEXT_FIELDS = ['sku', 'артикул', 'guid', 'штрихкод', 'баркод']
+ID_TARGET_FIELDS = ['sku', 'артикул', 'код товара', 'guid', 'штрихкод', 'баркод']
+
+# Поля фотографий WB и Ozon
+WB_PHOTO_COLUMN = "Фото"
+OZON_MAIN_PHOTO_COLUMN = "Ссылка на главное фото*"
+OZON_EXTRA_PHOTOS_COLUMN = "Ссылки на дополнительные фото"
+
+# Форматы ячеек для дат и времени, если формат образца колонки не предназначен для дат
+DATE_NUMBER_FORMAT = 'dd.mm.yyyy'
+DATETIME_NUMBER_FORMAT = 'dd.mm.yyyy hh:mm:ss'
+TIME_NUMBER_FORMAT = 'hh:mm:ss'
+
+def date_number_format(value):
+    """
+    Выбирает формат ячейки для даты или времени: дата без времени суток показывается только датой.
+    
+    Returns:
+        str: Формат ячейки
+    """
+    if isinstance(value, datetime.datetime):
+        return DATE_NUMBER_FORMAT if value.time() == datetime.time() else DATETIME_NUMBER_FORMAT
+    if isinstance(value, datetime.date):
+        return DATE_NUMBER_FORMAT
+    return TIME_NUMBER_FORMAT
+
+def unit_conversion(source_col, target_col):
+    """
+    Определяет перевод единиц измерения при переносе значений между колонками.
+    
+    Returns:
+        str: Ключ UNIT_CONVERTERS ('kg_to_g', 'g_to_kg', 'mm_to_cm', 'cm_to_mm') или None
+    """
+    source_col_lower = source_col.lower()
+    target_col_lower = target_col.lower()
+    is_weight = any(word in source_col_lower for word in WEIGHT_COLUMN_WORDS)
+    is_size = any(word in source_col_lower for word in SIZE_COLUMN_WORDS)
+    
+    if is_weight and 'кг' in source_col_lower and 'г' in target_col_lower and 'кг' not in target_col_lower:
+        return 'kg_to_g'
+    if is_weight and 'г' in source_col_lower and 'кг' not in source_col_lower and 'кг' in target_col_lower:
+        return 'g_to_kg'
+    if is_size and 'мм' in source_col_lower and 'см' in target_col_lower:
+        return 'mm_to_cm'
+    if is_size and 'см' in source_col_lower and 'мм' in target_col_lower:
+        return 'cm_to_mm'
+    return None
+
+# Число, записанное строкой: цифры, не больше одной точки и одной запятой, возможно со знаком минус
+NUMBER_TEXT_PATTERN = r'-*(?=[.,]*\d)(?!.*\..*\.)(?!.*,.*,)[\d.,]+'
+
+def split_photo_links(value):
+    """Разбивает строку с фотографиями на ссылки (разделитель WB - точка с запятой) и оставляет только URL"""
+    if ';' in value:
+        photo_links = [link.strip() for link in value.split(';') if link.strip()]
+    else:
+        photo_links = [link.strip() for link in re.split(r'[\n\r,;]+', value.strip()) if link.strip()]
+    
+    cleaned_links = []
+    for link in photo_links:
+        if link.startswith('http'):
+            cleaned_links.append(link)
+        else:
+            cleaned_links.extend(re.findall(r'https?://[^\s,;]+', link))
+    return cleaned_links
+
+def make_value_converter(source_col, target_col, source_columns, source_filename=None):
+    """
+    Собирает преобразование значений одной пары колонок для переноса: все проверки по названиям
+    колонок (перевод единиц, поля-идентификаторы, категория продавца, фотографии WB <-> Ozon)
+    выполняются один раз, а возвращаемая функция применяет выбранные шаги сразу ко всей колонке:
+    числа в строках разбираются pd.to_numeric (запятая - десятичный разделитель), единицы
+    переводятся одним действием NumPy, идентификаторы приводятся к строке всей колонкой.
+    Пропуски (NaN, NaT) становятся пустыми ячейками (None), даты - значениями datetime.
+    
+    Args:
+        source_col: Колонка исходной таблицы
+        target_col: Колонка целевой таблицы
+        source_columns: Колонки исходной таблицы
+        source_filename: Имя исходного файла (для поля "Категория продавца")
         
-        # Характерные колонки для Ozon с маркером обязательности (*)
-        ozon_indicators = ['Артикул*', 'Название товара*', 'Бренд*', 'Ссылка на главное фото*', 
-                          'Вес в упаковке, г*', 'Высота упаковки, мм*', 'Длина упаковки, мм*', 'Ширина упаковки, мм*']
+    Returns:
+        function: converter(values, source_df) -> np.ndarray значений для ячеек целевой колонки,
+                  где values - колонка source_col, source_df - переносимые строки исходной таблицы
+    """
+    unit = UNIT_CONVERTERS.get(unit_conversion(source_col, target_col))
+    target_col_lower = target_col.lower()
+    keeps_text = any(field in target_col_lower for field in ID_TEXT_FIELDS)
+    is_id = any(field in target_col_lower for field in ID_TARGET_FIELDS)
+    
+    # Поле "Категория продавца" заполняется именем исходного файла без расширения
+    category = None
+    if target_col == "Категория продавца" and source_filename:
+        category = os.path.splitext(os.path.basename(source_filename))[0]
+    
+    # WB -> Ozon: "Фото" делится на главное фото (первая ссылка) и дополнительные (остальные, с новой строки)
+    splits_photos = source_col == WB_PHOTO_COLUMN and target_col in (OZON_MAIN_PHOTO_COLUMN, OZON_EXTRA_PHOTOS_COLUMN)
+    # Ozon -> WB: главное фото объединяется с дополнительными из той же строки через точку с запятой
+    merges_photos = (
+        source_col == OZON_MAIN_PHOTO_COLUMN and target_col == WB_PHOTO_COLUMN
+        and OZON_EXTRA_PHOTOS_COLUMN in source_columns
+    )
+    
+    def converter(values, source_df):
+        filled = ~values.isna().to_numpy()
+        if category is not None:
+            result = np.empty(len(values), dtype=object)
+            result[:] = category
+            return result
         
-        wb_matches = sum(1 for col in columns if col in wb_indicators)
-        ozon_matches = sum(1 for col in columns if col in ozon_indicators)
+        # Даты - значениями datetime (Excel не хранит часовой пояс), пропуски - пустыми ячейками
+        if is_datetime64_any_dtype(values.dtype):
+            if values.dt.tz is not None:
+                values = values.dt.tz_localize(None)
+            result = values.to_numpy(dtype='datetime64[us]').astype(object)
+        else:
+            result = values.to_numpy(dtype=object).copy()
+        result[~filled] = None
         
-        if wb_matches > ozon_matches:
-            return 'wildberries'
-        elif ozon_matches > wb_matches:
-            return 'ozon'
+        # Виды значений: строки, числа (int и float, в том числе bool) и прочие
+        if is_numeric_dtype(values.dtype):
+            is_text = np.zeros(len(result), dtype=bool)
+            is_number = filled.copy()
         else:
-            # Если не удалось однозначно определить, возвращаем 'unknown'
-            return 'unknown'
-    
-    # Определяем тип маркетплейса для исходных и целевых колонок
-    source_marketplace = detect_marketplace_from_columns(source_columns)
-    target_marketplace = detect_marketplace_from_columns(target_columns)
+            is_text = np.fromiter((isinstance(value, str) for value in result), dtype=bool, count=len(result))
+            is_number = filled & np.fromiter((isinstance(value, (int, float)) for value in result), dtype=bool, count=len(result))
+        converted = filled.copy()
+        
+        # Числа, записанные строкой, переводятся в число (кроме полей-идентификаторов);
+        # строку, которая не разбирается как число, оставляем как есть
+        if is_text.any():
+            text_idx = np.flatnonzero(is_text)
+            text = pd.Series(result[text_idx], dtype=object)
+            number_text = text.str.fullmatch(NUMBER_TEXT_PATTERN).to_numpy(dtype=bool)
+            text_idx, text = text_idx[number_text], text[number_text]
+            numbers = pd.to_numeric(text.str.replace(',', '.', regex=False), errors='coerce').to_numpy(dtype=np.float64)
+            parsed = ~np.isnan(numbers)
+            converted[text_idx[~parsed]] = False
+            text_idx, numbers = text_idx[parsed], numbers[parsed]
+            if unit is not None:
+                result[text_idx] = unit(numbers).tolist()
+            elif not keeps_text:
+                result[text_idx] = numbers.tolist()
+        
+        # Перевод единиц у чисел - одним действием над всеми числами колонки
+        if unit is not None and is_number.any():
+            number_idx = np.flatnonzero(is_number)
+            # У колонки смешанных типов действие выполняется над массивом объектов: int остается int
+            numbers = values.to_numpy()[number_idx] if is_numeric_dtype(values.dtype) else result[number_idx]
+            result[number_idx] = unit(numbers).tolist()
+        
+        # Идентификаторы (SKU, Артикул и т.д.) - всегда строкой
+        if is_id and converted.any():
+            result[converted] = pd.Series(result[converted], dtype=object).astype(str).to_numpy(dtype=object)
+        
+        if splits_photos:
+            for row_idx, value in enumerate(result):
+                if value and isinstance(value, str):
+                    cleaned_links = split_photo_links(value)
+                    if cleaned_links:
+                        if target_col == OZON_MAIN_PHOTO_COLUMN:
+                            result[row_idx] = cleaned_links[0]
+                        else:
+                            result[row_idx] = '\n'.join(cleaned_links[1:]) if len(cleaned_links) > 1 else ""
+        
+        if merges_photos:
+            for row_idx, (value, additional_photos) in enumerate(zip(result, source_df[OZON_EXTRA_PHOTOS_COLUMN].to_numpy(dtype=object))):
+                main_photo = str(value) if value else ""
+                if additional_photos and isinstance(additional_photos, str):
+                    add_photos_split = re.split(r'[\n\r,;]+', additional_photos.strip())
+                    add_photos_clean = [p.strip() for p in add_photos_split if p and p.strip().startswith('http')]
+                    if main_photo:
+                        result[row_idx] = ';'.join([main_photo] + add_photos_clean)
+                    else:
+                        result[row_idx] = ';'.join(add_photos_clean) if add_photos_clean else ""
+        
+        return result
     
-    # Применяем готовые словари соответствия в зависимости от направления
-    if source_marketplace == 'wildberries' and target_marketplace == 'ozon':
-        # WB -> Ozon
-        for source_col in source_columns:
-            if source_col in wb_to_ozon and wb_to_ozon[source_col] in target_columns:
-                mapping[source_col] = wb_to_ozon[source_col]
-                used_target_columns.add(wb_to_ozon[source_col])
-    elif source_marketplace == 'ozon' and target_marketplace == 'wildberries':
-        # Ozon -> WB
-        for source_col in source_columns:
-            if source_col in ozon_to_wb and ozon_to_wb[source_col] in target_columns:
-                mapping[source_col] = ozon_to_wb[source_col]
-                used_target_columns.add(ozon_to_wb[source_col])
+    return converter
+
+# Имя именованных стилей, которые перенос данных добавляет в книгу (с номером: "Перенос данных 1")
+TRANSFER_STYLE_NAME = "Перенос данных"
+
+CELL_STYLE_KEYS = ('font', 'fill', 'border', 'alignment', 'number_format', 'protection')
+
+def register_cell_style(workbook, cell_style, registered):
+    """
+    Регистрирует образец форматирования ячейки (font, fill, border, alignment, number_format,
+    protection) в книге как именованный стиль. Стиль собирается один раз на образец, а ячейке
+    достаточно присвоить его имя (cell.style = имя), без пересчета стилей книги для каждой
+    ячейки, как при присваивании cell.font и т.п.
     
-    # Проверка схожести названий колонок для оставшихся колонок
-    for source_col in source_columns:
-        if source_col not in mapping:
-            source_normalized = normalize_column_name(source_col)
-            
-            best_match = None
-            best_score = 0
-            
-            for target_col in target_columns:
-                if target_col not in used_target_columns:
-                    target_normalized = normalize_column_name(target_col)
-                    
-                    # Проверяем нечеткое совпадение
-                    score = fuzz.token_sort_ratio(source_normalized, target_normalized)
-                    
-                    # Повышаем вес для точных соответствий
-                    if source_normalized == target_normalized:
-                        score += 30
-                    
-                    # Повышаем вес для частичных соответствий
-                    elif source_normalized in target_normalized or target_normalized in source_normalized:
-                        score += 15
-                    
-                    # Обрабатываем специфические отношения между единицами измерения
-                    # Вес: кг <-> г
-                    if ('кг' in source_col.lower() and 'г' in target_col.lower() and 'кг' not in target_col.lower()) or \
-                       ('кг' in target_col.lower() and 'г' in source_col.lower() and 'кг' not in source_col.lower()):
-                        if any(w in source_normalized for w in ['вес', 'масса']) and \
-                           any(w in target_normalized for w in ['вес', 'масса']):
-                            score += 20
-                    
-                    # Размеры: мм <-> см
-                    if ('мм' in source_col.lower() and 'см' in target_col.lower()) or \
-                       ('мм' in target_col.lower() and 'см' in source_col.lower()):
-                        if any(w in source_normalized for w in ['длина', 'ширина', 'высота', 'глубина', 'габарит', 'размер']) and \
-                           any(w in target_normalized for w in ['длина', 'ширина', 'высота', 'глубина', 'габарит', 'размер']):
-                            score += 20
-                    
-                    if score > best_score and score >= threshold:
-                        best_score = score
-                        best_match = target_col
-            
-            if best_match:
-                mapping[source_col] = best_match
-                used_target_columns.add(best_match)
+    Args:
+        workbook: Рабочая книга openpyxl
+        cell_style: Образец форматирования {элемент: значение}; отсутствующие элементы - по умолчанию
+        registered: Уже зарегистрированные образцы {образец: имя стиля}, одинаковые образцы
+                    получают один стиль
+        
+    Returns:
+        str: Имя именованного стиля
+    """
+    key = tuple(cell_style.get(name) for name in CELL_STYLE_KEYS)
+    if key not in registered:
+        existing_names = set(workbook.named_styles)
+        number = len(registered) + 1
+        while f"{TRANSFER_STYLE_NAME} {number}" in existing_names:
+            number += 1
+        
+        style = NamedStyle(name=f"{TRANSFER_STYLE_NAME} {number}")
+        for name, value in zip(CELL_STYLE_KEYS, key):
+            if value:
+                setattr(style, name, value)
+        workbook.add_named_style(style)
+        registered[key] = style.name
+    return registered[key]
+
+def plan_column_transfer(column_mapping, source_columns, target_column_indices, source_filename=None):
+    """
+    Составляет план переноса данных: по одной операции на каждую пару колонок, которая
+    действительно переносится (колонки есть в обеих таблицах и не исключены).
     
-    return mapping
+    Args:
+        column_mapping: Словарь соответствия колонок {source_column: target_column или список}
+        source_columns: Колонки исходной таблицы
+        target_column_indices: Номера колонок целевого листа {заголовок: номер колонки}
+        source_filename: Имя исходного файла (для поля "Категория продавца")
+        
+    Returns:
+        list: Операции (исходная колонка, номер целевой колонки, converter) в порядке
+              column_mapping (см. make_value_converter)
+    """
+    source_columns = set(source_columns)
+    plan = []
+    for source_col, target_col_value in column_mapping.items():
+        if source_col in excluded_columns or source_col not in source_columns:
+            continue
+        
+        target_cols = target_col_value if isinstance(target_col_value, list) else [target_col_value]
+        for target_col in target_cols:
+            if target_col not in target_column_indices or target_col in excluded_columns:
+                continue
+            # Дополнительные фото Ozon переносятся в "Фото" вместе с главным фото
+            if (source_col == OZON_EXTRA_PHOTOS_COLUMN and target_col == WB_PHOTO_COLUMN
+                    and OZON_MAIN_PHOTO_COLUMN in source_columns and OZON_MAIN_PHOTO_COLUMN in column_mapping):
+                continue
+            plan.append((
+                source_col,
+                target_column_indices[target_col],
+                make_value_converter(source_col, target_col, source_columns, source_filename)
+            ))
+    return plan
 
 def transfer_data_between_tables(source_df, target_workbook, target_sheet_name, column_mapping, target_header_row=1, source_filename=None):
     """
@@ -998,7 +2080,7 @@ def transfer_data_between_tables(source_df, target_workbook, target_sheet_name,
             val = first_row[col]
             if isinstance(val, str) and not any(c.isdigit() for c in val):
                 string_descriptors += 1
-            elif isinstance(val, (int, float)) and not pd.isna(val):
+            elif isinstance(val, (int, float, np.number)) and not pd.isna(val):
                 numeric_values += 1
                 
         # Если в первой строке больше нечисловых описательных значений, это может быть подзаголовок
@@ -1030,195 +2112,45 @@ def transfer_data_between_tables(source_df, target_workbook, target_sheet_name,
         for col_idx in range(1, target_sheet.max_column + 1):
             target_sheet.cell(row=row_idx, column=col_idx).value = None
     
-    # Копируем данные из исходной таблицы
+    # Копируем данные из исходной таблицы по заранее составленному плану переноса
     if len(source_df) > data_start_idx:
         data_to_copy = source_df.iloc[data_start_idx:]
+        plan = plan_column_transfer(column_mapping, source_df.columns, target_column_indices, source_filename)
         
-        for idx, source_row in data_to_copy.iterrows():
-            target_row_idx = target_data_start_row + (idx - data_start_idx)
-            
-            for source_col, target_col_value in column_mapping.items():
-                # Проверяем, не входит ли колонка в список исключений
-                if source_col in excluded_columns:
-                    continue
-                    
-                # Обрабатываем случай, когда target_col - это список
-                if isinstance(target_col_value, list):
-                    target_cols = target_col_value
-                else:
-                    target_cols = [target_col_value]
-                    
-                # Проходим по всем целевым колонкам
-                for target_col in target_cols:
-                    # Проверяем, существуют ли исходная и целевая колонки, и не в списке ли исключений целевая колонка
-                    if source_col in source_df.columns and target_col in target_column_indices and target_col not in excluded_columns:
-                        # Получаем значение из исходной таблицы
-                        value = source_row.get(source_col)
-                        target_col_idx = target_column_indices[target_col]
-                        
-                        # Предобработка значения и безопасное преобразование
-                        if value is not None and not pd.isna(value):
-                            # Для строк и чисел - разные преобразования
-                            try:
-                                # Преобразование единиц измерения
-                                source_col_lower = source_col.lower()
-                                target_col_lower = target_col.lower()
-                                
-                                # Для чисел, представленных как строки, пробуем безопасно конвертировать
-                                if isinstance(value, str) and (value.replace('.', '', 1).replace(',', '', 1).isdigit() or 
-                                                              value.lstrip('-').replace('.', '', 1).replace(',', '', 1).isdigit()):
-                                    # Заменяем запятую на точку для правильного преобразования
-                                    numeric_value = float(value.replace(',', '.'))
-                                    
-                                    # Вес: кг -> г
-                                    if (('вес' in source_col_lower or 'масса' in source_col_lower) and 
-                                       'кг' in source_col_lower and 'г' in target_col_lower and 'кг' not in target_col_lower):
-                                        value = numeric_value * 1000  # Из кг в г
-                                    
-                                    # Вес: г -> кг
-                                    elif (('вес' in source_col_lower or 'масса' in source_col_lower) and 
-                                          'г' in source_col_lower and 'кг' not in source_col_lower and 'кг' in target_col_lower):
-                                        value = numeric_value / 1000  # Из г в кг
-                                    
-                                    # Размеры: мм -> см
-                                    elif ((any(dim in source_col_lower for dim in ['длина', 'ширина', 'высота', 'глубина', 'диаметр']) or 
-                                         'упаковк' in source_col_lower) and 
-                                          'мм' in source_col_lower and 'см' in target_col_lower):
-                                        value = numeric_value / 10  # Из мм в см
-                                    
-                                    # Размеры: см -> мм
-                                    elif ((any(dim in source_col_lower for dim in ['длина', 'ширина', 'высота', 'глубина', 'диаметр']) or 
-                                         'упаковк' in source_col_lower) and 
-                                          'см' in source_col_lower and 'мм' in target_col_lower):
-                                        value = numeric_value * 10  # Из см в мм
-                                    else:
-                                        # Если не нужно преобразовывать единицы, но значение числовое
-                                        # оставляем его в виде строки для избежания проблем с конвертацией
-                                        # например для полей типа "Артикул", "SKU" и т.д.
-                                        if any(id_field in target_col_lower for id_field in ['sku', 'артикул', 'guid', 'штрихкод', 'баркод']):
-                                            value = str(value)  # Оставляем как строку
-                                        else:
-                                            value = numeric_value  # Используем числовое значение
-                                            
-                                # Для числовых значений
-                                elif isinstance(value, (int, float)):
-                                    # Вес: кг -> г
-                                    if (('вес' in source_col_lower or 'масса' in source_col_lower) and 
-                                       'кг' in source_col_lower and 'г' in target_col_lower and 'кг' not in target_col_lower):
-                                        value = value * 1000  # Из кг в г
-                                    
-                                    # Вес: г -> кг
-                                    elif (('вес' in source_col_lower or 'масса' in source_col_lower) and 
-                                          'г' in source_col_lower and 'кг' not in source_col_lower and 'кг' in target_col_lower):
-                                        value = value / 1000  # Из г в кг
-                                    
-                                    # Размеры: мм -> см
-                                    elif ((any(dim in source_col_lower for dim in ['длина', 'ширина', 'высота', 'глубина', 'диаметр']) or 
-                                         'упаковк' in source_col_lower) and 
-                                          'мм' in source_col_lower and 'см' in target_col_lower):
-                                        value = value / 10  # Из мм в см
-                                    
-                                    # Размеры: см -> мм
-                                    elif ((any(dim in source_col_lower for dim in ['длина', 'ширина', 'высота', 'глубина', 'диаметр']) or 
-                                         'упаковк' in source_col_lower) and 
-                                          'см' in source_col_lower and 'мм' in target_col_lower):
-                                        value = value * 10  # Из см в мм
-                                        
-                                # Для идентификаторов (SKU, Артикул и т.д.) - всегда преобразуем в строку
-                                if any(id_field in target_col_lower for id_field in ['sku', 'артикул', 'код товара', 'guid', 'штрихкод', 'баркод']):
-                                    value = str(value)
-                            except (ValueError, TypeError) as e:
-                                # В случае ошибки преобразования оставляем исходное значение
-                                pass
-                                    
-                        # Специальная обработка для поля "Категория продавца" - использование имени файла
-                        # Заполняем поле "Категория продавца" всегда, когда оно есть в шаблоне
-                        if target_col == "Категория продавца" and source_filename:
-                            # Извлекаем название файла без расширения
-                            filename_without_ext = os.path.splitext(os.path.basename(source_filename))[0]
-                            value = filename_without_ext
-                            
-                        # Специальная обработка для фотографий - здесь i это индекс строки
-                        i = idx - data_start_idx  # Индекс строки в исходном DataFrame
-                        
-                        # WB -> Ozon: поле "Фото" переносится в "Ссылка на главное фото*" (первая ссылка) и "Ссылки на дополнительные фото"
-                        if source_col == "Фото" and (target_col == "Ссылка на главное фото*" or target_col == "Ссылки на дополнительные фото"):
-                            if value and isinstance(value, str):
-                                # Разделяем строку с фотографиями по точке с запятой (характерно для WB)
-                                photo_links = []
-                                if ';' in value:
-                                    photo_links = [link.strip() for link in value.split(';') if link.strip()]
-                                # Если нет разделителя точка с запятой, используем другие разделители
-                                else:
-                                    photo_links = [link.strip() for link in re.split(r'[\n\r,;]+', value.strip()) if link.strip()]
-                                
-                                # Очищаем ссылки и оставляем только URL
-                                cleaned_links = []
-                                for link in photo_links:
-                                    if link.startswith('http'):
-                                        cleaned_links.append(link)
-                                    else:
-                                        # Ищем URL в строке
-                                        urls = re.findall(r'https?://[^\s,;]+', link)
-                                        cleaned_links.extend(urls)
-                                
-                                # Если нашли URL
-                                if cleaned_links:
-                                    if target_col == "Ссылка на главное фото*":
-                                        # Берем только первую ссылку для главного фото
-                                        value = cleaned_links[0]
-                                    elif target_col == "Ссылки на дополнительные фото":
-                                        # Для дополнительных фото берем все кроме первой, добавляем каждую с новой строки без разделителя ";"
-                                        if len(cleaned_links) > 1:
-                                            # Используем перенос строки (без других разделителей)
-                                            value = '\n'.join(cleaned_links[1:])
-                                        else:
-                                            value = ""  # Если есть только одно фото, то поле дополнительных фото оставляем пустым
-                                        
-                        # Ozon -> WB: объединяем "Ссылка на главное фото*" и "Ссылки на дополнительные фото" в поле "Фото"
-                        if (source_col == "Ссылка на главное фото*" or source_col == "Ссылки на дополнительные фото") and target_col == "Фото":
-                            # Если мы обрабатываем главное фото
-                            if source_col == "Ссылка на главное фото*":
-                                # Преобразуем значение в строку, чтобы избежать ошибок конкатенации
-                                main_photo = str(value) if value else ""
-                                
-                                # Ищем дополнительные фото в этой же строке
-                                additional_photos_col = "Ссылки на дополнительные фото"
-                                if additional_photos_col in source_df.columns:
-                                    additional_photos = source_row.get(additional_photos_col, "")
-                                    if additional_photos and isinstance(additional_photos, str):
-                                        # Разбиваем дополнительные фото, которые могут быть с переносом строки
-                                        add_photos_split = re.split(r'[\n\r,;]+', additional_photos.strip())
-                                        add_photos_clean = [p.strip() for p in add_photos_split if p and p.strip().startswith('http')]
-                                        
-                                        # Объединяем фото с правильным разделителем - точка с запятой для WB
-                                        if main_photo:
-                                            all_photos = [main_photo] + add_photos_clean
-                                            value = ';'.join(all_photos)
-                                        else:
-                                            value = ';'.join(add_photos_clean) if add_photos_clean else ""
-                            
-                            # Если мы обрабатываем дополнительные фото, то пропускаем обработку,
-                            # так как они уже обработаны вместе с главным фото
-                            elif source_col == "Ссылки на дополнительные фото":
-                                # Проверяем, обрабатывали ли мы уже эту пару колонок через главное фото
-                                main_photo_col = "Ссылка на главное фото*"
-                                if main_photo_col in source_df.columns and main_photo_col in column_mapping:
-                                    continue  # Пропускаем, так как эти данные уже должны быть обработаны через главное фото
-                        
-                        # Записываем значение в целевую таблицу
-                        cell = target_sheet.cell(row=target_row_idx, column=target_col_idx)
-                        cell.value = value
-                    
-                    # Применяем сохраненное форматирование из образца данных (не из подсказок)
-                    if target_col in style_info:
-                        cell_style = style_info[target_col]
-                        if cell_style['font']: cell.font = cell_style['font']
-                        if cell_style['fill']: cell.fill = cell_style['fill']
-                        if cell_style['border']: cell.border = cell_style['border']
-                        if cell_style['alignment']: cell.alignment = cell_style['alignment']
-                        if cell_style['number_format']: cell.number_format = cell_style['number_format']
-                        if cell_style['protection']: cell.protection = cell_style['protection']
+        # Образец форматирования по номеру целевой колонки: образцы регистрируются в книге
+        # именованными стилями один раз (одинаковые образцы - одним стилем)
+        registered_styles = {}
+        style_by_index = {target_column_indices[col_name]: cell_style for col_name, cell_style in style_info.items()}
+        style_name_by_index = {
+            target_col_idx: register_cell_style(target_workbook, cell_style, registered_styles)
+            for target_col_idx, cell_style in style_by_index.items()
+        }
+        
+        # Строки целевого листа для строк исходной таблицы
+        target_rows = (target_data_start_row + (data_to_copy.index.to_numpy() - data_start_idx)).tolist()
+        
+        # Значения преобразуются сразу для всей колонки, затем записываются в ячейки
+        for source_col, target_col_idx, converter in plan:
+            values = converter(data_to_copy[source_col], data_to_copy)
+            cell_style = style_by_index.get(target_col_idx, {})
+            style_name = style_name_by_index.get(target_col_idx)
+            # Даты получают формат даты, если формат образца колонки не предназначен для дат
+            date_style_names = None if is_date_format(cell_style.get('number_format') or 'General') else {}
+            for target_row_idx, value in zip(target_rows, values):
+                cell = target_sheet.cell(row=target_row_idx, column=target_col_idx)
+                cell.value = value
+                
+                # Применяем сохраненное форматирование из образца данных (не из подсказок)
+                cell_style_name = style_name
+                if date_style_names is not None and isinstance(value, (datetime.date, datetime.time)):
+                    number_format = date_number_format(value)
+                    if number_format not in date_style_names:
+                        date_style_names[number_format] = register_cell_style(
+                            target_workbook, dict(cell_style, number_format=number_format), registered_styles
+                        )
+                    cell_style_name = date_style_names[number_format]
+                if cell_style_name:
+                    cell.style = cell_style_name
     
     # Восстанавливаем подзаголовки в целевой таблице, если они были
     if has_subheaders:
@@ -1236,6 +2168,9 @@ def transfer_data_between_tables(source_df, target_workbook, target_sheet_name,
                 if subheader_style['number_format']: subheader_cell.number_format = subheader_style['number_format']
                 if subheader_style['protection']: subheader_cell.protection = subheader_style['protection']
     
+    # Строки целевого листа изменились: сбрасываем их кеш для детекторов шаблонов
+    discard_row_cache(target_sheet)
+    
     return target_workbook
 
 def preview_data(source_df, target_df, column_mapping, source_filename=None):
@@ -1268,7 +2203,7 @@ def preview_data(source_df, target_df, column_mapping, source_filename=None):
         
         for col in source_df.columns:
             val = first_row[col]
-            if isinstance(val, (int, float)) and not pd.isna(val):
+            if isinstance(val, (int, float, np.number)) and not pd.isna(val):
                 numeric_values += 1
             elif isinstance(val, str) and not any(c.isdigit() for c in val):
                 string_descriptors += 1
@@ -1309,7 +2244,7 @@ def preview_data(source_df, target_df, column_mapping, source_filename=None):
         
         for col in preview_df.columns:
             val = first_row[col]
-            if isinstance(val, (int, float)) and not pd.isna(val):
+            if isinstance(val, (int, float, np.number)) and not pd.isna(val):
                 numeric_values += 1
             elif isinstance(val, str) and not any(c.isdigit() for c in val) and not pd.isna(val):
                 string_descriptors += 1
@@ -0,0 +1,744 @@
+"""
+Модуль для ленивой загрузки книг Excel (xlsx).
+Сначала читается только оглавление книги (xl/workbook.xml) со списком листов и их размерами,
+а содержимое листа разбирается только при первом обращении к нему и затем кешируется.
+
+Листы разбираются одним из движков:
+- 'openpyxl' - потоковое чтение средствами openpyxl (read_only);
+- 'xml' - собственный потоковый разбор sharedStrings.xml и XML листа (iterparse)
+  без создания объектов ячеек openpyxl; значения сразу складываются в строки или колонки.
+"""
+
+import io
+import itertools
+import mmap
+import os
+import posixpath
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import openpyxl
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.cell import column_index_from_string, range_boundaries
+from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, from_excel, from_ISO8601
+
+# Пространства имен XML, используемые в файлах xlsx
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# Доступные движки разбора листов
+ENGINES = ('openpyxl', 'xml')
+
+# Суммарный размер XML разбираемых листов (в байтах, без сжатия), начиная с которого
+# листы разбираются в пуле процессов: на меньших книгах запуск пула дольше самого разбора
+PARALLEL_MIN_SHEET_BYTES = 8 * 1024 * 1024
+
+# Описание листа в оглавлении книги
+SheetInfo = namedtuple('SheetInfo', ['name', 'path', 'state', 'dimension'])
+
+# Ячейка листа, загруженного в LazyWorkbook (совместима с обращением cell.value)
+ValueCell = namedtuple('ValueCell', ['value'])
+
+class MappedFile(io.RawIOBase):
+    """
+    Файловый объект только для чтения поверх отображения файла в память (mmap).
+    Его можно передавать в zipfile и openpyxl вместо файла: члены архива читаются прямо
+    из отображения по мере надобности, без копирования всего архива в байты Python.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        try:
+            self._map.seek(offset, whence)
+        except ValueError as e:
+            # Как у обычного файла: zipfile ожидает OSError для недопустимой позиции
+            raise OSError(str(e)) from e
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def read(self, size=-1):
+        return self._map.read(-1 if size is None else size)
+
+    def readinto(self, buffer):
+        data = self._map.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+def open_mapped(path):
+    """
+    Открывает файл с диска через mmap (см. MappedFile).
+
+    Args:
+        path: Путь к файлу
+
+    Returns:
+        MappedFile: Файловый объект поверх отображения файла
+    """
+    return MappedFile(path)
+
+def _local_name(tag):
+    """Возвращает имя XML-тега без пространства имен"""
+    return tag.rsplit('}', 1)[-1]
+
+def _resolve_part_path(target):
+    """Преобразует путь из xl/_rels/workbook.xml.rels в путь внутри zip-архива"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join('xl', target))
+
+def read_sheet_dimension(archive, path):
+    """
+    Читает размеры листа из тега <dimension> в начале XML листа, не разбирая данные листа.
+
+    Args:
+        archive: Открытый zipfile.ZipFile с книгой
+        path: Путь к XML листа внутри архива
+
+    Returns:
+        str: Диапазон вида 'A1:Q53' или None, если размеры не указаны
+    """
+    with archive.open(path) as source:
+        for _, element in ET.iterparse(source, events=('start',)):
+            name = _local_name(element.tag)
+            if name == 'dimension':
+                return element.get('ref')
+            if name == 'sheetData':
+                # Данные листа начались, тега с размерами нет
+                return None
+    return None
+
+def read_sheet_directory(archive):
+    """
+    Составляет оглавление книги: имена листов, пути к их XML, видимость и размеры.
+    Читает только xl/workbook.xml, связи книги и заголовки XML листов.
+
+    Args:
+        archive: Открытый zipfile.ZipFile с книгой
+
+    Returns:
+        list: Список SheetInfo в порядке листов книги
+    """
+    relationships = {}
+    with archive.open('xl/_rels/workbook.xml.rels') as source:
+        for rel in ET.parse(source).getroot().iter(f'{{{PACKAGE_REL_NS}}}Relationship'):
+            relationships[rel.get('Id')] = _resolve_part_path(rel.get('Target'))
+
+    directory = []
+    with archive.open('xl/workbook.xml') as source:
+        root = ET.parse(source).getroot()
+        for sheet in root.iter(f'{{{MAIN_NS}}}sheet'):
+            path = relationships.get(sheet.get(f'{{{REL_NS}}}id'))
+            if path is None or path not in archive.NameToInfo:
+                # Листы диаграмм и битые ссылки пропускаем
+                continue
+            directory.append(SheetInfo(
+                name=sheet.get('name'),
+                path=path,
+                state=sheet.get('state', 'visible'),
+                dimension=read_sheet_dimension(archive, path)
+            ))
+
+    return directory
+
+def _cell_text(element):
+    """Собирает текст строки из <si> или <is> (обычный текст и фрагменты rich text, без фонетики)"""
+    parts = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            for run_child in child:
+                if _local_name(run_child.tag) == 't':
+                    parts.append(run_child.text or '')
+    return ''.join(parts)
+
+def iter_shared_strings(archive):
+    """
+    Потоково читает таблицу общих строк книги (xl/sharedStrings.xml).
+
+    Args:
+        archive: Открытый zipfile.ZipFile с книгой
+
+    Yields:
+        str: Строки в порядке их индексов
+    """
+    if 'xl/sharedStrings.xml' not in archive.NameToInfo:
+        return
+
+    with archive.open('xl/sharedStrings.xml') as source:
+        root = None
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event == 'end' and _local_name(element.tag) == 'si':
+                yield _cell_text(element)
+                # Освобождаем уже разобранные элементы
+                root.clear()
+
+def read_shared_strings(archive):
+    """Читает всю таблицу общих строк книги (см. iter_shared_strings) в список"""
+    return list(iter_shared_strings(archive))
+
+class SharedStrings:
+    """
+    Таблица общих строк, которая дочитывается из архива только до запрошенного индекса.
+    Заголовки шаблонов обычно попадают в начало sharedStrings.xml, поэтому для чтения
+    верхних строк листа (см. LazyWorkbook.head) не нужно разбирать всю таблицу строк.
+    """
+
+    def __init__(self, archive):
+        self._strings = []
+        self._reader = iter_shared_strings(archive)
+
+    def _read_until(self, idx):
+        while self._reader is not None and (idx is None or idx >= len(self._strings)):
+            try:
+                self._strings.append(next(self._reader))
+            except StopIteration:
+                self._reader = None
+
+    def __getitem__(self, idx):
+        if idx >= len(self._strings):
+            self._read_until(idx)
+        return self._strings[idx]
+
+    def __len__(self):
+        self._read_until(None)
+        return len(self._strings)
+
+    def to_list(self):
+        """Дочитывает таблицу до конца и возвращает все строки списком"""
+        self._read_until(None)
+        return list(self._strings)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+def read_date_styles(archive):
+    """
+    Находит индексы стилей ячеек, имеющих формат даты (числа в таких ячейках - это даты Excel).
+
+    Args:
+        archive: Открытый zipfile.ZipFile с книгой
+
+    Returns:
+        set: Индексы стилей (атрибут s ячейки) с форматом даты
+    """
+    date_styles = set()
+    if 'xl/styles.xml' not in archive.NameToInfo:
+        return date_styles
+
+    with archive.open('xl/styles.xml') as source:
+        root = ET.parse(source).getroot()
+
+    custom_formats = {}
+    for num_fmt in root.iter(f'{{{MAIN_NS}}}numFmt'):
+        custom_formats[int(num_fmt.get('numFmtId'))] = num_fmt.get('formatCode')
+
+    cell_xfs = root.find(f'{{{MAIN_NS}}}cellXfs')
+    if cell_xfs is None:
+        return date_styles
+
+    for style_idx, xf in enumerate(cell_xfs.iter(f'{{{MAIN_NS}}}xf')):
+        num_fmt_id = int(xf.get('numFmtId', 0))
+        format_code = custom_formats.get(num_fmt_id, BUILTIN_FORMATS.get(num_fmt_id))
+        if format_code and is_date_format(format_code):
+            date_styles.add(style_idx)
+
+    return date_styles
+
+def read_workbook_epoch(archive):
+    """Возвращает начало отсчета дат книги (1900 или 1904)"""
+    with archive.open('xl/workbook.xml') as source:
+        root = ET.parse(source).getroot()
+    workbook_pr = root.find(f'{{{MAIN_NS}}}workbookPr')
+    if workbook_pr is not None and workbook_pr.get('date1904') in ('1', 'true'):
+        return MAC_EPOCH
+    return WINDOWS_EPOCH
+
+def _cast_number(value):
+    """Преобразует число из XML в int или float (так же, как openpyxl)"""
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+def _column_from_reference(reference):
+    """Возвращает индекс колонки (начиная с 0) по адресу ячейки вида 'AB12'"""
+    letters = reference.rstrip('0123456789')
+    return column_index_from_string(letters) - 1
+
+def iter_sheet_cells(archive, path, shared_strings, date_styles=frozenset(), epoch=WINDOWS_EPOCH):
+    """
+    Потоково разбирает XML листа и возвращает значения ячеек по строкам.
+    Значения соответствуют openpyxl с data_only=True: для формул берется сохраненный результат.
+
+    Args:
+        archive: Открытый zipfile.ZipFile с книгой
+        path: Путь к XML листа внутри архива
+        shared_strings: Таблица общих строк (см. read_shared_strings)
+        date_styles: Индексы стилей с форматом даты (см. read_date_styles)
+        epoch: Начало отсчета дат книги
+
+    Yields:
+        tuple: (номер строки (начиная с 1), словарь {индекс колонки (начиная с 0): значение})
+               Пустые ячейки в словарь не попадают.
+    """
+    c_tag = f'{{{MAIN_NS}}}c'
+    row_tag = f'{{{MAIN_NS}}}row'
+    v_tag = f'{{{MAIN_NS}}}v'
+    is_tag = f'{{{MAIN_NS}}}is'
+
+    with archive.open(path) as source:
+        sheet_data = None
+        row_idx = 0
+        col_idx = -1
+        values = {}
+
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            tag = element.tag
+
+            if event == 'start':
+                if tag == row_tag:
+                    row_idx = int(element.get('r', row_idx + 1))
+                    col_idx = -1
+                    values = {}
+                elif sheet_data is None and _local_name(tag) == 'sheetData':
+                    sheet_data = element
+                continue
+
+            if tag == c_tag:
+                reference = element.get('r')
+                col_idx = _column_from_reference(reference) if reference else col_idx + 1
+
+                data_type = element.get('t', 'n')
+                if data_type == 'inlineStr':
+                    inline = element.find(is_tag)
+                    value = _cell_text(inline) if inline is not None else None
+                else:
+                    value_element = element.find(v_tag)
+                    value = value_element.text if value_element is not None else None
+
+                if value is not None:
+                    if data_type == 's':
+                        value = shared_strings[int(value)]
+                    elif data_type == 'n':
+                        value = _cast_number(value)
+                        style = element.get('s')
+                        if style is not None and int(style) in date_styles:
+                            value = from_excel(value, epoch)
+                    elif data_type == 'b':
+                        value = bool(int(value))
+                    elif data_type == 'd':
+                        value = from_ISO8601(value)
+
+                    values[col_idx] = value
+
+            elif tag == row_tag:
+                yield row_idx, values
+                # Освобождаем уже разобранные строки
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+def collect_columns(row_cells, header_row):
+    """
+    Раскладывает значения листа по колонкам, не создавая строк целиком.
+
+    Args:
+        row_cells: Итератор (номер строки, {индекс колонки: значение}) (см. iter_sheet_cells)
+        header_row: Номер строки с заголовками (начиная с 1)
+
+    Returns:
+        tuple: (список (индекс колонки, заголовок) из строки заголовков,
+                словарь {индекс колонки: список значений} для непустых строк под заголовками)
+    """
+    header_cells = []
+    columns = {}
+
+    for row_idx, values in row_cells:
+        if row_idx < header_row:
+            continue
+
+        if row_idx == header_row:
+            header_cells = sorted(values.items())
+            columns = {col_idx: [] for col_idx, _ in header_cells}
+            continue
+
+        # Полностью пустые строки пропускаем
+        if not values:
+            continue
+
+        for col_idx, column in columns.items():
+            column.append(values.get(col_idx))
+
+    return header_cells, columns
+
+# Состояние процесса-обработчика при параллельном разборе листов
+_worker_state = {}
+
+def _init_sheet_worker(path, shared_strings, date_styles, epoch):
+    """
+    Открывает книгу в процессе-обработчике один раз (через mmap, см. open_mapped).
+    Общие строки и стили уже прочитаны основным процессом и передаются готовыми,
+    чтобы каждый обработчик не разбирал sharedStrings.xml заново.
+    """
+    _worker_state['archive'] = zipfile.ZipFile(open_mapped(path))
+    _worker_state['shared_strings'] = shared_strings
+    _worker_state['date_styles'] = date_styles
+    _worker_state['epoch'] = epoch
+
+def _parse_sheet_columns(path):
+    """
+    Разбирает лист в процессе-обработчике и возвращает его в компактном колоночном виде.
+
+    Returns:
+        tuple: (номер последней строки, {индекс колонки: (номера строк, значения)})
+    """
+    columns = {}
+    max_row = 0
+    for row_idx, values in iter_sheet_cells(
+        _worker_state['archive'],
+        path,
+        _worker_state['shared_strings'],
+        _worker_state['date_styles'],
+        _worker_state['epoch']
+    ):
+        max_row = row_idx
+        for col_idx, value in values.items():
+            column = columns.get(col_idx)
+            if column is None:
+                column = columns[col_idx] = ([], [])
+            column[0].append(row_idx)
+            column[1].append(value)
+    return max_row, columns
+
+class LazySheet:
+    """
+    Лист, загруженный в память в виде строк значений.
+    Поддерживает основные обращения в стиле openpyxl: max_row, max_column,
+    iter_rows(values_only=True) и sheet[номер_строки] с ячейками, у которых есть .value.
+    """
+
+    def __init__(self, title, rows):
+        self.title = title
+        self.max_column = max((len(row) for row in rows), default=0)
+        # Выравниваем строки по ширине листа, как это делает openpyxl
+        self._rows = [tuple(row) + (None,) * (self.max_column - len(row)) for row in rows]
+        self.max_row = len(self._rows)
+
+    @classmethod
+    def from_columns(cls, title, max_row, columns):
+        """Собирает лист из колоночного вида, который возвращает _parse_sheet_columns"""
+        width = max(columns) + 1 if columns else 0
+        rows = [[None] * width for _ in range(max_row)]
+        for col_idx, (row_numbers, values) in columns.items():
+            for row_idx, value in zip(row_numbers, values):
+                rows[row_idx - 1][col_idx] = value
+        return cls(title, rows)
+
+    @classmethod
+    def from_cells(cls, title, row_cells):
+        """Собирает лист из потока (номер строки, {индекс колонки: значение}) (см. iter_sheet_cells)"""
+        rows = []
+        for row_idx, values in row_cells:
+            # Пропущенные в файле строки заполняем пустыми, как openpyxl
+            while len(rows) < row_idx - 1:
+                rows.append(())
+            row = [None] * (max(values) + 1 if values else 0)
+            for col_idx, value in values.items():
+                row[col_idx] = value
+            rows.append(tuple(row))
+        return cls(title, rows)
+
+    def iter_rows(self, min_row=1, max_row=None, values_only=False):
+        """Возвращает строки листа с min_row по max_row (включительно)"""
+        if max_row is None or max_row > self.max_row:
+            max_row = self.max_row
+        for row in self._rows[max(min_row, 1) - 1:max_row]:
+            if values_only:
+                yield row
+            else:
+                yield tuple(ValueCell(value) for value in row)
+
+    @property
+    def values(self):
+        return self.iter_rows(values_only=True)
+
+    def __getitem__(self, row_idx):
+        if 1 <= row_idx <= self.max_row:
+            return tuple(ValueCell(value) for value in self._rows[row_idx - 1])
+        return tuple(ValueCell(None) for _ in range(self.max_column))
+
+class LazyWorkbook:
+    """
+    Книга Excel с ленивой загрузкой листов.
+    При создании читается только оглавление книги; лист разбирается при первом
+    обращении workbook[имя_листа] и затем хранится в кеше.
+    Файл, переданный путем, открывается через mmap (см. open_mapped).
+    """
+
+    def __init__(self, file, engine='openpyxl'):
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок чтения: {engine}. Доступны: {', '.join(ENGINES)}")
+        self.engine = engine
+        self._path = file if isinstance(file, (str, os.PathLike)) else None
+        if self._path is not None:
+            file = open_mapped(self._path)
+        self._file = file
+        archive = None
+        try:
+            archive = zipfile.ZipFile(file)
+            self._directory = read_sheet_directory(archive)
+        except Exception:
+            # Книга не открылась: закрываем архив и созданное самой книгой отображение файла
+            if archive is not None:
+                archive.close()
+            if self._path is not None:
+                file.close()
+            raise
+        self._archive = archive
+        self._sheets = {}
+        self._reader = None
+        self._shared_strings = None
+        self._date_styles = None
+        self._epoch = None
+
+    @property
+    def sheetnames(self):
+        return [info.name for info in self._directory]
+
+    @property
+    def sheet_directory(self):
+        return list(self._directory)
+
+    @property
+    def loaded_sheetnames(self):
+        """Имена листов, которые уже были разобраны"""
+        return list(self._sheets)
+
+    def get_sheet_info(self, sheet_name):
+        for info in self._directory:
+            if info.name == sheet_name:
+                return info
+        raise KeyError(f"Лист {sheet_name} не найден в книге")
+
+    def get_dimensions(self, sheet_name):
+        """
+        Возвращает размеры листа по оглавлению, не разбирая лист.
+
+        Returns:
+            tuple: (min_col, min_row, max_col, max_row) или None, если размеры не указаны в файле
+        """
+        dimension = self.get_sheet_info(sheet_name).dimension
+        if not dimension:
+            return None
+        if ':' not in dimension:
+            dimension = f"{dimension}:{dimension}"
+        return range_boundaries(dimension)
+
+    def _get_reader(self):
+        """Открывает потоковую книгу openpyxl, из которой разбираются листы"""
+        if self._reader is None:
+            if hasattr(self._file, 'seek'):
+                self._file.seek(0)
+            self._reader = openpyxl.load_workbook(self._file, read_only=True, data_only=True)
+        return self._reader
+
+    def _prepare_xml_engine(self):
+        """Готовит общие строки (читаются по мере обращения) и стили книги при первом разборе листа"""
+        if self._shared_strings is None:
+            self._shared_strings = SharedStrings(self._archive)
+            self._date_styles = read_date_styles(self._archive)
+            self._epoch = read_workbook_epoch(self._archive)
+
+    def _iter_cells(self, sheet_name):
+        self._prepare_xml_engine()
+        return iter_sheet_cells(
+            self._archive,
+            self.get_sheet_info(sheet_name).path,
+            self._shared_strings,
+            self._date_styles,
+            self._epoch
+        )
+
+    def _load_sheet(self, sheet_name):
+        if self.engine == 'xml':
+            return LazySheet.from_cells(sheet_name, self._iter_cells(sheet_name))
+
+        worksheet = self._get_reader()[sheet_name]
+        return LazySheet(sheet_name, list(worksheet.iter_rows(values_only=True)))
+
+    def head(self, sheet_name, max_rows):
+        """
+        Возвращает только первые max_rows строк листа. Если лист еще не разобран,
+        чтение XML листа прекращается сразу после строки max_rows.
+
+        Args:
+            sheet_name: Имя листа
+            max_rows: Число верхних строк
+
+        Returns:
+            LazySheet: Лист, содержащий только верхние строки
+        """
+        if sheet_name in self._sheets:
+            return LazySheet(sheet_name, list(self._sheets[sheet_name].iter_rows(max_row=max_rows, values_only=True)))
+
+        self.get_sheet_info(sheet_name)
+        if self.engine == 'xml':
+            cells = self._iter_cells(sheet_name)
+            try:
+                return LazySheet.from_cells(
+                    sheet_name,
+                    itertools.takewhile(lambda row_cells: row_cells[0] <= max_rows, cells)
+                )
+            finally:
+                cells.close()
+
+        worksheet = self._get_reader()[sheet_name]
+        return LazySheet(sheet_name, list(worksheet.iter_rows(max_row=max_rows, values_only=True)))
+
+    def _use_worker_pool(self, pending, workers):
+        """
+        Нужно ли разбирать листы в пуле процессов: обработчики открывают книгу сами по пути
+        к файлу, поэтому книга, переданная файловым объектом, небольшие листы
+        (см. PARALLEL_MIN_SHEET_BYTES) и машина с одним процессором обходятся без пула.
+        """
+        if not workers or min(workers, len(pending), os.cpu_count() or 1) <= 1 or self._path is None:
+            return False
+        sheet_bytes = sum(self._archive.getinfo(self.get_sheet_info(name).path).file_size for name in pending)
+        return sheet_bytes >= PARALLEL_MIN_SHEET_BYTES
+
+    def load_sheets(self, sheet_names=None, workers=None):
+        """
+        Разбирает сразу несколько листов и сохраняет их в кеш.
+        При workers > 1 листы книги, открытой по пути, разбираются параллельно в пуле процессов
+        (только движком 'xml'): каждый процесс сам открывает файл через mmap, разбирает лист
+        потоковым парсером XML и возвращает компактные колонки. Общие строки и стили читаются
+        один раз основным процессом. Небольшие листы (см. PARALLEL_MIN_SHEET_BYTES) и книги,
+        переданные файловым объектом, разбираются последовательно.
+
+        Args:
+            sheet_names: Имена листов (по умолчанию - все листы книги)
+            workers: Число процессов (None или 1 - последовательный разбор)
+
+        Returns:
+            list: Разобранные листы в порядке sheet_names
+
+        Raises:
+            ValueError: Если workers > 1 указано для движка 'openpyxl'
+        """
+        if workers and workers > 1 and self.engine != 'xml':
+            raise ValueError("Параллельный разбор листов поддерживается только движком 'xml'")
+
+        if sheet_names is None:
+            sheet_names = self.sheetnames
+        pending = [name for name in sheet_names if name not in self._sheets]
+
+        if self._use_worker_pool(pending, workers):
+            self._prepare_xml_engine()
+            paths = [self.get_sheet_info(name).path for name in pending]
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(pending), os.cpu_count()),
+                initializer=_init_sheet_worker,
+                initargs=(self._path, self._shared_strings.to_list(), self._date_styles, self._epoch)
+            ) as executor:
+                for sheet_name, (max_row, columns) in zip(pending, executor.map(_parse_sheet_columns, paths)):
+                    self._sheets[sheet_name] = LazySheet.from_columns(sheet_name, max_row, columns)
+
+        return [self[name] for name in sheet_names]
+
+    def read_columns(self, sheet_name, header_row):
+        """
+        Читает таблицу листа сразу в виде колонок (см. collect_columns).
+        Если лист еще не разобран и используется движок 'xml', значения берутся прямо
+        из потока XML без построения строк; иначе - из разобранного листа.
+
+        Args:
+            sheet_name: Имя листа
+            header_row: Номер строки с заголовками (начиная с 1)
+
+        Returns:
+            tuple: (список (индекс колонки, заголовок), словарь {индекс колонки: список значений})
+        """
+        if self.engine == 'xml' and sheet_name not in self._sheets:
+            self.get_sheet_info(sheet_name)
+            return collect_columns(self._iter_cells(sheet_name), header_row)
+
+        row_cells = (
+            (row_idx, {col_idx: value for col_idx, value in enumerate(row) if value is not None})
+            for row_idx, row in enumerate(self[sheet_name].iter_rows(values_only=True), start=1)
+        )
+        return collect_columns(row_cells, header_row)
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self._sheets:
+            self.get_sheet_info(sheet_name)
+            self._sheets[sheet_name] = self._load_sheet(sheet_name)
+        return self._sheets[sheet_name]
+
+    def __contains__(self, sheet_name):
+        return any(info.name == sheet_name for info in self._directory)
+
+    def __iter__(self):
+        for sheet_name in self.sheetnames:
+            yield self[sheet_name]
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if isinstance(self._shared_strings, SharedStrings):
+            self._shared_strings.close()
+        self._archive.close()
+        if self._path is not None:
+            # Отображение файла создано самой книгой
+            self._file.close()
+
+class WorkbookHead:
+    """
+    Верхние строки всех листов книги (см. LazyWorkbook.head).
+    Поддерживает те же обращения, что и книга (sheetnames, workbook[имя_листа]),
+    поэтому функции определения шаблона работают с ним без полного разбора листов.
+    """
+
+    def __init__(self, workbook, max_rows):
+        self.workbook = workbook
+        self.max_rows = max_rows
+        self._sheets = {}
+
+    @property
+    def sheetnames(self):
+        return self.workbook.sheetnames
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self._sheets:
+            self._sheets[sheet_name] = self.workbook.head(sheet_name, self.max_rows)
+        return self._sheets[sheet_name]
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self.workbook
+
+    def __iter__(self):
+        for sheet_name in self.sheetnames:
+            yield self[sheet_name]